@@ -5,6 +5,14 @@ from functools import lru_cache
 from typing import List
 
 
+def async_url(url: str) -> str:
+    # The same database through its async driver (asyncpg, aiosqlite).
+    scheme, rest = url.split("://", 1)
+    backend = scheme.split("+", 1)[0]
+    driver = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}.get(backend)
+    return f"{backend}+{driver}://{rest}" if driver else url
+
+
 class Settings:
     # Database
     DATABASE_URL_ENV: str | None = os.getenv("DATABASE_URL")
@@ -23,11 +31,51 @@ class Settings:
             f"@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
         )
 
+    # Connection pool (per engine and worker); DB_POOL_PRE_PING is always/idle/never
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT_SECONDS: float = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+    DB_POOL_RECYCLE_SECONDS: int = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+    DB_POOL_USE_LIFO: bool = os.getenv("DB_POOL_USE_LIFO", "true").lower() in ("1", "true", "yes")
+    DB_POOL_PRE_PING: str = os.getenv("DB_POOL_PRE_PING", "idle")
+    DB_POOL_PING_IDLE_SECONDS: float = float(os.getenv("DB_POOL_PING_IDLE_SECONDS", "30"))
+    DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+    # PgBouncer transaction pooling
+    DB_PGBOUNCER: bool = os.getenv("DB_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+
+    # sync or async
+    DB_MODE: str = os.getenv("DB_MODE", "sync")
+    ASYNC_DATABASE_URL_ENV: str | None = os.getenv("ASYNC_DATABASE_URL")
+
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        return self.ASYNC_DATABASE_URL_ENV or async_url(self.DATABASE_URL)
+
+    # Read replicas
+    DB_READ_REPLICA_URLS: List[str] = [u.strip() for u in os.getenv("DB_READ_REPLICA_URLS", "").split(",") if u.strip()]
+    DB_REPLICA_CHECK_SECONDS: float = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "5"))
+    DB_REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "0"))
+    DB_READ_YOUR_WRITES_SECONDS: float = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "10"))
+
     # Security / JWT
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY", "change-me-in-prod")
     JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 
+    # Password hashing
+    PBKDF2_ITERATIONS: int = int(os.getenv("PBKDF2_ITERATIONS", "200000"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PASSWORD_HASH_MAX_QUEUE: int = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+    PASSWORD_VERIFY_CACHE_SECONDS: float = float(os.getenv("PASSWORD_VERIFY_CACHE_SECONDS", "300"))
+    PASSWORD_VERIFY_CACHE_MAX_ENTRIES: int = int(os.getenv("PASSWORD_VERIFY_CACHE_MAX_ENTRIES", "10000"))
+
+    # Auth caches
+    AUTH_CACHE_TTL_SECONDS: float = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+    AUTH_CACHE_MAX_ENTRIES: int = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+    AUTH_TRUST_CLAIMS_SECONDS: int = int(os.getenv("AUTH_TRUST_CLAIMS_SECONDS", "0"))
+    ACL_CACHE_TTL_SECONDS: float = float(os.getenv("ACL_CACHE_TTL_SECONDS", "60"))
+    ACL_CACHE_MAX_ENTRIES: int = int(os.getenv("ACL_CACHE_MAX_ENTRIES", "10000"))
+
     # CORS
     CORS_ORIGINS: List[str] = [
         origin.strip()
@@ -35,6 +83,77 @@ class Settings:
         if origin.strip()
     ]
 
+    # Telemetry
+    TELEMETRY_ENABLED: bool = os.getenv("TELEMETRY_ENABLED", "true").lower() in ("1", "true", "yes")
+    TELEMETRY_SCRAPE_TOKEN: str | None = os.getenv("TELEMETRY_SCRAPE_TOKEN")
+    TELEMETRY_QUERY_WARN_THRESHOLD: int = int(os.getenv("TELEMETRY_QUERY_WARN_THRESHOLD", "50"))
+    # Sampling profiler
+    PROFILE_SLOW_REQUEST_MS: float = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+    PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", "1"))
+    PROFILE_INTERVAL_MS: float = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "profiles")
+
+    # Response cache
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    RESPONSE_CACHE_TTL_SECONDS: float = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+    RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+    # Live push; LIVE_BROKER is memory or postgres
+    LIVE_BROKER: str = os.getenv("LIVE_BROKER", "memory")
+    LIVE_PG_CHANNEL: str = os.getenv("LIVE_PG_CHANNEL", "dq_live")
+    LIVE_QUEUE_SIZE: int = int(os.getenv("LIVE_QUEUE_SIZE", "256"))
+    LIVE_MAX_POINTS: int = int(os.getenv("LIVE_MAX_POINTS", "1000"))
+    LIVE_HEARTBEAT_SECONDS: float = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "25"))
+
+    # Anomaly detection
+    ANOMALY_LOOKBACK_POINTS: int = int(os.getenv("ANOMALY_LOOKBACK_POINTS", "200"))
+    ANOMALY_ZSCORE_WINDOW: int = int(os.getenv("ANOMALY_ZSCORE_WINDOW", "30"))
+    ANOMALY_ZSCORE_THRESHOLD: float = float(os.getenv("ANOMALY_ZSCORE_THRESHOLD", "3"))
+    ANOMALY_EWMA_ALPHA: float = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.3"))
+    ANOMALY_EWMA_LIMIT: float = float(os.getenv("ANOMALY_EWMA_LIMIT", "3"))
+    ANOMALY_MIN_POINTS: int = int(os.getenv("ANOMALY_MIN_POINTS", "8"))
+    ANOMALY_CACHE_MAX_ENTRIES: int = int(os.getenv("ANOMALY_CACHE_MAX_ENTRIES", "10000"))
+    ANOMALY_CACHE_TTL_SECONDS: float = float(os.getenv("ANOMALY_CACHE_TTL_SECONDS", "3600"))
+
+    # Ingest
+    INGEST_CHUNK_SIZE: int = int(os.getenv("INGEST_CHUNK_SIZE", "5000"))
+    INGEST_MAX_CHUNK_SIZE: int = int(os.getenv("INGEST_MAX_CHUNK_SIZE", "50000"))
+    INGEST_STREAM_MAX_ERRORS: int = int(os.getenv("INGEST_STREAM_MAX_ERRORS", "1000"))
+    # Queued ingest; unset INGEST_QUEUE_PATH disables it
+    INGEST_QUEUE_PATH: str | None = os.getenv("INGEST_QUEUE_PATH")
+    INGEST_QUEUE_MAX_ROWS: int = int(os.getenv("INGEST_QUEUE_MAX_ROWS", "1000000"))
+    INGEST_QUEUE_FLUSH_ROWS: int = int(os.getenv("INGEST_QUEUE_FLUSH_ROWS", "50000"))
+    INGEST_QUEUE_FLUSH_SECONDS: float = float(os.getenv("INGEST_QUEUE_FLUSH_SECONDS", "0.5"))
+    INGEST_QUEUE_LEASE_SECONDS: float = float(os.getenv("INGEST_QUEUE_LEASE_SECONDS", "300"))
+    INGEST_QUEUE_RETENTION_SECONDS: float = float(os.getenv("INGEST_QUEUE_RETENTION_SECONDS", "86400"))
+
+    # Export
+    EXPORT_PAGE_SIZE: int = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+    EXPORT_MAX_PAGE_SIZE: int = int(os.getenv("EXPORT_MAX_PAGE_SIZE", "50000"))
+    EXPORT_STREAM_BATCH_SIZE: int = int(os.getenv("EXPORT_STREAM_BATCH_SIZE", "10000"))
+
+    # Retention and rollups (0 days = keep forever)
+    METRICS_RAW_RETENTION_DAYS: int = int(os.getenv("METRICS_RAW_RETENTION_DAYS", "0"))
+    METRICS_HOURLY_RETENTION_DAYS: int = int(os.getenv("METRICS_HOURLY_RETENTION_DAYS", "0"))
+    METRICS_ROLLUP_READS: bool = os.getenv("METRICS_ROLLUP_READS", "true").lower() in ("1", "true", "yes")
+    METRICS_PARTITIONING: bool = os.getenv("METRICS_PARTITIONING", "false").lower() in ("1", "true", "yes")
+    METRICS_PARTITION_INTERVAL: str = os.getenv("METRICS_PARTITION_INTERVAL", "month")
+    METRICS_PARTITION_PREMAKE: int = int(os.getenv("METRICS_PARTITION_PREMAKE", "3"))
+    METRICS_MAINTENANCE_INTERVAL_SECONDS: int = int(os.getenv("METRICS_MAINTENANCE_INTERVAL_SECONDS", "0"))
+
+    # Rule engine
+    RULES_TARGET_DATABASE_URL: str | None = os.getenv("RULES_TARGET_DATABASE_URL")
+    RULES_MAX_WORKERS: int = int(os.getenv("RULES_MAX_WORKERS", "8"))
+    RULES_PER_DATASET_CONCURRENCY: int = int(os.getenv("RULES_PER_DATASET_CONCURRENCY", "2"))
+    RULES_STATEMENT_TIMEOUT_SECONDS: float = float(os.getenv("RULES_STATEMENT_TIMEOUT_SECONDS", "300"))
+    RULES_CONCURRENT_RUNS: int = int(os.getenv("RULES_CONCURRENT_RUNS", "2"))
+    RULES_FUSE_CHECKS: bool = os.getenv("RULES_FUSE_CHECKS", "true").lower() in ("1", "true", "yes")
+    # Rule result cache (size 0 disables)
+    RULES_RESULT_CACHE_SIZE: int = int(os.getenv("RULES_RESULT_CACHE_SIZE", "1000"))
+    RULES_RESULT_CACHE_TTL_SECONDS: float = float(os.getenv("RULES_RESULT_CACHE_TTL_SECONDS", "86400"))
+    RULES_RESULT_CACHE_PATH: str | None = os.getenv("RULES_RESULT_CACHE_PATH")
+    RULES_TRACK_TABLE_CHANGES: bool = os.getenv("RULES_TRACK_TABLE_CHANGES", "false").lower() in ("1", "true", "yes")
+
     # Initial admin seed
     INITIAL_ADMIN_EMAIL: str = os.getenv("INITIAL_ADMIN_EMAIL", "admin@example.com")
     INITIAL_ADMIN_PASSWORD: str = os.getenv("INITIAL_ADMIN_PASSWORD", "admin123")
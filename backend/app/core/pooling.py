@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict
+from uuid import uuid4
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import NullPool, QueuePool
+
+from .config import get_settings
+
+
+PRE_PING_MODES = ("always", "idle", "never")
+
+# Engines by label ("primary", "async", ...) for pool stats and metrics.
+_engines: Dict[str, Engine] = {}
+_counters: Dict[str, Dict[str, int]] = {}
+_lock = threading.Lock()
+
+
+def _count(label: str, name: str) -> None:
+    with _lock:
+        counters = _counters.setdefault(label, {})
+        counters[name] = counters.get(name, 0) + 1
+
+
+def engine_options(url: str, is_async: bool = False) -> Dict[str, Any]:
+    # Keyword arguments for create_engine/create_async_engine from the DB_* settings.
+    settings = get_settings()
+    if settings.DB_POOL_PRE_PING not in PRE_PING_MODES:
+        raise ValueError(f"DB_POOL_PRE_PING must be one of {', '.join(PRE_PING_MODES)}")
+    options: Dict[str, Any] = {"pool_pre_ping": settings.DB_POOL_PRE_PING == "always"}
+    if settings.DB_POOL_SIZE <= 0:
+        options["poolclass"] = NullPool
+    elif ":memory:" not in url:
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+            pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+            pool_use_lifo=settings.DB_POOL_USE_LIFO,
+        )
+
+    connect_args: Dict[str, Any] = {}
+    backend = url.split("://", 1)[0]
+    timeout_ms = settings.DB_STATEMENT_TIMEOUT_MS
+    if backend.startswith("sqlite") and not is_async:
+        connect_args["check_same_thread"] = False
+    elif backend == "postgresql+asyncpg":
+        if settings.DB_PGBOUNCER:
+            # Transaction pooling hands each transaction to any server connection, so
+            # named prepared statements must be unique and never reused.
+            connect_args.update(
+                statement_cache_size=0,
+                prepared_statement_cache_size=0,
+                prepared_statement_name_func=lambda: f"__asyncpg_{uuid4()}__",
+            )
+        elif timeout_ms > 0:
+            connect_args["server_settings"] = {"statement_timeout": str(timeout_ms)}
+    elif backend.startswith("postgresql") and timeout_ms > 0 and not settings.DB_PGBOUNCER:
+        connect_args["options"] = f"-c statement_timeout={timeout_ms}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def _ping(dbapi_connection) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+    finally:
+        cursor.close()
+
+
+def statement_deadline_handler(info: Dict[str, Any]):
+    # SQLite progress handler enforcing info["statement_deadline"], if one is set.
+    return lambda: int(time.monotonic() > info.get("statement_deadline", float("inf")))
+
+
+def install_pool_hooks(engine: Engine, label: str) -> None:
+    settings = get_settings()
+    with _lock:
+        _engines[label] = engine
+        _counters.setdefault(label, {})
+
+    if settings.DB_POOL_PRE_PING == "idle":
+        # Ping only connections that sat in the pool past DB_POOL_PING_IDLE_SECONDS;
+        # a failed ping makes the pool discard the connection and take another.
+        idle_seconds = settings.DB_POOL_PING_IDLE_SECONDS
+
+        @event.listens_for(engine, "checkin")
+        def _checked_in(dbapi_connection, record) -> None:
+            record.info["checked_in_at"] = time.monotonic()
+
+        @event.listens_for(engine, "checkout")
+        def _checked_out(dbapi_connection, record, proxy) -> None:
+            checked_in_at = record.info.get("checked_in_at")
+            if checked_in_at is None or time.monotonic() - checked_in_at < idle_seconds:
+                return
+            _count(label, "pings")
+            try:
+                _ping(dbapi_connection)
+            except Exception as exc:
+                _count(label, "ping_failures")
+                raise DisconnectionError("Pooled connection failed its liveness check") from exc
+
+    timeout_ms = settings.DB_STATEMENT_TIMEOUT_MS
+    if timeout_ms <= 0:
+        return
+    if engine.dialect.name == "postgresql" and settings.DB_PGBOUNCER:
+        # No startup parameters through PgBouncer; scope the timeout to each transaction.
+        @event.listens_for(engine, "begin")
+        def _begin(conn) -> None:
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+    elif engine.dialect.name == "sqlite":
+        # SQLite has no statement timeout; interrupt from the progress handler instead.
+        # The deadline only covers execute() itself: it is cleared as soon as the
+        # statement returns or fails, so raw DBAPI work on the same connection and
+        # long yield_per fetches afterwards run unbounded.
+        @event.listens_for(engine, "connect")
+        def _connect(dbapi_connection, record) -> None:
+            if hasattr(dbapi_connection, "set_progress_handler"):
+                dbapi_connection.set_progress_handler(statement_deadline_handler(record.info), 10_000)
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _deadline(conn, cursor, statement, parameters, context, executemany) -> None:
+            conn.connection.info["statement_deadline"] = time.monotonic() + timeout_ms / 1000
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _clear_deadline(conn, cursor, statement, parameters, context, executemany) -> None:
+            conn.connection.info.pop("statement_deadline", None)
+
+        @event.listens_for(engine, "handle_error")
+        def _clear_deadline_on_error(exception_context) -> None:
+            conn = exception_context.connection
+            if conn is not None and not conn.invalidated:
+                conn.connection.info.pop("statement_deadline", None)
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    stats: Dict[str, Dict[str, Any]] = {}
+    with _lock:
+        engines = dict(_engines)
+        counters = {label: dict(values) for label, values in _counters.items()}
+    for label, engine in engines.items():
+        pool = engine.pool
+        entry: Dict[str, Any] = {"pool": type(pool).__name__, **counters.get(label, {})}
+        if isinstance(pool, QueuePool):
+            size = pool.size()
+            max_overflow = pool._max_overflow
+            checked_out = pool.checkedout()
+            capacity = size + max(max_overflow, 0)
+            entry.update(
+                size=size,
+                max_overflow=max_overflow,
+                checked_in=pool.checkedin(),
+                checked_out=checked_out,
+                overflow=pool.overflow(),
+                # Unbounded overflow (-1) has no meaningful utilization.
+                utilization=round(checked_out / capacity, 4) if capacity and max_overflow >= 0 else None,
+            )
+        stats[label] = entry
+    return stats
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.responses import Response
+
+from .config import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds a PostgreSQL standby is behind; 0 while it has replayed everything received.
+LAG_SQL = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Replica:
+    def __init__(self, label: str, url: str, engine: Engine) -> None:
+        self.label = label
+        self.url = url
+        self.engine = engine
+        self.healthy = False
+        self.checked_at: Optional[float] = None
+        self.lag_seconds: Optional[float] = None
+        self.reads = 0
+        self.failures = 0
+
+
+class ReplicaRouter:
+    # Round-robin over healthy replicas. A background thread re-checks every replica
+    # each DB_REPLICA_CHECK_SECONDS, so picking one never waits on a connection; until
+    # the first check has passed, reads use the primary.
+
+    def __init__(self, replicas: Sequence[Replica]) -> None:
+        self.replicas = list(replicas)
+        self.primary_reads = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        for replica in self.replicas:
+            self.watch(replica.engine, replica)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="replica-checks", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self.check_all()
+            self._stopping.wait(get_settings().DB_REPLICA_CHECK_SECONDS)
+
+    def watch(self, engine: Engine, replica: Replica) -> None:
+        # A dropped connection on any engine of the replica (sync or async) takes it
+        # out of rotation until its next check.
+        def handle_error(exception_context) -> None:
+            if exception_context.is_disconnect:
+                self.mark_down(replica)
+
+        event.listen(engine, "handle_error", handle_error)
+
+    def mark_down(self, replica: Replica) -> None:
+        with self._lock:
+            if replica.healthy:
+                logger.warning("Read replica %s marked unhealthy", replica.label)
+            replica.healthy = False
+            replica.failures += 1
+            replica.checked_at = time.monotonic()
+
+    def _check(self, replica: Replica) -> None:
+        settings = get_settings()
+        try:
+            with replica.engine.connect() as conn:
+                if settings.DB_REPLICA_MAX_LAG_SECONDS > 0 and conn.dialect.name == "postgresql":
+                    replica.lag_seconds = float(conn.exec_driver_sql(LAG_SQL).scalar() or 0.0)
+                    healthy = replica.lag_seconds <= settings.DB_REPLICA_MAX_LAG_SECONDS
+                else:
+                    conn.exec_driver_sql("SELECT 1")
+                    healthy = True
+        except Exception as exc:
+            logger.warning("Read replica %s failed its health check: %s", replica.label, exc)
+            healthy = False
+        with self._lock:
+            if not healthy:
+                replica.failures += 1
+            replica.healthy = healthy
+            replica.checked_at = time.monotonic()
+
+    def check_all(self) -> None:
+        for replica in self.replicas:
+            self._check(replica)
+
+    def choose(self) -> Optional[Replica]:
+        # None means "read from the primary".
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            if not healthy:
+                self.primary_reads += 1
+                return None
+            replica = healthy[self._next % len(healthy)]
+            self._next += 1
+            replica.reads += 1
+            return replica
+
+    def count_primary_read(self) -> None:
+        with self._lock:
+            self.primary_reads += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "primary_reads": self.primary_reads,
+                "replicas": [
+                    {
+                        "label": replica.label,
+                        "healthy": replica.healthy,
+                        "lag_seconds": replica.lag_seconds,
+                        "reads": replica.reads,
+                        "failures": replica.failures,
+                    }
+                    for replica in self.replicas
+                ],
+            }
+
+
+# Read-your-writes travels with the client rather than living in one worker: a write
+# response carries its commit time in this header, and a read that sends it back is
+# served by the primary while that time is within DB_READ_YOUR_WRITES_SECONDS.
+READ_AFTER_HEADER = "X-Read-After"
+
+
+def pin_to_primary(response: Response) -> None:
+    if get_settings().DB_READ_YOUR_WRITES_SECONDS > 0:
+        response.headers[READ_AFTER_HEADER] = f"{time.time():.3f}"
+
+
+def pinned_to_primary(token: Optional[str]) -> bool:
+    if not token:
+        return False
+    try:
+        written_at = float(token)
+    except ValueError:
+        return False
+    return time.time() - written_at < get_settings().DB_READ_YOUR_WRITES_SECONDS
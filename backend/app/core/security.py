@@ -1,19 +1,24 @@
 from __future__ import annotations
 
+import asyncio
 import base64
 import hashlib
 import hmac
+import multiprocessing
 import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional, TypeVar
 
 import jwt
 
+from .cache import TTLCache, register_cache
 from .config import get_settings
 
 
 PBKDF2_ALGORITHM = "sha256"
-PBKDF2_ITERATIONS = 200_000
+PBKDF2_ITERATIONS = get_settings().PBKDF2_ITERATIONS
 PBKDF2_SALT_BYTES = 16
 
 
@@ -25,12 +30,13 @@ def _b64decode(data: str) -> bytes:
     return base64.b64decode(data.encode("utf-8"))
 
 
-def hash_password(plain_password: str) -> str:
+def hash_password(plain_password: str, iterations: Optional[int] = None) -> str:
+    iterations = iterations or PBKDF2_ITERATIONS
     salt = os.urandom(PBKDF2_SALT_BYTES)
     dk = hashlib.pbkdf2_hmac(
-        PBKDF2_ALGORITHM, plain_password.encode("utf-8"), salt, PBKDF2_ITERATIONS
+        PBKDF2_ALGORITHM, plain_password.encode("utf-8"), salt, iterations
     )
-    return f"pbkdf2_{PBKDF2_ALGORITHM}${PBKDF2_ITERATIONS}${_b64encode(salt)}${_b64encode(dk)}"
+    return f"pbkdf2_{PBKDF2_ALGORITHM}${iterations}${_b64encode(salt)}${_b64encode(dk)}"
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -48,6 +54,109 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return hmac.compare_digest(candidate, expected)
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    try:
+        scheme, iter_str, _, _ = hashed_password.split("$")
+        return scheme != f"pbkdf2_{PBKDF2_ALGORITHM}" or int(iter_str) != PBKDF2_ITERATIONS
+    except ValueError:
+        return True
+
+
+T = TypeVar("T")
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHashPool:
+    # Runs PBKDF2 in a dedicated process pool so logins cannot starve the request
+    # threadpool. Concurrency is bounded by the pool size; callers beyond
+    # workers + max_queue are rejected instead of piling up.
+
+    def __init__(self, workers: int, max_queue: int) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> Optional[Executor]:
+        if self.workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        limit = max(self.workers, 1) + self.max_queue
+        with self._lock:
+            if self.in_flight >= limit:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+            self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "queue_depth": max(0, self.in_flight - max(self.workers, 1)),
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+password_hasher = PasswordHashPool(
+    workers=get_settings().PASSWORD_HASH_WORKERS, max_queue=get_settings().PASSWORD_HASH_MAX_QUEUE
+)
+
+
+async def hash_password_async(plain_password: str) -> str:
+    return await password_hasher.run(hash_password, plain_password)
+
+
+_verify_key = os.urandom(32)
+_verified: TTLCache[bool] = register_cache(
+    "password_verify",
+    TTLCache(maxsize=get_settings().PASSWORD_VERIFY_CACHE_MAX_ENTRIES, ttl=get_settings().PASSWORD_VERIFY_CACHE_SECONDS),
+)
+
+
+def _verify_cache_key(plain_password: str, hashed_password: str) -> bytes:
+    # A changed password or rehash changes the stored hash, so old entries just miss.
+    message = hashed_password.encode("utf-8") + b"\0" + plain_password.encode("utf-8")
+    return hmac.new(_verify_key, message, hashlib.sha256).digest()
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    key = _verify_cache_key(plain_password, hashed_password)
+    if _verified.get(key):
+        return True
+    verified = await password_hasher.run(verify_password, plain_password, hashed_password)
+    if verified:
+        _verified.set(key, True)
+    return verified
+
+
 def create_access_token(subject: str, expires_minutes: Optional[int] = None, extra: Optional[Dict[str, Any]] = None) -> str:
     settings = get_settings()
     expire_delta = timedelta(minutes=expires_minutes or settings.ACCESS_TOKEN_EXPIRE_MINUTES)
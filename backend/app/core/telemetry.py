@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from .cache import cache_stats
+from .config import get_settings
+from .pooling import pool_stats
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+POOL_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    # Cumulative-bucket histogram per label combination, in Prometheus exposition format.
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            # Per-bucket counts, then sum and count.
+            series = self._series.setdefault(label_values, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((key, list(values)) for key, values in self._series.items())
+        for label_values, series in snapshot:
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-2] + series[-1:]):
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, label_values, le)} {count:g}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {series[-1]:g}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), kind: str = "counter") -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.kind = kind
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.labels, key)} {value:g}" for key, value in snapshot)
+        return lines
+
+
+request_duration = Histogram(
+    "dq_http_request_duration_seconds", "Request latency by route template.", LATENCY_BUCKETS, ("method", "route", "status")
+)
+request_queries = Histogram(
+    "dq_http_request_sql_statements", "SQL statements executed per request.", QUERY_BUCKETS, ("method", "route")
+)
+request_sql_seconds = Histogram(
+    "dq_http_request_sql_seconds", "Time spent executing SQL per request.", LATENCY_BUCKETS, ("method", "route")
+)
+request_pool_wait = Histogram(
+    "dq_http_request_pool_wait_seconds", "Time spent waiting for pooled connections per request.", POOL_BUCKETS, ("method", "route")
+)
+pool_checkout = Histogram("dq_db_pool_checkout_seconds", "Time to obtain a connection from the pool.", POOL_BUCKETS, ("engine",))
+pool_timeouts = CounterMetric("dq_db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT_SECONDS.", ("engine",))
+sql_statements = CounterMetric("dq_sql_statements_total", "SQL statements executed.", ("context",))
+sql_seconds = CounterMetric("dq_sql_seconds_total", "Time spent executing SQL.", ("context",))
+requests_in_flight = CounterMetric("dq_http_requests_in_flight", "Requests currently being served.", kind="gauge")
+slow_profiles = CounterMetric("dq_slow_request_profiles_total", "Profiles written for slow requests.")
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    sql_seconds: float = 0.0
+    pool_wait_seconds: float = 0.0
+
+
+# Set by the middleware; the threadpool and run_sync greenlets inherit it, so SQL run
+# on behalf of a request is charged to it. Background work sees None.
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("telemetry_started", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = conn.info.get("telemetry_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats = current_request.get()
+    context_label = "request" if stats is not None else "background"
+    sql_statements.inc(1, context_label)
+    sql_seconds.inc(elapsed, context_label)
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_seconds += elapsed
+
+
+def _handle_error(exception_context) -> None:
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("telemetry_started"):
+        conn.info["telemetry_started"].pop()
+
+
+def _time_pool(engine: Engine, label: str) -> None:
+    # Pools have no "checkout started" event, so the pool's connect() is wrapped.
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        except PoolTimeoutError:
+            pool_timeouts.inc(1, label)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            pool_checkout.observe(elapsed, label)
+            stats = current_request.get()
+            if stats is not None:
+                stats.pool_wait_seconds += elapsed
+
+    pool.connect = timed_connect
+
+
+def instrument_engine(engine: Engine, label: str = "primary") -> None:
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    _time_pool(engine, label)
+    # dispose() swaps in a fresh pool.
+    event.listen(engine, "engine_disposed", lambda target: _time_pool(target, label))
+
+
+class SlowRequestProfiler:
+    # Wall-clock sampling profiler. While at least one sampled request is in flight, a
+    # background thread snapshots every thread's stack each interval; requests that end
+    # up slower than the threshold get the samples written as folded stacks (one
+    # "frame;frame;frame count" line per stack, for flamegraph.pl or speedscope). All
+    # busy threads are sampled, so concurrent requests show up in each other's profiles;
+    # threads parked in a wait are skipped.
+
+    _IDLE = re.compile(r"(threading|selectors|queue)\.py$|concurrent[\\/]futures[\\/]thread\.py$")
+
+    def __init__(self) -> None:
+        self._active: List[Counter] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self) -> Counter:
+        samples: Counter = Counter()
+        with self._lock:
+            self._active.append(samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+                self._thread.start()
+        return samples
+
+    def end(self, samples: Counter) -> None:
+        with self._lock:
+            self._active.remove(samples)
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                active = list(self._active)
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me or self._IDLE.search(frame.f_code.co_filename):
+                    continue
+                stacks.append(";".join(reversed(list(self._frames(frame)))))
+            for samples in active:
+                samples.update(stacks)
+            time.sleep(get_settings().PROFILE_INTERVAL_MS / 1000)
+
+    @staticmethod
+    def _frames(frame) -> Iterable[str]:
+        while frame is not None:
+            code = frame.f_code
+            yield f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+            frame = frame.f_back
+
+    def dump(self, samples: Counter, method: str, route: str, elapsed: float) -> Optional[str]:
+        directory = get_settings().PROFILE_DIR
+        if not samples:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        path = os.path.join(directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{method}-{slug}-{int(elapsed * 1000)}ms.folded")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+        slow_profiles.inc()
+        return path
+
+
+profiler = SlowRequestProfiler()
+
+
+class TelemetryMiddleware:
+    # Pure ASGI, so streamed bodies are timed to their last chunk. The route label is
+    # the matched path template ("unmatched" otherwise) to keep label cardinality fixed.
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        settings = get_settings()
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        samples = None
+        if settings.PROFILE_SLOW_REQUEST_MS > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+            samples = profiler.begin()
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.inc(1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.inc(-1)
+            current_request.reset(token)
+            if samples is not None:
+                profiler.end(samples)
+            method = scope["method"]
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            request_duration.observe(elapsed, method, route, str(status))
+            request_queries.observe(stats.queries, method, route)
+            request_sql_seconds.observe(stats.sql_seconds, method, route)
+            request_pool_wait.observe(stats.pool_wait_seconds, method, route)
+            threshold = settings.TELEMETRY_QUERY_WARN_THRESHOLD
+            if threshold > 0 and stats.queries > threshold:
+                logger.warning(
+                    "%s %s ran %d SQL statements (%.1f ms in SQL); possible N+1 query pattern",
+                    method, route, stats.queries, stats.sql_seconds * 1000,
+                )
+            if samples is not None and elapsed * 1000 >= settings.PROFILE_SLOW_REQUEST_MS:
+                try:
+                    path = profiler.dump(samples, method, route, elapsed)
+                    if path:
+                        logger.warning("%s %s took %.0f ms; profile written to %s", method, route, elapsed * 1000, path)
+                except OSError:
+                    logger.exception("Could not write request profile")
+
+
+def _cache_metrics() -> List[str]:
+    stats = cache_stats()
+    lines = []
+    for field, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("size", "gauge")):
+        name = f"dq_cache_{field}_total" if kind == "counter" else f"dq_cache_{field}"
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f'{name}{{cache="{_escape(cache)}"}} {values.get(field, 0)}' for cache, values in sorted(stats.items()))
+    return lines
+
+
+def _pool_metrics() -> List[str]:
+    # Gauges read from the pools at scrape time; NullPool engines only report ping counts.
+    stats = pool_stats()
+    lines: List[str] = []
+    for field in ("size", "max_overflow", "checked_out", "checked_in", "overflow", "utilization"):
+        name = f"dq_db_pool_{field}"
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(
+            f'{name}{{engine="{_escape(label)}"}} {values[field]:g}'
+            for label, values in sorted(stats.items())
+            if values.get(field) is not None
+        )
+    for field in ("pings", "ping_failures"):
+        name = f"dq_db_pool_{field}_total"
+        lines.append(f"# TYPE {name} counter")
+        lines.extend(f'{name}{{engine="{_escape(label)}"}} {values.get(field, 0)}' for label, values in sorted(stats.items()))
+    return lines
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in (
+        request_duration,
+        request_queries,
+        request_sql_seconds,
+        request_pool_wait,
+        pool_checkout,
+        pool_timeouts,
+        sql_statements,
+        sql_seconds,
+        requests_in_flight,
+        slow_profiles,
+    ):
+        lines.extend(metric.render())
+    lines.extend(_cache_metrics())
+    lines.extend(_pool_metrics())
+    return "\n".join(lines) + "\n"
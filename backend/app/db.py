@@ -1,20 +1,40 @@
 from __future__ import annotations
 
 from contextlib import contextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Optional
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 
-from .core.config import get_settings
+from .core.config import async_url, get_settings
+from .core.pooling import engine_options, install_pool_hooks
+from .core.replicas import Replica, ReplicaRouter
+from .core.telemetry import instrument_engine
 
 
 settings = get_settings()
 
-# Enable SQLite-friendly connection args for local testing
-connect_args = {}
-if settings.DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
 
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True, connect_args=connect_args)
+def _create_engine(url: str, label: str) -> Engine:
+    new_engine = create_engine(url, **engine_options(url))
+    install_pool_hooks(new_engine, label)
+    if settings.TELEMETRY_ENABLED:
+        instrument_engine(new_engine, label)
+    return new_engine
+
+
+def _create_async_engine(url: str, label: str) -> AsyncEngine:
+    new_engine = create_async_engine(url, **engine_options(url, is_async=True))
+    install_pool_hooks(new_engine.sync_engine, label)
+    if settings.TELEMETRY_ENABLED:
+        instrument_engine(new_engine.sync_engine, label)
+    return new_engine
+
+
+engine = _create_engine(settings.DATABASE_URL, "primary")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -37,3 +57,66 @@ def get_db() -> Session:
         yield db
     finally:
         db.close()
+
+
+# Async stack, created on first use so the async drivers stay optional in sync mode.
+@lru_cache(maxsize=1)
+def get_async_engine() -> AsyncEngine:
+    return _create_async_engine(settings.ASYNC_DATABASE_URL, "async")
+
+
+@lru_cache(maxsize=1)
+def get_async_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(bind=get_async_engine(), autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
+# Read replicas (DB_READ_REPLICA_URLS). Only GET endpoints of the metrics and datasets
+# routers read through these; every write and auth lookup stays on `engine`.
+@lru_cache(maxsize=1)
+def get_replica_router() -> Optional[ReplicaRouter]:
+    if not settings.DB_READ_REPLICA_URLS:
+        return None
+    router = ReplicaRouter([
+        Replica(f"replica-{i}", url, _create_engine(url, f"replica-{i}"))
+        for i, url in enumerate(settings.DB_READ_REPLICA_URLS)
+    ])
+    router.start()
+    return router
+
+
+@lru_cache(maxsize=None)
+def _async_replica_engine(replica: Replica) -> AsyncEngine:
+    async_engine = _create_async_engine(async_url(replica.url), f"{replica.label}-async")
+    get_replica_router().watch(async_engine.sync_engine, replica)
+    return async_engine
+
+
+def _read_replica(primary: bool) -> Optional[Replica]:
+    router = get_replica_router()
+    if router is None:
+        return None
+    if primary:
+        router.count_primary_read()
+        return None
+    return router.choose()
+
+
+# Replica sessions are tagged in Session.info so callers can tell possibly stale reads
+# apart (the ACL caches in deps.py never keep them).
+def read_session(primary: bool = False) -> Session:
+    replica = _read_replica(primary)
+    if replica is None:
+        return SessionLocal()
+    return SessionLocal(bind=replica.engine, info={"replica": replica.label})
+
+
+async def async_read_session(primary: bool = False) -> AsyncSession:
+    replica = _read_replica(primary)
+    if replica is None:
+        return get_async_sessionmaker()()
+    return get_async_sessionmaker()(bind=_async_replica_engine(replica), info={"replica": replica.label})
@@ -1,23 +1,66 @@
 from __future__ import annotations
 
-from typing import Generator, Optional
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, FrozenSet, Generator, Iterable, List, Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .db import get_db
+from .db import async_read_session, get_async_db, get_db, read_session
+from .core.cache import TTLCache, register_cache
+from .core.config import get_settings
+from .core.replicas import READ_AFTER_HEADER, pinned_to_primary
 from .core.security import decode_token
-from .models import User, UserDatasetAccess
+from .models import Dataset, User, UserDatasetAccess
 
 
 bearer_scheme = HTTPBearer(auto_error=False)
 
 
-def get_current_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
-    db: Session = Depends(get_db),
-) -> User:
+@dataclass(frozen=True)
+class Principal:
+    # The subset of User needed for authorization; safe to cache across sessions.
+    id: int
+    email: str
+    is_admin: bool
+    is_active: bool = True
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, email=user.email, is_admin=user.is_admin, is_active=user.is_active)
+
+
+_settings = get_settings()
+principal_cache: TTLCache[Principal] = register_cache(
+    "auth_principals", TTLCache(maxsize=_settings.AUTH_CACHE_MAX_ENTRIES, ttl=_settings.AUTH_CACHE_TTL_SECONDS)
+)
+
+# Dataset ids each user was granted, keyed by user id, and the set of active datasets.
+acl_cache: TTLCache[FrozenSet[int]] = register_cache(
+    "dataset_acl", TTLCache(maxsize=_settings.ACL_CACHE_MAX_ENTRIES, ttl=_settings.ACL_CACHE_TTL_SECONDS)
+)
+active_datasets_cache: TTLCache[FrozenSet[int]] = register_cache(
+    "active_datasets", TTLCache(maxsize=1, ttl=_settings.ACL_CACHE_TTL_SECONDS)
+)
+
+
+def invalidate_principal(email: str) -> None:
+    principal_cache.invalidate(email)
+
+
+def _principal_from_claims(payload: Dict[str, Any]) -> Optional[Principal]:
+    window = get_settings().AUTH_TRUST_CLAIMS_SECONDS
+    if window <= 0 or "uid" not in payload or "is_admin" not in payload:
+        return None
+    if time.time() - float(payload.get("iat", 0)) > window:
+        return None
+    return Principal(id=int(payload["uid"]), email=payload["sub"], is_admin=bool(payload["is_admin"]))
+
+
+def _token_payload(credentials: Optional[HTTPAuthorizationCredentials]) -> Dict[str, Any]:
     if credentials is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
     try:
@@ -27,26 +70,125 @@ def get_current_user(
             raise ValueError
     except Exception:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return payload
 
+
+def _load_principal(db: Session, subject: str) -> Principal:
     user = db.query(User).filter(User.email == subject).first()
     if not user or not user.is_active:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Inactive or missing user")
+    principal = Principal.from_user(user)
+    principal_cache.set(subject, principal)
+    return principal
+
+
+def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    db: Session = Depends(get_db),
+) -> Principal:
+    payload = _token_payload(credentials)
+    principal = _principal_from_claims(payload) or principal_cache.get(payload["sub"])
+    if principal is not None:
+        return principal
+    return _load_principal(db, payload["sub"])
+
+
+async def get_current_user_async(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    db: AsyncSession = Depends(get_async_db),
+) -> Principal:
+    payload = _token_payload(credentials)
+    principal = _principal_from_claims(payload) or principal_cache.get(payload["sub"])
+    if principal is not None:
+        return principal
+    return await db.run_sync(_load_principal, payload["sub"])
+
+
+def _reads_primary(request: Request) -> bool:
+    if request.headers.get("x-read-consistency", "").lower() == "primary":
+        return True
+    return pinned_to_primary(request.headers.get(READ_AFTER_HEADER))
+
+
+def get_read_db(request: Request, current: Principal = Depends(get_current_user)) -> Generator[Session, None, None]:
+    # A replica session when replicas are configured, unless the caller asked for the
+    # primary or sent back a recent X-Read-After from one of its writes.
+    db = read_session(_reads_primary(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request, current: Principal = Depends(get_current_user_async)) -> AsyncIterator[AsyncSession]:
+    async with await async_read_session(_reads_primary(request)) as db:
+        yield db
+
+
+def get_current_admin(user: Principal = Depends(get_current_user)) -> Principal:
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
     return user
 
 
-def get_current_admin(user: User = Depends(get_current_user)) -> User:
+async def get_current_admin_async(user: Principal = Depends(get_current_user_async)) -> Principal:
     if not user.is_admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
     return user
 
 
-def ensure_dataset_access(dataset_id: int, user: User, db: Session) -> None:
+def invalidate_dataset_access(user_id: Optional[int] = None) -> None:
+    if user_id is None:
+        acl_cache.clear()
+    else:
+        acl_cache.invalidate(user_id)
+
+
+def invalidate_active_datasets() -> None:
+    active_datasets_cache.clear()
+
+
+# A lagging replica can still return what an invalidation just dropped, so only reads
+# from the primary refill these caches; replica reads answer their own request only.
+def accessible_dataset_ids(user: Principal, db: Session) -> FrozenSet[int]:
+    ids = acl_cache.get(user.id)
+    if ids is None:
+        rows = db.query(UserDatasetAccess.dataset_id).filter(UserDatasetAccess.user_id == user.id).all()
+        ids = frozenset(ds_id for (ds_id,) in rows)
+        if "replica" not in db.info:
+            acl_cache.set(user.id, ids)
+    return ids
+
+
+def active_dataset_ids(db: Session) -> FrozenSet[int]:
+    ids = active_datasets_cache.get("active")
+    if ids is None:
+        ids = frozenset(ds_id for (ds_id,) in db.query(Dataset.id).filter(Dataset.is_active == True).all())
+        if "replica" not in db.info:
+            active_datasets_cache.set("active", ids)
+    return ids
+
+
+def has_dataset_access(dataset_id: int, user: Principal, db: Session) -> bool:
+    if user.is_admin:
+        return True
+    return dataset_id in accessible_dataset_ids(user, db)
+
+
+def ensure_dataset_access(dataset_id: int, user: Principal, db: Session) -> None:
+    if not has_dataset_access(dataset_id, user, db):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No access to dataset")
+
+
+def ensure_datasets_access(dataset_ids: Iterable[int], user: Principal, db: Session) -> None:
     if user.is_admin:
         return
-    access = (
-        db.query(UserDatasetAccess)
-        .filter(UserDatasetAccess.user_id == user.id, UserDatasetAccess.dataset_id == dataset_id)
-        .first()
-    )
-    if not access:
+    if not set(dataset_ids) <= accessible_dataset_ids(user, db):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No access to dataset")
+
+
+def visible_dataset_ids(user: Principal, db: Session) -> List[int]:
+    active = active_dataset_ids(db)
+    if user.is_admin:
+        return sorted(active)
+    return sorted(accessible_dataset_ids(user, db) & active)
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+# Synthetic load for benchmarks: datasets, users with dataset ACLs and metric history.
+#
+#   python -m app.generate_data --datasets 10 --users 50 --series-per-dataset 20 --days 30
+#   python -m app.generate_data --datasets 200 --series-per-dataset 50 --days 365 --cadences 300,900
+#
+# Rows per series are days * 86400 / cadence, so the second line writes ~640M points.
+# Each series reports on its own cadence with jittered timestamps; values are quality
+# ratios around a per-series level with a daily cycle, noise and occasional incidents
+# (a drop lasting a few hours). The same --seed always produces the same data.
+
+import argparse
+import csv
+import io
+import json
+import math
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+from sqlalchemy import insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .core.config import get_settings
+from .core.security import hash_password
+from .db import SessionLocal, engine
+from .models import Base, Dataset, DimensionEnum, MetricRecord, User, UserDatasetAccess
+from .rebuild_latest import rebuild_latest_metrics
+from .services import partitions
+from .services.ingest import RECORD_COLUMNS
+from .services.rollups import mark_dirty
+from .services.series import series_catalog, series_key
+from .services.versions import bump_versions
+
+
+@dataclass
+class GenerateOptions:
+    datasets: int = 10
+    users: int = 50
+    datasets_per_user: int = 3
+    series_per_dataset: int = 20
+    days: float = 30
+    cadences: Tuple[int, ...] = (300, 900, 3600, 86400)
+    seed: int = 42
+    prefix: str = "load"
+    password: str = "loadtest123"
+    chunk_rows: int = 100_000
+
+
+@dataclass
+class SeriesModel:
+    # Parallel per-series parameters.
+    ids: np.ndarray
+    cadence: np.ndarray
+    phase: np.ndarray
+    level: np.ndarray
+    amplitude: np.ndarray
+    cycle_offset: np.ndarray
+    noise: np.ndarray
+    # Incidents as (series index, start epoch, end epoch, drop).
+    incidents: np.ndarray
+
+
+def _ensure_datasets(db: Session, options: GenerateOptions) -> List[int]:
+    keys = [f"{options.prefix}_{i:05d}" for i in range(options.datasets)]
+    existing = {key: ds_id for key, ds_id in db.execute(select(Dataset.key, Dataset.id).where(Dataset.key.in_(keys)))}
+    db.add_all(
+        Dataset(key=key, name=f"Load dataset {i}", description="Synthetic benchmark data")
+        for i, key in enumerate(keys)
+        if key not in existing
+    )
+    db.flush()
+    existing.update(db.execute(select(Dataset.key, Dataset.id).where(Dataset.key.in_(keys))).all())
+    return [existing[key] for key in keys]
+
+
+def _ensure_users(db: Session, options: GenerateOptions, dataset_ids: List[int], rng: np.random.Generator) -> List[int]:
+    # One hash for everyone: PBKDF2 per user would dominate small runs.
+    emails = [f"{options.prefix}_user_{i:05d}@example.com" for i in range(options.users)]
+    existing = {email: user_id for email, user_id in db.execute(select(User.email, User.id).where(User.email.in_(emails)))}
+    hashed = hash_password(options.password)
+    db.add_all(
+        User(email=email, full_name=f"Load user {i}", hashed_password=hashed, is_active=True, is_admin=False)
+        for i, email in enumerate(emails)
+        if email not in existing
+    )
+    db.flush()
+    existing.update(db.execute(select(User.email, User.id).where(User.email.in_(emails))).all())
+    user_ids = [existing[email] for email in emails]
+
+    granted = set(db.execute(
+        select(UserDatasetAccess.user_id, UserDatasetAccess.dataset_id).where(UserDatasetAccess.user_id.in_(user_ids))
+    ).all())
+    per_user = min(options.datasets_per_user, len(dataset_ids))
+    grants = []
+    for user_id in user_ids:
+        for index in rng.choice(len(dataset_ids), size=per_user, replace=False).tolist():
+            if (user_id, dataset_ids[index]) not in granted:
+                grants.append({"user_id": user_id, "dataset_id": dataset_ids[index]})
+    if grants:
+        db.execute(insert(UserDatasetAccess), grants)
+    return user_ids
+
+
+def _series_model(db: Session, options: GenerateOptions, dataset_ids: List[int], start: float, end: float, rng: np.random.Generator) -> SeriesModel:
+    dims = list(DimensionEnum)
+    keys = [
+        series_key(ds_id, dims[j % len(dims)], f"{dims[j % len(dims)].value}_check_{j // len(dims)}")
+        for ds_id in dataset_ids
+        for j in range(options.series_per_dataset)
+    ]
+    resolved = series_catalog.resolve(db, keys)
+    n = len(keys)
+    cadence = rng.choice(np.array(options.cadences, dtype=np.float64), size=n)
+    incidents = []
+    span_days = (end - start) / 86400
+    # About one incident per series per 20 days, lasting 1-12 hours.
+    for index in range(n):
+        for _ in range(rng.poisson(span_days / 20)):
+            begin = rng.uniform(start, end)
+            incidents.append((index, begin, begin + rng.uniform(3600, 12 * 3600), rng.uniform(0.05, 0.4)))
+    return SeriesModel(
+        ids=np.array([resolved[key] for key in keys], dtype=np.int64),
+        cadence=cadence,
+        phase=rng.uniform(0, 1, size=n) * cadence,
+        level=rng.beta(40, 1.5, size=n),
+        amplitude=rng.uniform(0, 0.02, size=n),
+        cycle_offset=rng.uniform(0, 2 * math.pi, size=n),
+        noise=rng.uniform(0.001, 0.02, size=n),
+        incidents=np.array(incidents, dtype=np.float64).reshape(-1, 4),
+    )
+
+
+def _slab(model: SeriesModel, start: float, slab_start: float, slab_end: float, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Every series' points with nominal time in [slab_start, slab_end), in time order.
+    first = np.ceil((slab_start - start - model.phase) / model.cadence).astype(np.int64)
+    stop = np.ceil((slab_end - start - model.phase) / model.cadence).astype(np.int64)
+    first = np.maximum(first, 0)
+    counts = np.maximum(stop - first, 0)
+    total = int(counts.sum())
+    if not total:
+        empty = np.zeros(0)
+        return empty.astype(np.int64), empty, empty
+    index = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    cadence = model.cadence[index]
+    times = start + model.phase[index] + (first[index] + offsets) * cadence
+    # Reporting jitter of up to 5% of the cadence, capped at a minute.
+    times += rng.uniform(0, np.minimum(0.05 * cadence, 60.0))
+    values = (
+        model.level[index]
+        + model.amplitude[index] * np.sin(2 * math.pi * times / 86400 + model.cycle_offset[index])
+        + rng.normal(0, 1, size=total) * model.noise[index]
+    )
+    active = model.incidents[(model.incidents[:, 2] > slab_start) & (model.incidents[:, 1] < slab_end)]
+    for series_index, begin, end, drop in active:
+        hit = (index == int(series_index)) & (times >= begin) & (times < end)
+        values[hit] -= drop
+    np.clip(values, 0.0, 1.0, out=values)
+    order = np.argsort(times, kind="stable")
+    return model.ids[index][order], values[order], times[order]
+
+
+def _timestamps(epochs: np.ndarray, sep: str) -> List[str]:
+    # Naive UTC, as the ingest path stores it.
+    stamps = np.datetime_as_string((epochs * 1_000_000).astype(np.int64).astype("datetime64[us]"), unit="us")
+    if sep != "T":
+        stamps = np.char.replace(stamps, "T", sep)
+    return stamps.tolist()
+
+
+def _write_chunk(target: Engine, series_ids: np.ndarray, values: np.ndarray, epochs: np.ndarray) -> None:
+    dialect = target.dialect
+    if dialect.driver == "psycopg2":
+        buf = io.StringIO()
+        csv.writer(buf).writerows(zip(series_ids.tolist(), values.tolist(), _timestamps(epochs, "T")))
+        buf.seek(0)
+        conn = target.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.copy_expert(
+                f"COPY {MetricRecord.__tablename__} ({', '.join(RECORD_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf
+            )
+            cursor.close()
+            conn.commit()
+        finally:
+            conn.close()
+        return
+    if dialect.name == "sqlite":
+        # The format SQLAlchemy's SQLite DateTime type reads back.
+        conn = target.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(
+                f"INSERT INTO {MetricRecord.__tablename__} ({', '.join(RECORD_COLUMNS)}) VALUES (?, ?, ?)",
+                zip(series_ids.tolist(), values.tolist(), _timestamps(epochs, " ")),
+            )
+            cursor.close()
+            conn.commit()
+        finally:
+            conn.close()
+        return
+    stamps = [datetime(1970, 1, 1) + timedelta(seconds=float(t)) for t in epochs]
+    with target.begin() as conn:
+        conn.execute(
+            insert(MetricRecord.__table__),
+            [{"series_id": s, "metric_value": v, "recorded_at": t} for s, v, t in zip(series_ids.tolist(), values.tolist(), stamps)],
+        )
+
+
+def _chunks(model: SeriesModel, start: float, end: float, options: GenerateOptions) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    # Slabs sized for roughly chunk_rows points, so memory stays flat at any scale.
+    per_second = float((1.0 / model.cadence).sum())
+    slab_seconds = max(60.0, options.chunk_rows / per_second) if per_second else end - start
+    slab_start = start
+    slab_index = 0
+    while slab_start < end:
+        slab_end = min(end, slab_start + slab_seconds)
+        rng = np.random.default_rng([options.seed, slab_index])
+        yield _slab(model, start, slab_start, slab_end, rng)
+        slab_start = slab_end
+        slab_index += 1
+
+
+def generate(target: Engine, db: Session, options: GenerateOptions, now: datetime | None = None) -> Dict[str, Any]:
+    started = time.perf_counter()
+    rng = np.random.default_rng(options.seed)
+    # A minute of headroom so jittered points never land in the future.
+    end_at = (now or datetime.utcnow()).replace(second=0, microsecond=0) - timedelta(minutes=1)
+    start_at = end_at - timedelta(days=options.days)
+    epoch = datetime(1970, 1, 1)
+    start, end = (start_at - epoch).total_seconds(), (end_at - epoch).total_seconds()
+
+    dataset_ids = _ensure_datasets(db, options)
+    user_ids = _ensure_users(db, options, dataset_ids, rng)
+    model = _series_model(db, options, dataset_ids, start, end, rng)
+    db.commit()
+
+    settings = get_settings()
+    with target.begin() as conn:
+        if partitions.is_partitioned(conn):
+            existing = {p.name for p in partitions.list_partitions(conn)}
+            for partition in partitions.partitions_between(start_at, end_at, settings.METRICS_PARTITION_INTERVAL):
+                if partition.name not in existing:
+                    partitions.create_partition(conn, partition)
+
+    rows = 0
+    for series_ids, values, epochs in _chunks(model, start, end, options):
+        if len(values):
+            _write_chunk(target, series_ids, values, epochs)
+            rows += len(values)
+    written = time.perf_counter()
+
+    latest = None
+    if rows:
+        bump_versions(db)
+        mark_dirty(db, start_at)
+        latest = rebuild_latest_metrics(db)
+        db.commit()
+    finished = time.perf_counter()
+    return {
+        "dialect": target.dialect.name,
+        "options": {**asdict(options), "password": None},
+        "datasets": len(dataset_ids),
+        "dataset_ids": dataset_ids,
+        "users": len(user_ids),
+        "series": len(model.ids),
+        "latest_series": latest,
+        "rows": rows,
+        "start": start_at.isoformat(),
+        "end": end_at.isoformat(),
+        "write_seconds": round(written - started, 3),
+        "rows_per_second": round(rows / (written - started), 1) if rows else 0.0,
+        "total_seconds": round(finished - started, 3),
+    }
+
+
+def main() -> None:
+    defaults = GenerateOptions()
+    parser = argparse.ArgumentParser(description="Populate the database with synthetic datasets, users and metric history")
+    parser.add_argument("--datasets", type=int, default=defaults.datasets)
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--datasets-per-user", type=int, default=defaults.datasets_per_user)
+    parser.add_argument("--series-per-dataset", type=int, default=defaults.series_per_dataset)
+    parser.add_argument("--days", type=float, default=defaults.days)
+    parser.add_argument("--cadences", default=",".join(str(c) for c in defaults.cadences), help="reporting intervals in seconds")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--prefix", default=defaults.prefix, help="dataset keys and user emails start with this")
+    parser.add_argument("--password", default=defaults.password, help="password of every generated user")
+    parser.add_argument("--chunk-rows", type=int, default=defaults.chunk_rows)
+    args = parser.parse_args()
+
+    options = GenerateOptions(
+        datasets=args.datasets,
+        users=args.users,
+        datasets_per_user=args.datasets_per_user,
+        series_per_dataset=args.series_per_dataset,
+        days=args.days,
+        cadences=tuple(int(c) for c in args.cadences.split(",") if c.strip()),
+        seed=args.seed,
+        prefix=args.prefix,
+        password=args.password,
+        chunk_rows=args.chunk_rows,
+    )
+    Base.metadata.create_all(bind=engine)
+    db: Session = SessionLocal()
+    try:
+        manifest = generate(engine, db, options)
+    finally:
+        db.close()
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,39 @@
 from __future__ import annotations
 
-from fastapi import FastAPI
+import asyncio
+import logging
+
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from .core.config import get_settings
-from .db import engine, get_db
+from .db import SessionLocal, engine, get_db, get_replica_router
 from .models import Base, User, Dataset, UserDatasetAccess
-from .core.security import hash_password
+from .core.security import PasswordHasherBusy, hash_password, password_hasher
+from .core.telemetry import TelemetryMiddleware
 from .routers import auth as auth_router
+from .routers import live as live_router
 from .routers import users as users_router
-from .routers import datasets as datasets_router
-from .routers import metrics as metrics_router
+from .routers import rules as rules_router
+from .routers import system as system_router
+from .services.ingest_queue import get_ingest_writer
+from .services.rules import get_rule_runner
+from .services.pubsub import get_broker
+from .services.rollups import maintain_metrics
 
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
+if settings.DB_MODE == "async":
+    from .routers import datasets_async as datasets_router
+    from .routers import metrics_async as metrics_router
+else:
+    from .routers import datasets as datasets_router
+    from .routers import metrics as metrics_router
+
 app = FastAPI(title="Data Quality Dashboard API", version="1.0.0")
 
 app.add_middleware(
@@ -23,16 +42,70 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Read-After"],
 )
+if settings.TELEMETRY_ENABLED:
+    # Added last, so it wraps everything else (CORS preflights included).
+    app.add_middleware(TelemetryMiddleware)
 
 
 @app.on_event("startup")
 def on_startup():
     # Create tables
     Base.metadata.create_all(bind=engine)
+    get_broker().start()
+    # Starts the replica health checks before the first read needs them.
+    get_replica_router()
+    writer = get_ingest_writer()
+    if writer is not None:
+        writer.start()
+    if settings.METRICS_MAINTENANCE_INTERVAL_SECONDS > 0:
+        app.state.maintenance = asyncio.create_task(_maintenance_loop(settings.METRICS_MAINTENANCE_INTERVAL_SECONDS))
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    password_hasher.shutdown()
+    get_broker().stop()
+    replicas = get_replica_router()
+    if replicas is not None:
+        replicas.stop()
+    get_rule_runner().stop()
+    writer = get_ingest_writer()
+    if writer is not None:
+        writer.stop()
+    maintenance = getattr(app.state, "maintenance", None)
+    if maintenance is not None:
+        maintenance.cancel()
+
+
+def _run_maintenance() -> None:
+    db = SessionLocal()
+    try:
+        maintain_metrics(db)
+    finally:
+        db.close()
+
+
+async def _maintenance_loop(interval: int) -> None:
+    # Rollups and retention; concurrent runs from other workers serialise on the state row.
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(_run_maintenance)
+        except Exception:
+            logger.exception("Metrics maintenance failed")
+
+
+@app.exception_handler(PasswordHasherBusy)
+def password_hasher_busy(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Too many concurrent logins, retry shortly"}, headers={"Retry-After": "1"})
 
 
 app.include_router(auth_router.router)
 app.include_router(users_router.router)
 app.include_router(datasets_router.router)
 app.include_router(metrics_router.router)
+app.include_router(live_router.router)
+app.include_router(rules_router.router)
+app.include_router(system_router.router)
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import argparse
+import json
+
+from sqlalchemy.orm import Session
+
+from .core.config import get_settings
+from .db import SessionLocal, engine
+from .models import Base
+from .services import partitions
+from .services.rollups import maintain_metrics
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Roll up metric_records and apply the retention policy")
+    parser.add_argument("--partition", action="store_true", help="convert metric_records to a partitioned table first (PostgreSQL)")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    Base.metadata.create_all(bind=engine)
+    if args.partition:
+        if engine.dialect.name != "postgresql":
+            raise SystemExit("Partitioning needs PostgreSQL")
+        with engine.begin() as conn:
+            created = partitions.convert_to_partitioned(conn, settings.METRICS_PARTITION_INTERVAL, settings.METRICS_PARTITION_PREMAKE)
+        print(f"Partitioned metric_records ({len(created)} partitions created).")
+
+    db: Session = SessionLocal()
+    try:
+        print(json.dumps(maintain_metrics(db), indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from sqlalchemy import inspect, text
+
+from .core.config import get_settings
+from .db import engine
+from .models import Base, MetricRecord
+from .services import partitions
+from .services.series import series_catalog
+
+
+def main() -> None:
+    # One-off move of metric_records from (dataset_id, dimension, metric_name) strings
+    # to series ids. Safe to re-run: a table that already has series_id is left alone.
+    table = MetricRecord.__tablename__
+    inspector = inspect(engine)
+    columns = {c["name"] for c in inspector.get_columns(table)} if inspector.has_table(table) else set()
+    if "metric_name" not in columns:
+        Base.metadata.create_all(bind=engine)
+        print("metric_records already uses series ids.")
+        return
+
+    settings = get_settings()
+    old = f"{table}_legacy"
+    with engine.begin() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        was_partitioned = partitions.is_partitioned(conn)
+        if postgres:
+            conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        if postgres:
+            # Free the names create_all is about to use.
+            for index in ("metric_records_pkey", "metric_records_part_pkey", "ix_metrics_dataset_time_id", "ix_metrics_dataset_dimension_time"):
+                conn.execute(text(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_legacy"))
+            conn.execute(text(f"ALTER SEQUENCE IF EXISTS {table}_id_seq RENAME TO {table}_id_seq_legacy"))
+        else:
+            for index in ("ix_metrics_dataset_time_id", "ix_metrics_dataset_dimension_time"):
+                conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+        Base.metadata.create_all(bind=conn)
+
+        conn.execute(text(
+            "INSERT INTO metric_series (dataset_id, dimension, metric_name, created_at) "
+            f"SELECT dataset_id, dimension, metric_name, MIN(recorded_at) FROM {old} o "
+            "WHERE NOT EXISTS (SELECT 1 FROM metric_series s WHERE s.dataset_id = o.dataset_id "
+            "AND s.dimension = o.dimension AND s.metric_name = o.metric_name) "
+            "GROUP BY dataset_id, dimension, metric_name"
+        ))
+        moved = conn.execute(text(
+            f"INSERT INTO {table} (id, series_id, metric_value, recorded_at) "
+            f"SELECT o.id, s.id, o.metric_value, o.recorded_at FROM {old} o JOIN metric_series s "
+            "ON s.dataset_id = o.dataset_id AND s.dimension = o.dimension AND s.metric_name = o.metric_name"
+        )).rowcount
+        conn.execute(text(f"DROP TABLE {old}"))
+        if postgres:
+            conn.execute(text(f"DROP SEQUENCE IF EXISTS {table}_id_seq_legacy"))
+            conn.execute(text(f"SELECT setval('{table}_id_seq', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"))
+            if was_partitioned:
+                partitions.convert_to_partitioned(conn, settings.METRICS_PARTITION_INTERVAL, settings.METRICS_PARTITION_PREMAKE)
+    series_catalog.clear()
+    print(f"Moved {moved} metric records onto metric_series.")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import enum
 from datetime import datetime
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     DateTime,
@@ -57,7 +58,7 @@ class Dataset(Base):
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
 
-    metrics: Mapped[list["MetricRecord"]] = relationship(back_populates="dataset", cascade="all, delete-orphan")
+    series: Mapped[list["MetricSeries"]] = relationship(back_populates="dataset", cascade="all, delete-orphan")
     user_access: Mapped[list["UserDatasetAccess"]] = relationship(back_populates="dataset", cascade="all, delete-orphan")
     rules: Mapped[list["QualityRule"]] = relationship(back_populates="dataset", cascade="all, delete-orphan")
 
@@ -73,17 +74,33 @@ class UserDatasetAccess(Base):
     dataset: Mapped[Dataset] = relationship(back_populates="user_access")
 
 
+class MetricSeries(Base):
+    # Catalogue of (dataset, dimension, metric name); metric_records refer to it by id
+    # instead of repeating the strings on every point.
+    __tablename__ = "metric_series"
+    __table_args__ = (UniqueConstraint("dataset_id", "dimension", "metric_name", name="uq_series_key"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    dataset_id: Mapped[int] = mapped_column(ForeignKey("datasets.id", ondelete="CASCADE"), index=True, nullable=False)
+    dimension: Mapped[DimensionEnum] = mapped_column(Enum(DimensionEnum), nullable=False)
+    metric_name: Mapped[str] = mapped_column(String(100), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+    dataset: Mapped[Dataset] = relationship(back_populates="series")
+    records: Mapped[list["MetricRecord"]] = relationship(back_populates="series", cascade="all, delete-orphan", passive_deletes=True)
+
+
 class MetricRecord(Base):
     __tablename__ = "metric_records"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    dataset_id: Mapped[int] = mapped_column(ForeignKey("datasets.id", ondelete="CASCADE"), index=True, nullable=False)
-    dimension: Mapped[DimensionEnum] = mapped_column(Enum(DimensionEnum), index=True, nullable=False)
-    metric_name: Mapped[str] = mapped_column(String(100), index=True, nullable=False)
+    series_id: Mapped[int] = mapped_column(ForeignKey("metric_series.id", ondelete="CASCADE"), nullable=False)
     metric_value: Mapped[float] = mapped_column(Float, nullable=False)
-    recorded_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, index=True, nullable=False)
+    recorded_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+    series: Mapped[MetricSeries] = relationship(back_populates="records")
+
 
-    dataset: Mapped[Dataset] = relationship(back_populates="metrics")
 class QualityRule(Base):
     __tablename__ = "quality_rules"
     __table_args__ = (UniqueConstraint("dataset_id", "name", name="uq_rule_dataset_name"),)
@@ -96,9 +113,136 @@ class QualityRule(Base):
     dimension: Mapped[DimensionEnum | None] = mapped_column(Enum(DimensionEnum), nullable=True)
     threshold_min: Mapped[float | None] = mapped_column(Float, nullable=True)
     threshold_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+    # Optional OHDSI-style check definition (e.g. isRequired on MEASUREMENT.value_as_number).
+    # Checks on the same cdm_table_name are fused into one scan by the rule engine.
+    check_name: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    cdm_table_name: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    cdm_field_name: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    check_value: Mapped[float | None] = mapped_column(Float, nullable=True)
+    # Monotonic column (id or load timestamp) of cdm_table_name; when set, runs only
+    # scan rows past the rule's watermark and merge them into the stored counts.
+    incremental_column: Mapped[str | None] = mapped_column(String(200), nullable=True)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
 
     dataset: Mapped[Dataset] = relationship(back_populates="rules")
+    executions: Mapped[list["RuleExecution"]] = relationship(back_populates="rule", cascade="all, delete-orphan")
+    watermark: Mapped["RuleWatermark | None"] = relationship(back_populates="rule", cascade="all, delete-orphan")
+
+
+class RuleRun(Base):
+    # One submitted rule set, executed in the background; poll it by id.
+    __tablename__ = "rule_runs"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    status: Mapped[str] = mapped_column(String(20), nullable=False)
+    rules: Mapped[int] = mapped_column(Integer, nullable=False)
+    error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, index=True, nullable=False)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class RuleExecution(Base):
+    __tablename__ = "rule_executions"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    run_id: Mapped[str | None] = mapped_column(ForeignKey("rule_runs.id", ondelete="SET NULL"), index=True, nullable=True)
+    rule_id: Mapped[int] = mapped_column(ForeignKey("quality_rules.id", ondelete="CASCADE"), index=True, nullable=False)
+    dataset_id: Mapped[int] = mapped_column(ForeignKey("datasets.id", ondelete="CASCADE"), index=True, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False)
+    metric_value: Mapped[float | None] = mapped_column(Float, nullable=True)
+    num_violated_rows: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    num_denominator_rows: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    incremental: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    cached: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    passed: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
+    duration_ms: Mapped[float] = mapped_column(Float, nullable=False)
+    error: Mapped[str | None] = mapped_column(Text)
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, index=True, nullable=False)
+
+    rule: Mapped[QualityRule] = relationship(back_populates="executions")
+
+
+class RuleWatermark(Base):
+    # Running counts of an incremental rule up to `watermark`. `signature` is the check
+    # definition they were computed for; a different signature forces a full recompute.
+    __tablename__ = "rule_watermarks"
+
+    rule_id: Mapped[int] = mapped_column(ForeignKey("quality_rules.id", ondelete="CASCADE"), primary_key=True)
+    signature: Mapped[str] = mapped_column(String(1000), nullable=False)
+    watermark: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    num_violated_rows: Mapped[int] = mapped_column(Integer, nullable=False)
+    num_denominator_rows: Mapped[int] = mapped_column(Integer, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+    rule: Mapped[QualityRule] = relationship(back_populates="watermark")
+
+
+class LatestMetric(Base):
+    # Newest timestamp per series with the sum and count of its points at that timestamp,
+    # upserted by the ingest path alongside metric_records.
+    __tablename__ = "latest_metrics"
+
+    dataset_id: Mapped[int] = mapped_column(ForeignKey("datasets.id", ondelete="CASCADE"), primary_key=True)
+    dimension: Mapped[DimensionEnum] = mapped_column(Enum(DimensionEnum), primary_key=True)
+    metric_name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    value_sum: Mapped[float] = mapped_column(Float, nullable=False)
+    value_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    recorded_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class DatasetVersion(Base):
+    # Bumped whenever a dataset's metrics change; HTTP ETags are derived from it.
+    __tablename__ = "dataset_versions"
+
+    dataset_id: Mapped[int] = mapped_column(ForeignKey("datasets.id", ondelete="CASCADE"), primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+
+class IngestBatch(Base):
+    # Queued ingest batches already committed, written in the same transaction as
+    # their rows so the spool writer never applies a batch twice. Pruned by the
+    # writer once no spool can replay the batch any more.
+    __tablename__ = "ingested_batches"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    rows: Mapped[int] = mapped_column(Integer, nullable=False)
+    committed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, index=True, nullable=False)
+
+
+class MetricRollup(Base):
+    # Hourly ("1h") and daily ("1d") aggregates of metric_records that outlive the raw
+    # points. bucket_epoch is the bucket start in UTC epoch seconds.
+    __tablename__ = "metric_rollups"
+
+    granularity: Mapped[str] = mapped_column(String(4), primary_key=True)
+    dataset_id: Mapped[int] = mapped_column(ForeignKey("datasets.id", ondelete="CASCADE"), primary_key=True)
+    dimension: Mapped[DimensionEnum] = mapped_column(Enum(DimensionEnum), primary_key=True)
+    metric_name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    bucket_epoch: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+    sum_value: Mapped[float] = mapped_column(Float, nullable=False)
+    min_value: Mapped[float] = mapped_column(Float, nullable=False)
+    max_value: Mapped[float] = mapped_column(Float, nullable=False)
+    last_value: Mapped[float] = mapped_column(Float, nullable=False)
+    last_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class MetricRollupState(Base):
+    # Single row (id=1). Rollups are exact below min(rolled_until, dirty_from); ingest
+    # lowers dirty_from when it writes behind rolled_until. Raw points below raw_floor
+    # have been dropped by retention. All values are UTC epoch seconds.
+    __tablename__ = "metric_rollup_state"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    rolled_until: Mapped[int | None] = mapped_column(BigInteger)
+    dirty_from: Mapped[int | None] = mapped_column(BigInteger)
+    raw_floor: Mapped[int | None] = mapped_column(BigInteger)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
 
-Index("ix_metrics_dataset_dimension_time", MetricRecord.dataset_id, MetricRecord.dimension, MetricRecord.recorded_at)
+Index("ix_metrics_series_time_id", MetricRecord.series_id, MetricRecord.recorded_at, MetricRecord.id)
+# Time-range scans across every series (rollups, retention).
+Index("ix_metrics_time_id", MetricRecord.recorded_at, MetricRecord.id)
+Index("ix_rollups_dataset_bucket", MetricRollup.granularity, MetricRollup.dataset_id, MetricRollup.bucket_epoch)
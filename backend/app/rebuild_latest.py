@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal, engine
+from .models import Base, LatestMetric, MetricRecord, MetricSeries
+from .services.timeseries import RECORDS
+
+
+def rebuild_latest_metrics(db: Session) -> int:
+    # Replace latest_metrics with the sum and count of every series' points at its
+    # newest timestamp; caller commits.
+    latest = (
+        select(MetricRecord.series_id, func.max(MetricRecord.recorded_at).label("recorded_at"))
+        .group_by(MetricRecord.series_id)
+        .subquery()
+    )
+    columns = ["dataset_id", "dimension", "metric_name", "value_sum", "value_count", "recorded_at"]
+    newest = (
+        select(
+            MetricSeries.dataset_id,
+            MetricSeries.dimension,
+            MetricSeries.metric_name,
+            func.sum(MetricRecord.metric_value),
+            func.count(),
+            latest.c.recorded_at,
+        )
+        .select_from(RECORDS.join(latest, and_(
+            latest.c.series_id == MetricRecord.series_id, latest.c.recorded_at == MetricRecord.recorded_at
+        )))
+        .group_by(MetricSeries.dataset_id, MetricSeries.dimension, MetricSeries.metric_name, latest.c.recorded_at)
+    )
+    db.execute(delete(LatestMetric))
+    db.execute(insert(LatestMetric).from_select(columns, newest))
+    return db.query(func.count()).select_from(LatestMetric).scalar()
+
+
+def main() -> None:
+    # Backfill latest_metrics from the full metric_records history, recreating the
+    # table so an older column layout is replaced.
+    LatestMetric.__table__.drop(bind=engine, checkfirst=True)
+    Base.metadata.create_all(bind=engine)
+    db: Session = SessionLocal()
+    try:
+        count = rebuild_latest_metrics(db)
+        db.commit()
+        print(f"Rebuilt latest_metrics with {count} series.")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
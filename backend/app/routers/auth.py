@@ -1,22 +1,37 @@
 from __future__ import annotations
 
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 from ..db import get_db
-from ..core.security import verify_password, create_access_token
+from ..core.security import create_access_token, hash_password_async, needs_rehash, verify_password_async
 from ..models import User
 from ..schemas import LoginRequest, Token
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
+def _find_user(db: Session, email: str) -> Optional[User]:
+    return db.query(User).filter(User.email == email).first()
+
+
+def _store_hash(db: Session, user: User, hashed_password: str) -> None:
+    user.hashed_password = hashed_password
+    db.commit()
+
+
 @router.post("/login", response_model=Token)
-def login(payload: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == payload.email).first()
-    if not user or not verify_password(payload.password, user.hashed_password):
+async def login(payload: LoginRequest, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_find_user, db, payload.email)
+    if not user or not await verify_password_async(payload.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
     if not user.is_active:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is inactive")
-    token = create_access_token(subject=user.email, extra={"is_admin": user.is_admin})
+    # Read before a rehash commits and expires the instance, which would reload it on the event loop.
+    token = create_access_token(subject=user.email, extra={"uid": user.id, "is_admin": user.is_admin})
+    if needs_rehash(user.hashed_password):
+        await run_in_threadpool(_store_hash, db, user, await hash_password_async(payload.password))
     return Token(access_token=token)
@@ -2,34 +2,43 @@ from __future__ import annotations
 
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 
 from ..db import get_db
-from ..deps import get_current_user, get_current_admin
-from ..models import Dataset, UserDatasetAccess, User
+from ..core.replicas import pin_to_primary
+from ..deps import Principal, get_current_user, get_current_admin, get_read_db, invalidate_active_datasets, visible_dataset_ids
+from ..models import Dataset
 from ..schemas import DatasetCreate, DatasetOut
+from ..services.http_cache import conditional_get
 
 router = APIRouter(prefix="/datasets", tags=["datasets"])
 
 
 @router.get("/", response_model=List[DatasetOut])
-def list_datasets(current: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if current.is_admin:
-        return db.query(Dataset).filter(Dataset.is_active == True).all()
-    dataset_ids = [a.dataset_id for a in db.query(UserDatasetAccess).filter(UserDatasetAccess.user_id == current.id).all()]
+def list_datasets(request: Request, current: Principal = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    dataset_ids = visible_dataset_ids(current, db)
     if not dataset_ids:
         return []
-    return db.query(Dataset).filter(Dataset.id.in_(dataset_ids), Dataset.is_active == True).all()
+
+    def render():
+        datasets = db.query(Dataset).filter(Dataset.id.in_(dataset_ids)).all()
+        return [DatasetOut.model_validate(ds) for ds in datasets]
+
+    # Dataset rows only change on create, which resets the active set, so the visible
+    # ids alone identify the body; data versions are deliberately left out.
+    return conditional_get(request, db, "datasets", {"dataset_ids": dataset_ids}, [], render)
 
 
 @router.post("/", response_model=DatasetOut)
-def create_dataset(payload: DatasetCreate, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+def create_dataset(payload: DatasetCreate, response: Response, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
     existing = db.query(Dataset).filter(Dataset.key == payload.key).first()
     if existing:
         raise HTTPException(status_code=400, detail="Dataset key already exists")
     ds = Dataset(key=payload.key, name=payload.name, description=payload.description, is_active=payload.is_active)
     db.add(ds)
     db.commit()
+    invalidate_active_datasets()
+    pin_to_primary(response)
     db.refresh(ds)
     return ds
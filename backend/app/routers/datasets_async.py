@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.replicas import pin_to_primary
+from ..db import get_async_db
+from ..deps import Principal, get_async_read_db, get_current_admin_async, get_current_user_async, invalidate_active_datasets, visible_dataset_ids
+from ..models import Dataset
+from ..schemas import DatasetCreate, DatasetOut
+from ..services.http_cache import conditional_get_async
+
+# Async counterpart of routers/datasets.py; see routers/metrics_async.py.
+router = APIRouter(prefix="/datasets", tags=["datasets"])
+
+
+@router.get("/", response_model=List[DatasetOut])
+async def list_datasets(request: Request, current: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_read_db)):
+    dataset_ids = await db.run_sync(lambda s: visible_dataset_ids(current, s))
+    if not dataset_ids:
+        return []
+
+    async def render():
+        datasets = (await db.execute(select(Dataset).where(Dataset.id.in_(dataset_ids)))).scalars().all()
+        return await run_in_threadpool(lambda: [DatasetOut.model_validate(ds) for ds in datasets])
+
+    return await conditional_get_async(request, db, "datasets", {"dataset_ids": dataset_ids}, [], render)
+
+
+@router.post("/", response_model=DatasetOut)
+async def create_dataset(payload: DatasetCreate, response: Response, admin=Depends(get_current_admin_async), db: AsyncSession = Depends(get_async_db)):
+    existing = (await db.execute(select(Dataset.id).where(Dataset.key == payload.key))).first()
+    if existing:
+        raise HTTPException(status_code=400, detail="Dataset key already exists")
+    ds = Dataset(key=payload.key, name=payload.name, description=payload.description, is_active=payload.is_active)
+    db.add(ds)
+    await db.commit()
+    invalidate_active_datasets()
+    pin_to_primary(response)
+    await db.refresh(ds)
+    return ds
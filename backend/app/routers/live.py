@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPAuthorizationCredentials
+
+from ..core.config import get_settings
+from ..db import SessionLocal
+from ..deps import ensure_datasets_access, get_current_user
+from ..services.live import dataset_channel
+from ..services.pubsub import get_broker
+
+# Push channel for dashboards: after connecting, the client receives a "metrics"
+# message for every committed ingest into the datasets it subscribed to, "ping"
+# heartbeats, and "resync" if it fell too far behind and should refetch.
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+PING = json.dumps({"type": "ping"})
+
+
+def _authorize(token: Optional[str], dataset_ids: List[int]) -> None:
+    # Access is checked once, when subscribing.
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token) if token else None
+    db = SessionLocal()
+    try:
+        current = get_current_user(credentials, db)
+        ensure_datasets_access(dataset_ids, current, db)
+    finally:
+        db.close()
+
+
+async def _wait_for_disconnect(websocket: WebSocket) -> None:
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+@router.websocket("/live")
+async def live_metrics(
+    websocket: WebSocket,
+    dataset_id: List[int] = Query(...),
+    token: Optional[str] = Query(None, description="Bearer token; browsers cannot set headers on WebSockets"),
+):
+    if token is None:
+        scheme, _, value = websocket.headers.get("authorization", "").partition(" ")
+        token = value if scheme.lower() == "bearer" and value else None
+    dataset_ids = sorted(set(dataset_id))
+    await websocket.accept()
+    try:
+        await run_in_threadpool(_authorize, token, dataset_ids)
+    except HTTPException as exc:
+        await websocket.close(code=4000 + exc.status_code, reason=str(exc.detail))
+        return
+
+    broker = get_broker()
+    subscription = broker.subscribe(dataset_channel(ds_id) for ds_id in dataset_ids)
+    receiver = asyncio.create_task(_wait_for_disconnect(websocket))
+    heartbeat = get_settings().LIVE_HEARTBEAT_SECONDS
+    try:
+        await websocket.send_text(json.dumps({"type": "subscribed", "dataset_ids": dataset_ids}))
+        while not receiver.done():
+            getter = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait({getter, receiver}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                await websocket.send_text(getter.result())
+                continue
+            getter.cancel()
+            if not receiver.done():
+                await websocket.send_text(PING)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        broker.unsubscribe(subscription)
@@ -1,102 +1,450 @@
 from __future__ import annotations
 
-from collections import defaultdict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 
-from ..db import get_db
-from ..deps import get_current_user, ensure_dataset_access
-from ..models import MetricRecord, Dataset, User
-from ..schemas import MetricRecordCreate, MetricRecordOut, DimensionEnum, DimensionSummary, TimeseriesResponse, MetricsSummaryPoint
+from ..core.config import get_settings
+from ..core.replicas import pin_to_primary
+from ..db import SessionLocal, get_db
+from ..deps import Principal, get_current_user, get_read_db, ensure_dataset_access, ensure_datasets_access, has_dataset_access, visible_dataset_ids
+from ..models import MetricRecord, Dataset
+from ..schemas import MetricRecordCreate, MetricRecordOut, DimensionEnum, DimensionSummary, TimeseriesResponse, MetricsSummaryPoint, IngestSummary, IngestLineError, StreamIngestSummary, DatasetLatestSummary, MetricExportPage, IngestBatchOut, SeriesAnomalyOut
+from ..services.anomalies import SeriesStats, series_anomalies
+from ..services.export import Cursor, decode_cursor, encode_cursor, export_statement, iter_ndjson, row_to_dict
+from ..services.http_cache import conditional_get
+from ..services.ingest import CsvLineParser, insert_metrics, iter_lines, normalize_metrics, parse_ndjson_line
+from ..services.ingest_queue import BatchStatus, IngestQueueFull, IngestSpool, get_ingest_spool
+from ..services.summary import dimension_summaries, latest_by_dimension
+from ..services.timeseries import AGGREGATES, ARROW_MEDIA_TYPES, BUCKET_SECONDS, Series, load_series, metric_filters, to_arrow_bytes, to_columnar
 
 router = APIRouter(prefix="/metrics", tags=["metrics"])
 
 
-@router.post("/ingest", response_model=List[MetricRecordOut])
-def ingest_metrics(items: List[MetricRecordCreate], current: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.post("/ingest", response_model=Union[List[MetricRecordOut], IngestSummary])
+def ingest_metrics(
+    items: List[MetricRecordCreate],
+    response: Response,
+    echo: bool = Query(True, description="Return the created rows; disable for large batches"),
+    chunk_size: Optional[int] = Query(None, ge=1, le=get_settings().INGEST_MAX_CHUNK_SIZE),
+    current: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
     if not items:
-        return []
+        return [] if echo else IngestSummary(inserted=0)
     # Ensure access to all datasets referenced
-    dataset_ids = {i.dataset_id for i in items}
-    for ds_id in dataset_ids:
-        ensure_dataset_access(ds_id, current, db)
-
-    created: List[MetricRecord] = []
-    for item in items:
-        recorded_at = item.recorded_at or datetime.utcnow()
-        rec = MetricRecord(
-            dataset_id=item.dataset_id,
-            dimension=item.dimension,
-            metric_name=item.metric_name,
-            metric_value=item.metric_value,
-            recorded_at=recorded_at,
-        )
-        db.add(rec)
-        created.append(rec)
+    ensure_datasets_access({i.dataset_id for i in items}, current, db)
+
+    result = insert_metrics(db, (i.model_dump() for i in items), echo=echo, chunk_size=chunk_size)
+    db.commit()
+    pin_to_primary(response)
+    if not echo:
+        return IngestSummary(inserted=result.inserted)
+    return result.rows
+
+
+def _require_spool() -> IngestSpool:
+    spool = get_ingest_spool()
+    if spool is None:
+        raise HTTPException(status_code=501, detail="Queued ingest is not enabled on this server")
+    return spool
+
+
+def _batch_out(status: BatchStatus) -> IngestBatchOut:
+    return IngestBatchOut(
+        batch_id=status.batch_id,
+        status=status.status,
+        rows=status.rows,
+        inserted=status.inserted,
+        error=status.error,
+        created_at=datetime.utcfromtimestamp(status.created_at),
+        finished_at=datetime.utcfromtimestamp(status.finished_at) if status.finished_at is not None else None,
+    )
+
+
+def enqueue_batch(items: List[MetricRecordCreate], current: Principal, response: Response) -> IngestBatchOut:
+    # Points without recorded_at are stamped now, when they are accepted, not when written.
+    spool = _require_spool()
+    now = datetime.utcnow()
+    rows = [dict(i.model_dump(mode="json"), recorded_at=(i.recorded_at or now).isoformat()) for i in items]
+    try:
+        batch_id = spool.enqueue(rows, current.id)
+    except IngestQueueFull:
+        raise HTTPException(status_code=503, detail="Ingest queue is full, retry shortly", headers={"Retry-After": "5"})
+    # The writer usually commits well within the read-your-writes window.
+    pin_to_primary(response)
+    return _batch_out(spool.status(batch_id))
+
+
+@router.post("/ingest/batches", response_model=IngestBatchOut, status_code=202)
+def queue_ingest(
+    items: List[MetricRecordCreate],
+    response: Response,
+    current: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # Accept now, write later: the batch is durably spooled and a background writer
+    # inserts it together with other queued batches. Poll the returned batch id.
+    ensure_datasets_access({i.dataset_id for i in items}, current, db)
+    return enqueue_batch(items, current, response)
+
+
+@router.get("/ingest/batches/{batch_id}", response_model=IngestBatchOut)
+def ingest_batch_status(batch_id: str, current: Principal = Depends(get_current_user)):
+    status = _require_spool().status(batch_id)
+    if status is None or (status.user_id != current.id and not current.is_admin):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return _batch_out(status)
+
+
+def _commit_batch(db: Session, batch: List[dict]) -> int:
+    result = insert_metrics(db, batch, echo=False, normalized=True)
     db.commit()
-    for rec in created:
-        db.refresh(rec)
-    return created
+    return result.inserted
+
+
+def _describe_error(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(f"{'.'.join(str(p) for p in e['loc']) or 'record'}: {e['msg']}" for e in exc.errors())
+    return str(exc)
+
+
+def _parse_lines(parse, lines: List[Tuple[int, str]]) -> List[Tuple[int, Optional[dict], Optional[str]]]:
+    # (line number, normalized row or None, error or None) per line; runs in the threadpool.
+    parsed = []
+    now = datetime.utcnow()
+    for line_no, line in lines:
+        try:
+            raw = parse(line)
+            if raw is None:
+                continue
+            row = normalize_metrics([MetricRecordCreate.model_validate(raw).model_dump()], now)[0]
+        except ValueError as exc:
+            # Blank lines are never passed in, so the header is the first parsed line.
+            if isinstance(parse, CsvLineParser) and parse.header is None:
+                raise HTTPException(status_code=400, detail=str(exc))
+            parsed.append((line_no, None, _describe_error(exc)))
+            continue
+        parsed.append((line_no, row, None))
+    return parsed
+
+
+async def ingest_stream(
+    request: Request,
+    format: Optional[str],
+    check_access: Callable[[int], Awaitable[bool]],
+    commit_batch: Callable[[List[dict]], Awaitable[int]],
+) -> StreamIngestSummary:
+    # Shared by the sync and async routers; they differ only in how the database is reached.
+    # Lines are parsed and validated a chunk at a time in the threadpool, off the event loop.
+    settings = get_settings()
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    parse = CsvLineParser() if format == "csv" else parse_ndjson_line
+
+    summary = StreamIngestSummary(inserted=0)
+    access: Dict[int, bool] = {}
+    pending: List[Tuple[int, str]] = []
+    batch: List[dict] = []
+
+    def record_error(line_no: int, message: str) -> None:
+        summary.failed += 1
+        if len(summary.errors) < settings.INGEST_STREAM_MAX_ERRORS:
+            summary.errors.append(IngestLineError(line=line_no, error=message))
+        else:
+            summary.errors_truncated = True
+
+    async def flush() -> None:
+        nonlocal batch
+        for line_no, row, error in await run_in_threadpool(_parse_lines, parse, pending):
+            if error is not None:
+                record_error(line_no, error)
+                continue
+            allowed = access.get(row["dataset_id"])
+            if allowed is None:
+                allowed = access[row["dataset_id"]] = await check_access(row["dataset_id"])
+            if not allowed:
+                record_error(line_no, "No access to dataset")
+                continue
+            batch.append(row)
+            if len(batch) >= settings.INGEST_CHUNK_SIZE:
+                summary.inserted += await commit_batch(batch)
+                batch = []
+        pending.clear()
+
+    line_no = 0
+    undecodable = False
+    try:
+        async for line in iter_lines(request.stream()):
+            line_no += 1
+            if not line.strip():
+                continue
+            pending.append((line_no, line))
+            if len(pending) >= settings.INGEST_CHUNK_SIZE:
+                await flush()
+    except UnicodeDecodeError:
+        # Nothing past this point can be split into lines: keep what was read before it
+        # and answer 400 with the same summary, so the client knows what already landed.
+        record_error(line_no + 1, "Body is not valid UTF-8; the rest of the stream was not read")
+        undecodable = True
+    await flush()
+    if batch:
+        summary.inserted += await commit_batch(batch)
+    if undecodable:
+        raise HTTPException(status_code=400, detail=summary.model_dump(mode="json"))
+    return summary
+
+
+@router.post("/ingest/stream", response_model=StreamIngestSummary)
+async def ingest_metrics_stream(
+    request: Request,
+    response: Response,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$", description="Defaults from the Content-Type header"),
+    current: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    summary = await ingest_stream(
+        request,
+        format,
+        check_access=lambda ds_id: run_in_threadpool(has_dataset_access, ds_id, current, db),
+        commit_batch=lambda batch: run_in_threadpool(_commit_batch, db, batch),
+    )
+    if summary.inserted:
+        pin_to_primary(response)
+    return summary
 
 
 @router.get("/latest", response_model=List[DimensionSummary])
-def latest_summary(dataset_id: int = Query(...), current: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def latest_summary(
+    request: Request,
+    dataset_id: int = Query(...),
+    current: Principal = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
     ensure_dataset_access(dataset_id, current, db)
 
-    results: List[DimensionSummary] = []
-    for dim in DimensionEnum:
-        # latest timestamp per dimension
-        latest_ts = (
-            db.query(func.max(MetricRecord.recorded_at))
-            .filter(MetricRecord.dataset_id == dataset_id, MetricRecord.dimension == dim)
-            .scalar()
-        )
-        if latest_ts is None:
-            results.append(DimensionSummary(dimension=dim, latest_value=None, latest_at=None))
-            continue
-        avg_value = (
-            db.query(func.avg(MetricRecord.metric_value))
-            .filter(
-                MetricRecord.dataset_id == dataset_id,
-                MetricRecord.dimension == dim,
-                MetricRecord.recorded_at == latest_ts,
-            )
-            .scalar()
-        )
-        results.append(DimensionSummary(dimension=dim, latest_value=float(avg_value) if avg_value is not None else None, latest_at=latest_ts))
-    return results
+    def render():
+        latest = latest_by_dimension(db, [dataset_id])
+        return dimension_summaries(latest.get(dataset_id, {}))
+
+    return conditional_get(request, db, "latest", {"dataset_id": dataset_id}, [dataset_id], render)
+
+
+def _parse_id_list(raw: str) -> List[int]:
+    try:
+        return sorted({int(part) for part in raw.split(",") if part.strip()})
+    except ValueError:
+        raise HTTPException(status_code=422, detail="dataset_ids must be a comma-separated list of integers")
+
+
+def requested_datasets(dataset_ids: Optional[str], current: Principal, db: Session) -> List[int]:
+    if dataset_ids is None:
+        return visible_dataset_ids(current, db)
+    requested = _parse_id_list(dataset_ids)
+    ensure_datasets_access(requested, current, db)
+    return requested
+
+
+# Response builders shared with routers/metrics_async.py, which runs them in the threadpool.
+def overview_body(requested: List[int], latest) -> List[DatasetLatestSummary]:
+    return [DatasetLatestSummary(dataset_id=ds_id, dimensions=dimension_summaries(latest.get(ds_id, {}))) for ds_id in requested]
+
+
+def anomalies_body(
+    series_stats: List[SeriesStats], z_threshold: Optional[float], drift_limit: Optional[float], include_ok: bool
+) -> List[SeriesAnomalyOut]:
+    settings = get_settings()
+    z_threshold = z_threshold if z_threshold is not None else settings.ANOMALY_ZSCORE_THRESHOLD
+    drift_limit = drift_limit if drift_limit is not None else settings.ANOMALY_EWMA_LIMIT
+    out = []
+    for stats in series_stats:
+        flags = stats.anomalies(z_threshold, drift_limit)
+        if flags or include_ok:
+            out.append(SeriesAnomalyOut(
+                dataset_id=stats.dataset_id,
+                series_id=stats.series_id,
+                dimension=stats.dimension,
+                metric_name=stats.metric_name,
+                points=stats.points,
+                last_value=stats.last_value,
+                last_recorded_at=stats.last_recorded_at,
+                threshold_min=stats.threshold_min,
+                threshold_max=stats.threshold_max,
+                breach=stats.breach,
+                breach_points=stats.breach_points,
+                zscore=stats.zscore,
+                drift_score=stats.drift_score,
+                anomalies=flags,
+            ))
+    return out
+
+
+def timeseries_body(series: Series, format: str):
+    if format == "columnar":
+        return JSONResponse(to_columnar(series))
+    if format in ARROW_MEDIA_TYPES:
+        try:
+            content = to_arrow_bytes(series, format)
+        except ImportError:
+            raise HTTPException(status_code=501, detail="pyarrow is not installed on the server")
+        return Response(content=content, media_type=ARROW_MEDIA_TYPES[format])
+    return [
+        TimeseriesResponse(metric_name=name, points=[MetricsSummaryPoint(recorded_at=ts, value=value) for ts, value in points])
+        for name, points in series.items()
+    ]
+
+
+def timeseries_params(
+    dataset_id: int,
+    dimension: Optional[DimensionEnum],
+    metric_name: Optional[str],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    bucket: Optional[str],
+    agg: str,
+    max_points: Optional[int],
+    format: str,
+) -> Dict[str, Any]:
+    return {
+        "dataset_id": dataset_id,
+        "dimension": dimension.value if dimension is not None else None,
+        "metric_name": metric_name,
+        "start": start.isoformat() if start is not None else None,
+        "end": end.isoformat() if end is not None else None,
+        "bucket": bucket,
+        "agg": agg,
+        "max_points": max_points,
+        "format": format,
+        # After retention, raw-only reads answer differently from rollup-backed ones.
+        "rollups": get_settings().METRICS_ROLLUP_READS,
+    }
+
+
+def export_page(rows, limit: int) -> MetricExportPage:
+    # `rows` holds up to limit + 1 rows; the extra one only signals a next page.
+    items = [row_to_dict(row) for row in rows]
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["recorded_at"], items[-1]["id"])
+    return MetricExportPage(items=items, next_cursor=next_cursor)
+
+
+def export_cursor(cursor: Optional[str]) -> Optional[Cursor]:
+    try:
+        return decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+@router.get("/latest/overview", response_model=List[DatasetLatestSummary])
+def latest_overview(
+    request: Request,
+    dataset_ids: Optional[str] = Query(None, description="Comma-separated ids; defaults to every dataset you can see"),
+    current: Principal = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    requested = requested_datasets(dataset_ids, current, db)
+    if not requested:
+        return []
+    return conditional_get(
+        request, db, "latest_overview", {"dataset_ids": requested}, requested,
+        lambda: overview_body(requested, latest_by_dimension(db, requested)),
+    )
+
+
+@router.get("/anomalies", response_model=List[SeriesAnomalyOut])
+def anomalies(
+    dataset_ids: Optional[str] = Query(None, description="Comma-separated ids; defaults to every dataset you can see"),
+    z_threshold: Optional[float] = Query(None, gt=0, description="Flag a last point this many stddevs from the recent window"),
+    drift_limit: Optional[float] = Query(None, gt=0, description="Flag an EWMA this many standard errors from the series mean"),
+    include_ok: bool = Query(False, description="Also return series with nothing flagged"),
+    current: Principal = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    requested = requested_datasets(dataset_ids, current, db)
+    return anomalies_body(series_anomalies(db, requested), z_threshold, drift_limit, include_ok)
 
 
 @router.get("/timeseries", response_model=List[TimeseriesResponse])
 def timeseries(
+    request: Request,
     dataset_id: int = Query(...),
     dimension: Optional[DimensionEnum] = Query(None),
     metric_name: Optional[str] = Query(None),
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
-    current: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    bucket: Optional[str] = Query(None, pattern=f"^({'|'.join(BUCKET_SECONDS)})$", description="Aggregate points into time buckets"),
+    agg: str = Query("avg", pattern=f"^({'|'.join(AGGREGATES)})$", description="Aggregate applied per bucket"),
+    max_points: Optional[int] = Query(
+        None, ge=3, description="Downsample each series to at most this many points (LTTB; long ranges are pre-aggregated with agg)"
+    ),
+    format: str = Query(
+        "points",
+        pattern="^(points|columnar|arrow|parquet)$",
+        description="columnar returns parallel timestamps (epoch ms) and values arrays per metric; arrow/parquet need pyarrow",
+    ),
+    current: Principal = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
 ):
     ensure_dataset_access(dataset_id, current, db)
 
-    q = db.query(MetricRecord).filter(MetricRecord.dataset_id == dataset_id)
-    if dimension is not None:
-        q = q.filter(MetricRecord.dimension == dimension)
-    if metric_name is not None:
-        q = q.filter(MetricRecord.metric_name == metric_name)
-    if start is not None:
-        q = q.filter(MetricRecord.recorded_at >= start)
-    if end is not None:
-        q = q.filter(MetricRecord.recorded_at <= end)
+    def render():
+        series = load_series(
+            db,
+            dataset_id,
+            dimension=dimension,
+            metric_name=metric_name,
+            start=start,
+            end=end,
+            bucket=bucket,
+            agg=agg,
+            max_points=max_points,
+        )
+        return timeseries_body(series, format)
+
+    params = timeseries_params(dataset_id, dimension, metric_name, start, end, bucket, agg, max_points, format)
+    return conditional_get(request, db, "timeseries", params, [dataset_id], render)
+
+
+def _stream_export(clauses: list, after: Optional[Cursor], batch_size: int, bind):
+    # The request-scoped session may be closed before the body is sent, so the
+    # stream owns its session (on the same primary or replica).
+    db: Session = SessionLocal(bind=bind)
+    try:
+        yield from iter_ndjson(db, clauses, after, batch_size)
+    finally:
+        db.close()
 
-    q = q.order_by(MetricRecord.metric_name, MetricRecord.recorded_at)
 
-    series: Dict[str, List[MetricsSummaryPoint]] = defaultdict(list)
-    for rec in q.all():
-        series[rec.metric_name].append(MetricsSummaryPoint(recorded_at=rec.recorded_at, value=rec.metric_value))
+@router.get("/export", response_model=MetricExportPage)
+def export_metrics(
+    dataset_id: int = Query(...),
+    dimension: Optional[DimensionEnum] = Query(None),
+    metric_name: Optional[str] = Query(None),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1),
+    stream: bool = Query(False, description="Stream every matching row as NDJSON instead of one page"),
+    current: Principal = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    ensure_dataset_access(dataset_id, current, db)
+    settings = get_settings()
+    after = export_cursor(cursor)
+    clauses = metric_filters(dataset_id, dimension, metric_name, start, end)
+
+    if stream:
+        return StreamingResponse(
+            _stream_export(clauses, after, settings.EXPORT_STREAM_BATCH_SIZE, db.get_bind()),
+            media_type="application/x-ndjson",
+        )
 
-    return [TimeseriesResponse(metric_name=name, points=points) for name, points in series.items()]
+    limit = min(limit or settings.EXPORT_PAGE_SIZE, settings.EXPORT_MAX_PAGE_SIZE)
+    return export_page(db.execute(export_statement(db.get_bind().dialect.name, clauses, after, limit + 1)), limit)
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, List, Optional, Union
+
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import get_settings
+from ..core.replicas import pin_to_primary
+from ..db import get_async_db
+from ..deps import Principal, ensure_dataset_access, ensure_datasets_access, get_async_read_db, get_current_user_async, has_dataset_access
+from ..schemas import DatasetLatestSummary, DimensionEnum, DimensionSummary, IngestBatchOut, IngestSummary, MetricExportPage, MetricRecordCreate, MetricRecordOut, SeriesAnomalyOut, StreamIngestSummary, TimeseriesResponse
+from ..services.anomalies import series_anomalies_async
+from ..services.export import Cursor, export_statement, row_to_ndjson
+from ..services.http_cache import conditional_get_async
+from ..services.ingest import insert_metrics, normalize_metrics
+from ..services.summary import dimension_summaries, latest_by_dimension
+from ..services.timeseries import AGGREGATES, BUCKET_SECONDS, load_series_async, metric_filters
+from . import metrics
+
+# Same endpoints as routers/metrics.py over an AsyncSession. Queries are awaited on the
+# async driver; everything CPU-bound (normalizing ingest rows, grouping and downsampling
+# series, NumPy statistics, building and encoding response bodies) runs in the
+# threadpool so one heavy request does not stall the event loop for the others.
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@lru_cache(maxsize=None)
+def _adapter(model: Any) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+def _encode(model: Any, content: Any) -> Response:
+    # The response_model serialization FastAPI would otherwise run on the event loop.
+    adapter = _adapter(model)
+    return JSONResponse(adapter.dump_python(adapter.validate_python(content, from_attributes=True), mode="json"))
+
+
+@router.post("/ingest", response_model=Union[List[MetricRecordOut], IngestSummary])
+async def ingest_metrics(
+    items: List[MetricRecordCreate],
+    response: Response,
+    echo: bool = Query(True, description="Return the created rows; disable for large batches"),
+    chunk_size: Optional[int] = Query(None, ge=1, le=get_settings().INGEST_MAX_CHUNK_SIZE),
+    current: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if not items:
+        return [] if echo else IngestSummary(inserted=0)
+    await db.run_sync(lambda s: ensure_datasets_access({i.dataset_id for i in items}, current, s))
+    rows = await run_in_threadpool(lambda: normalize_metrics([i.model_dump() for i in items]))
+    result = await db.run_sync(lambda s: insert_metrics(s, rows, echo=echo, chunk_size=chunk_size, normalized=True))
+    await db.commit()
+    if not echo:
+        pin_to_primary(response)
+        return IngestSummary(inserted=result.inserted)
+    encoded = await run_in_threadpool(_encode, List[MetricRecordOut], result.rows)
+    pin_to_primary(encoded)
+    return encoded
+
+
+@router.post("/ingest/batches", response_model=IngestBatchOut, status_code=202)
+async def queue_ingest(
+    items: List[MetricRecordCreate],
+    response: Response,
+    current: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+):
+    await db.run_sync(lambda s: ensure_datasets_access({i.dataset_id for i in items}, current, s))
+    return await run_in_threadpool(metrics.enqueue_batch, items, current, response)
+
+
+@router.get("/ingest/batches/{batch_id}", response_model=IngestBatchOut)
+async def ingest_batch_status(batch_id: str, current: Principal = Depends(get_current_user_async)):
+    return await run_in_threadpool(metrics.ingest_batch_status, batch_id, current)
+
+
+@router.post("/ingest/stream", response_model=StreamIngestSummary)
+async def ingest_metrics_stream(
+    request: Request,
+    response: Response,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$", description="Defaults from the Content-Type header"),
+    current: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+):
+    summary = await metrics.ingest_stream(
+        request,
+        format,
+        check_access=lambda ds_id: db.run_sync(lambda s: has_dataset_access(ds_id, current, s)),
+        commit_batch=lambda batch: db.run_sync(metrics._commit_batch, batch),
+    )
+    if summary.inserted:
+        pin_to_primary(response)
+    return summary
+
+
+@router.get("/latest", response_model=List[DimensionSummary])
+async def latest_summary(
+    request: Request,
+    dataset_id: int = Query(...),
+    current: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    await db.run_sync(lambda s: ensure_dataset_access(dataset_id, current, s))
+
+    async def render():
+        latest = await db.run_sync(latest_by_dimension, [dataset_id])
+        return dimension_summaries(latest.get(dataset_id, {}))
+
+    return await conditional_get_async(request, db, "latest", {"dataset_id": dataset_id}, [dataset_id], render)
+
+
+@router.get("/latest/overview", response_model=List[DatasetLatestSummary])
+async def latest_overview(
+    request: Request,
+    dataset_ids: Optional[str] = Query(None, description="Comma-separated ids; defaults to every dataset you can see"),
+    current: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    requested = await db.run_sync(lambda s: metrics.requested_datasets(dataset_ids, current, s))
+    if not requested:
+        return []
+
+    async def render():
+        latest = await db.run_sync(latest_by_dimension, requested)
+        return await run_in_threadpool(metrics.overview_body, requested, latest)
+
+    return await conditional_get_async(request, db, "latest_overview", {"dataset_ids": requested}, requested, render)
+
+
+@router.get("/anomalies", response_model=List[SeriesAnomalyOut])
+async def anomalies(
+    dataset_ids: Optional[str] = Query(None, description="Comma-separated ids; defaults to every dataset you can see"),
+    z_threshold: Optional[float] = Query(None, gt=0, description="Flag a last point this many stddevs from the recent window"),
+    drift_limit: Optional[float] = Query(None, gt=0, description="Flag an EWMA this many standard errors from the series mean"),
+    include_ok: bool = Query(False, description="Also return series with nothing flagged"),
+    current: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    requested = await db.run_sync(lambda s: metrics.requested_datasets(dataset_ids, current, s))
+    series_stats = await series_anomalies_async(db, requested)
+    return await run_in_threadpool(
+        lambda: _encode(List[SeriesAnomalyOut], metrics.anomalies_body(series_stats, z_threshold, drift_limit, include_ok))
+    )
+
+
+@router.get("/timeseries", response_model=List[TimeseriesResponse])
+async def timeseries(
+    request: Request,
+    dataset_id: int = Query(...),
+    dimension: Optional[DimensionEnum] = Query(None),
+    metric_name: Optional[str] = Query(None),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    bucket: Optional[str] = Query(None, pattern=f"^({'|'.join(BUCKET_SECONDS)})$", description="Aggregate points into time buckets"),
+    agg: str = Query("avg", pattern=f"^({'|'.join(AGGREGATES)})$", description="Aggregate applied per bucket"),
+    max_points: Optional[int] = Query(
+        None, ge=3, description="Downsample each series to at most this many points (LTTB; long ranges are pre-aggregated with agg)"
+    ),
+    format: str = Query(
+        "points",
+        pattern="^(points|columnar|arrow|parquet)$",
+        description="columnar returns parallel timestamps (epoch ms) and values arrays per metric; arrow/parquet need pyarrow",
+    ),
+    current: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    await db.run_sync(lambda s: ensure_dataset_access(dataset_id, current, s))
+
+    async def render():
+        series = await load_series_async(
+            db,
+            dataset_id,
+            dimension=dimension,
+            metric_name=metric_name,
+            start=start,
+            end=end,
+            bucket=bucket,
+            agg=agg,
+            max_points=max_points,
+        )
+        return await run_in_threadpool(metrics.timeseries_body, series, format)
+
+    params = metrics.timeseries_params(dataset_id, dimension, metric_name, start, end, bucket, agg, max_points, format)
+    return await conditional_get_async(request, db, "timeseries", params, [dataset_id], render)
+
+
+async def _stream_export(clauses: list, after: Optional[Cursor], batch_size: int, bind):
+    async with bind.connect() as conn:
+        result = await conn.stream(export_statement(conn.dialect.name, clauses, after))
+        async for partition in result.partitions(batch_size):
+            yield await run_in_threadpool(lambda: b"".join(row_to_ndjson(row) for row in partition))
+
+
+@router.get("/export", response_model=MetricExportPage)
+async def export_metrics(
+    dataset_id: int = Query(...),
+    dimension: Optional[DimensionEnum] = Query(None),
+    metric_name: Optional[str] = Query(None),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1),
+    stream: bool = Query(False, description="Stream every matching row as NDJSON instead of one page"),
+    current: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    await db.run_sync(lambda s: ensure_dataset_access(dataset_id, current, s))
+    settings = get_settings()
+    after = metrics.export_cursor(cursor)
+    clauses = metric_filters(dataset_id, dimension, metric_name, start, end)
+
+    if stream:
+        return StreamingResponse(
+            _stream_export(clauses, after, settings.EXPORT_STREAM_BATCH_SIZE, db.bind),
+            media_type="application/x-ndjson",
+        )
+
+    limit = min(limit or settings.EXPORT_PAGE_SIZE, settings.EXPORT_MAX_PAGE_SIZE)
+    rows = (await db.execute(export_statement(db.bind.dialect.name, clauses, after, limit + 1))).all()
+    return await run_in_threadpool(lambda: _encode(MetricExportPage, metrics.export_page(rows, limit)))
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from ..db import get_db
+from ..deps import Principal, ensure_dataset_access, get_current_admin, get_current_user, visible_dataset_ids
+from ..models import Dataset, QualityRule, RuleExecution, RuleRun
+from ..schemas import QualityRuleCreate, QualityRuleOut, QualityRuleUpdate, RuleEvaluationOut, RuleExecutionOut, RuleRunOut, RuleRunRequest
+from ..services.fused import FieldCheck, render_check_sql, validate_check
+from ..services.result_cache import get_result_cache, sql_hash
+from ..services.rules import RuleSpec, evaluate_thresholds, get_rule_runner, get_target_engine, load_rules
+
+router = APIRouter(prefix="/rules", tags=["rules"])
+
+
+@router.get("/", response_model=List[QualityRuleOut])
+def list_rules(
+    dataset_id: Optional[int] = Query(None),
+    current: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    q = db.query(QualityRule)
+    if dataset_id is not None:
+        ensure_dataset_access(dataset_id, current, db)
+        q = q.filter(QualityRule.dataset_id == dataset_id)
+    elif not current.is_admin:
+        q = q.filter(QualityRule.dataset_id.in_(visible_dataset_ids(current, db)))
+    return q.order_by(QualityRule.dataset_id, QualityRule.id).all()
+
+
+def _apply_check(rule: QualityRule) -> None:
+    # Structured checks keep a rendered copy of their SQL; the engine re-renders it at run time.
+    try:
+        validate_check(rule.check_name, rule.cdm_table_name, rule.cdm_field_name, rule.check_value, rule.incremental_column)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if rule.check_name:
+        check = FieldCheck(rule.check_name, rule.cdm_table_name, rule.cdm_field_name, rule.check_value)
+        rule.sql_query = render_check_sql(get_target_engine().dialect, check)
+    elif not rule.sql_query:
+        raise HTTPException(status_code=400, detail="sql_query is required unless check_name is set")
+
+
+@router.post("/", response_model=QualityRuleOut)
+def create_rule(payload: QualityRuleCreate, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    if not db.get(Dataset, payload.dataset_id):
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    existing = db.query(QualityRule).filter(QualityRule.dataset_id == payload.dataset_id, QualityRule.name == payload.name).first()
+    if existing:
+        raise HTTPException(status_code=400, detail="Rule name already exists for dataset")
+    rule = QualityRule(**payload.model_dump())
+    _apply_check(rule)
+    db.add(rule)
+    db.commit()
+    db.refresh(rule)
+    return rule
+
+
+@router.patch("/{rule_id}", response_model=QualityRuleOut)
+def update_rule(rule_id: int, payload: QualityRuleUpdate, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    rule = db.get(QualityRule, rule_id)
+    if not rule:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    for field, value in payload.model_dump(exclude_unset=True).items():
+        setattr(rule, field, value)
+    _apply_check(rule)
+    db.commit()
+    db.refresh(rule)
+    return rule
+
+
+@router.get("/{rule_id}/evaluation", response_model=RuleEvaluationOut)
+def get_rule_evaluation(rule_id: int, current: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    # The last cached result checked against the rule's current thresholds, without
+    # querying the target database - e.g. while tuning threshold_min/threshold_max.
+    rule = db.get(QualityRule, rule_id)
+    if not rule:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    ensure_dataset_access(rule.dataset_id, current, db)
+    cache = get_result_cache()
+    target = get_target_engine()
+    spec = RuleSpec.from_rule(rule)
+    sql = render_check_sql(target.dialect, spec.check) if spec.check else spec.sql_query
+    entry = cache.latest(sql_hash(target, sql)) if cache is not None else None
+    if entry is None:
+        raise HTTPException(status_code=404, detail="No cached result for this rule")
+    return RuleEvaluationOut(
+        rule_id=rule.id,
+        metric_value=entry.value,
+        num_violated_rows=entry.num_violated_rows,
+        num_denominator_rows=entry.num_denominator_rows,
+        passed=evaluate_thresholds(entry.value, rule.threshold_min, rule.threshold_max),
+        computed_at=datetime.utcfromtimestamp(entry.computed_at),
+    )
+
+
+def _run_out(run: RuleRun, executions: List[RuleExecution]) -> RuleRunOut:
+    return RuleRunOut(
+        run_id=run.id,
+        status=run.status,
+        rules=run.rules,
+        error=run.error,
+        created_at=run.created_at,
+        finished_at=run.finished_at,
+        executions=[RuleExecutionOut.model_validate(e) for e in executions],
+    )
+
+
+@router.post("/run", response_model=RuleRunOut, status_code=202)
+def run_quality_rules(payload: RuleRunRequest, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    # Rules run in the background; poll GET /rules/runs/{run_id} for the executions.
+    rules = load_rules(db, dataset_ids=payload.dataset_ids, rule_ids=payload.rule_ids, full=payload.full)
+    return _run_out(get_rule_runner().submit(db, rules), [])
+
+
+@router.get("/runs/{run_id}", response_model=RuleRunOut)
+def get_rule_run(run_id: str, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    run = db.get(RuleRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    executions = db.query(RuleExecution).filter(RuleExecution.run_id == run_id).order_by(RuleExecution.id).all()
+    return _run_out(run, executions)
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import hmac
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy.orm import Session
+
+from ..core.cache import cache_stats
+from ..core.config import get_settings
+from ..core.pooling import pool_stats
+from ..core.security import password_hasher
+from ..core.telemetry import render_metrics
+from ..db import get_db, get_replica_router
+from ..deps import bearer_scheme, get_current_admin, get_current_user
+from ..services.ingest_queue import get_ingest_spool
+from ..services.pubsub import get_broker
+
+router = APIRouter(prefix="/system", tags=["system"])
+
+
+@router.get("/caches")
+def get_cache_stats(admin=Depends(get_current_admin)) -> Dict[str, Dict[str, Any]]:
+    return cache_stats()
+
+
+@router.get("/password-hasher")
+def get_password_hasher_stats(admin=Depends(get_current_admin)) -> Dict[str, Any]:
+    return password_hasher.stats()
+
+
+@router.get("/live")
+def get_live_stats(admin=Depends(get_current_admin)) -> Dict[str, Any]:
+    return get_broker().stats()
+
+
+@router.get("/ingest-queue")
+def get_ingest_queue_stats(admin=Depends(get_current_admin)) -> Dict[str, Any]:
+    spool = get_ingest_spool()
+    return spool.stats() if spool is not None else {"enabled": False}
+
+
+@router.get("/db-pool")
+def get_db_pool_stats(admin=Depends(get_current_admin)) -> Dict[str, Dict[str, Any]]:
+    return pool_stats()
+
+
+@router.get("/replicas")
+def get_replica_stats(admin=Depends(get_current_admin)) -> Dict[str, Any]:
+    router = get_replica_router()
+    return router.stats() if router is not None else {"enabled": False}
+
+
+def _metrics_reader(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    db: Session = Depends(get_db),
+) -> None:
+    # Scrapers cannot log in, so a static token is accepted alongside admin JWTs.
+    token = get_settings().TELEMETRY_SCRAPE_TOKEN
+    if token and credentials is not None and hmac.compare_digest(credentials.credentials.encode(), token.encode()):
+        return
+    get_current_admin(get_current_user(credentials, db))
+
+
+@router.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(_metrics_reader)])
+def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -3,26 +3,27 @@ from __future__ import annotations
 from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 from ..db import get_db
-from ..deps import get_current_admin
-from ..core.security import hash_password
+from ..deps import get_current_admin, invalidate_dataset_access, invalidate_principal
+from ..core.security import hash_password_async
 from ..models import User, Dataset, UserDatasetAccess
 from ..schemas import UserCreate, UserOut, UserUpdate
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
-@router.post("/", response_model=UserOut)
-def create_user(payload: UserCreate, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
-    existing = db.query(User).filter(User.email == payload.email).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Email already registered")
+def _email_taken(db: Session, email: str) -> bool:
+    return db.query(User).filter(User.email == email).first() is not None
+
+
+def _create_user(db: Session, payload: UserCreate, hashed_password: str) -> User:
     user = User(
         email=payload.email,
         full_name=payload.full_name,
-        hashed_password=hash_password(payload.password),
+        hashed_password=hashed_password,
         is_active=payload.is_active,
         is_admin=payload.is_admin,
     )
@@ -35,10 +36,19 @@ def create_user(payload: UserCreate, db: Session = Depends(get_db), admin=Depend
             db.add(UserDatasetAccess(user_id=user.id, dataset_id=ds.id))
 
     db.commit()
+    invalidate_dataset_access(user.id)
     db.refresh(user)
     return user
 
 
+@router.post("/", response_model=UserOut)
+async def create_user(payload: UserCreate, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+    if await run_in_threadpool(_email_taken, db, payload.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    hashed_password = await hash_password_async(payload.password)
+    return await run_in_threadpool(_create_user, db, payload, hashed_password)
+
+
 @router.get("/", response_model=List[UserOut])
 def list_users(db: Session = Depends(get_db), admin=Depends(get_current_admin)):
     return db.query(User).all()
@@ -65,5 +75,7 @@ def update_user(user_id: int, payload: UserUpdate, db: Session = Depends(get_db)
                 db.add(UserDatasetAccess(user_id=user.id, dataset_id=ds.id))
 
     db.commit()
+    invalidate_principal(user.email)
+    invalidate_dataset_access(user.id)
     db.refresh(user)
     return user
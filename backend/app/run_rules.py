@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import argparse
+from collections import Counter
+
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal, engine
+from .models import Base
+from .services.rules import load_rules, run_rules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run active quality rules and record their results")
+    parser.add_argument("--dataset-id", type=int, action="append", dest="dataset_ids")
+    parser.add_argument("--rule-id", type=int, action="append", dest="rule_ids")
+    parser.add_argument("--full", action="store_true", help="rescan incremental rules instead of resuming from their watermarks")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db: Session = SessionLocal()
+    try:
+        rules = load_rules(db, dataset_ids=args.dataset_ids, rule_ids=args.rule_ids, full=args.full)
+        executions = run_rules(db, rules)
+        statuses = Counter(e.status for e in executions)
+        total_ms = sum(e.duration_ms for e in executions)
+        incremental = sum(1 for e in executions if e.incremental)
+        print(f"Ran {len(executions)} rules ({dict(statuses)}, {incremental} incremental), {total_ms / 1000:.1f}s of query time.")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -88,6 +88,36 @@ class MetricRecordOut(MetricRecordBase):
     }
 
 
+class IngestSummary(BaseModel):
+    inserted: int
+
+
+class IngestLineError(BaseModel):
+    line: int
+    error: str
+
+
+class StreamIngestSummary(IngestSummary):
+    failed: int = 0
+    errors: List[IngestLineError] = []
+    errors_truncated: bool = False
+
+
+class IngestBatchOut(BaseModel):
+    batch_id: str
+    status: str
+    rows: int
+    inserted: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class MetricExportPage(BaseModel):
+    items: List[MetricRecordOut]
+    next_cursor: Optional[str] = None
+
+
 class MetricsSummaryPoint(BaseModel):
     recorded_at: datetime
     value: float
@@ -99,6 +129,117 @@ class DimensionSummary(BaseModel):
     latest_at: Optional[datetime] = None
 
 
+class DatasetLatestSummary(BaseModel):
+    dataset_id: int
+    dimensions: List[DimensionSummary]
+
+
 class TimeseriesResponse(BaseModel):
     metric_name: str
     points: List[MetricsSummaryPoint]
+
+
+
+class SeriesAnomalyOut(BaseModel):
+    dataset_id: int
+    series_id: int
+    dimension: DimensionEnum
+    metric_name: str
+    points: int
+    last_value: float
+    last_recorded_at: datetime
+    threshold_min: Optional[float] = None
+    threshold_max: Optional[float] = None
+    breach: Optional[str] = None
+    breach_points: int = 0
+    zscore: Optional[float] = None
+    drift_score: Optional[float] = None
+    anomalies: List[str] = []
+
+# Quality rules
+class QualityRuleBase(BaseModel):
+    dataset_id: int
+    name: str
+    description: Optional[str] = None
+    sql_query: str
+    dimension: Optional[DimensionEnum] = None
+    threshold_min: Optional[float] = None
+    threshold_max: Optional[float] = None
+    check_name: Optional[str] = None
+    cdm_table_name: Optional[str] = None
+    cdm_field_name: Optional[str] = None
+    check_value: Optional[float] = None
+    incremental_column: Optional[str] = None
+    is_active: bool = True
+
+
+class QualityRuleCreate(QualityRuleBase):
+    # Structured checks (check_name set) get their SQL rendered server-side.
+    sql_query: Optional[str] = None
+
+
+class QualityRuleUpdate(BaseModel):
+    description: Optional[str] = None
+    sql_query: Optional[str] = None
+    dimension: Optional[DimensionEnum] = None
+    threshold_min: Optional[float] = None
+    threshold_max: Optional[float] = None
+    check_name: Optional[str] = None
+    cdm_table_name: Optional[str] = None
+    cdm_field_name: Optional[str] = None
+    check_value: Optional[float] = None
+    incremental_column: Optional[str] = None
+    is_active: Optional[bool] = None
+
+
+class QualityRuleOut(QualityRuleBase):
+    id: int
+
+    model_config = {
+        'from_attributes': True
+    }
+
+
+class RuleRunRequest(BaseModel):
+    dataset_ids: Optional[List[int]] = None
+    rule_ids: Optional[List[int]] = None
+    # Ignore stored watermarks and rescan incremental rules from scratch.
+    full: bool = False
+
+
+class RuleExecutionOut(BaseModel):
+    rule_id: int
+    dataset_id: int
+    status: str
+    metric_value: Optional[float] = None
+    num_violated_rows: Optional[int] = None
+    num_denominator_rows: Optional[int] = None
+    incremental: bool = False
+    cached: bool = False
+    passed: Optional[bool] = None
+    duration_ms: float
+    error: Optional[str] = None
+    started_at: datetime
+
+    model_config = {
+        'from_attributes': True
+    }
+
+
+class RuleRunOut(BaseModel):
+    run_id: str
+    status: str
+    rules: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    executions: List[RuleExecutionOut] = []
+
+
+class RuleEvaluationOut(BaseModel):
+    rule_id: int
+    metric_value: Optional[float] = None
+    num_violated_rows: Optional[int] = None
+    num_denominator_rows: Optional[int] = None
+    passed: Optional[bool] = None
+    computed_at: datetime
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from ..core.cache import TTLCache, register_cache
+from ..core.config import get_settings
+from ..models import DimensionEnum, MetricRecord, MetricSeries, QualityRule
+from .versions import get_versions
+
+
+# (dimension, metric_name) -> (threshold_min, threshold_max) for one dataset.
+Thresholds = Dict[Tuple[DimensionEnum, str], Tuple[Optional[float], Optional[float]]]
+
+
+@dataclass(frozen=True)
+class SeriesStats:
+    dataset_id: int
+    series_id: int
+    dimension: DimensionEnum
+    metric_name: str
+    points: int
+    last_value: float
+    last_recorded_at: datetime
+    threshold_min: Optional[float]
+    threshold_max: Optional[float]
+    breach_points: int
+    zscore: Optional[float]
+    drift_score: Optional[float]
+
+    @property
+    def breach(self) -> Optional[str]:
+        if self.threshold_min is not None and self.last_value < self.threshold_min:
+            return "below_min"
+        if self.threshold_max is not None and self.last_value > self.threshold_max:
+            return "above_max"
+        return None
+
+    def anomalies(self, z_threshold: float, drift_limit: float) -> List[str]:
+        flags = []
+        if self.breach is not None:
+            flags.append("breach")
+        if self.zscore is not None and abs(self.zscore) > z_threshold:
+            flags.append("zscore")
+        if self.drift_score is not None and abs(self.drift_score) > drift_limit:
+            flags.append("drift")
+        return flags
+
+
+_settings = get_settings()
+# Statistics per dataset, keyed by its data version and rule thresholds, so they are
+# recomputed only after new points land or a threshold changes.
+stats_cache: TTLCache[List[SeriesStats]] = register_cache(
+    "anomalies",
+    TTLCache(maxsize=_settings.ANOMALY_CACHE_MAX_ENTRIES, ttl=_settings.ANOMALY_CACHE_TTL_SECONDS),
+)
+
+
+def series_statistics(
+    series_ids: np.ndarray,
+    values: np.ndarray,
+    window: int,
+    alpha: float,
+    min_points: int,
+    threshold_min: Optional[np.ndarray] = None,
+    threshold_max: Optional[np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    # All series concatenated, each contiguous and in time order. Returns one entry per
+    # series (in order of first appearance):
+    # - zscore: last point against the mean/stddev of the `window` points before it;
+    # - drift_score: the series' EWMA at its last point, in units of the EWMA's own
+    #   standard error around the series mean (an EWMA control chart statistic);
+    # - breach_points: points outside [threshold_min, threshold_max] (NaN = unbounded).
+    # Series shorter than min_points get NaN scores.
+    n = len(values)
+    starts = np.flatnonzero(np.r_[True, series_ids[1:] != series_ids[:-1]]) if n else np.zeros(0, dtype=np.int64)
+    lengths = np.diff(np.r_[starts, n])
+    last = starts + lengths - 1
+    segment = np.repeat(np.arange(len(starts)), lengths)
+
+    # Centre each series on its mean so the running sums below keep their precision.
+    means = np.bincount(segment, weights=values, minlength=len(starts)) / np.maximum(lengths, 1)
+    x = values - means[segment]
+    # Stddevs below this are treated as a flat line; any change from it scores huge.
+    floor = 1e-9 * np.maximum(1.0, np.abs(means))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sums = np.r_[0.0, np.cumsum(x)]
+        squares = np.r_[0.0, np.cumsum(x * x)]
+        lo = np.maximum(starts, last - window)
+        count = last - lo
+        mu = (sums[last] - sums[lo]) / count
+        var = (squares[last] - squares[lo] - count * mu * mu) / (count - 1)
+        std = np.maximum(np.sqrt(np.maximum(var, 0.0)), floor)
+        zscore = np.where(lengths >= min_points, (x[last] - mu) / std, np.nan)
+
+        age = np.repeat(last, lengths) - np.arange(n)
+        weights = (1.0 - alpha) ** age
+        weight_sum = np.bincount(segment, weights=weights, minlength=len(starts))
+        ewma = np.bincount(segment, weights=weights * x, minlength=len(starts)) / weight_sum
+        # Variance factor of the weighted mean of i.i.d. points.
+        ewma_factor = np.bincount(segment, weights=weights * weights, minlength=len(starts)) / (weight_sum * weight_sum)
+        series_std = np.sqrt(np.bincount(segment, weights=x * x, minlength=len(starts)) / (lengths - 1))
+        series_std = np.maximum(series_std, floor)
+        drift_score = np.where(lengths >= min_points, ewma / (series_std * np.sqrt(ewma_factor)), np.nan)
+
+        if threshold_min is None:
+            threshold_min = np.full(len(starts), np.nan)
+        if threshold_max is None:
+            threshold_max = np.full(len(starts), np.nan)
+        outside = (values < threshold_min[segment]) | (values > threshold_max[segment])
+        breach_points = np.bincount(segment, weights=outside, minlength=len(starts)).astype(np.int64)
+
+    return {
+        "series_id": series_ids[starts],
+        "points": lengths,
+        "last": last,
+        "zscore": zscore,
+        "drift_score": drift_score,
+        "breach_points": breach_points,
+    }
+
+
+def load_thresholds(db: Session, dataset_ids: Collection[int]) -> Dict[int, Thresholds]:
+    # Rule results are stored under the rule's name and dimension (validity if unset).
+    rows = db.execute(
+        select(QualityRule.dataset_id, QualityRule.dimension, QualityRule.name, QualityRule.threshold_min, QualityRule.threshold_max)
+        .where(
+            QualityRule.dataset_id.in_(sorted(set(dataset_ids))),
+            QualityRule.is_active.is_(True),
+            or_(QualityRule.threshold_min.is_not(None), QualityRule.threshold_max.is_not(None)),
+        )
+    )
+    thresholds: Dict[int, Thresholds] = {}
+    for ds_id, dimension, name, threshold_min, threshold_max in rows:
+        thresholds.setdefault(ds_id, {})[(dimension or DimensionEnum.validity, name)] = (threshold_min, threshold_max)
+    return thresholds
+
+
+def _history_statement(dialect: str, dataset_ids: List[int], lookback: int):
+    # The latest `lookback` raw points of every series, oldest first within a series.
+    # Each series is read backwards on ix_metrics_series_time_id and stops after
+    # `lookback` rows, instead of ranking the series' whole history.
+    latest = aliased(MetricRecord)
+    newest = (
+        select(latest.id)
+        .where(latest.series_id == MetricSeries.id)
+        .order_by(latest.recorded_at.desc(), latest.id.desc())
+        .limit(lookback)
+    )
+    if dialect == "postgresql":
+        points = newest.add_columns(latest.recorded_at, latest.metric_value).lateral()
+        stmt = select(MetricSeries.id, points.c.recorded_at, points.c.metric_value).join(points, true())
+        order = (points.c.recorded_at, points.c.id)
+    else:
+        # No LATERAL (SQLite): the per-series subquery yields rowids to look up.
+        stmt = select(MetricSeries.id, MetricRecord.recorded_at, MetricRecord.metric_value).join(
+            MetricRecord, MetricRecord.id.in_(newest.correlate(MetricSeries).scalar_subquery())
+        )
+        order = (MetricRecord.recorded_at, MetricRecord.id)
+    return stmt.where(MetricSeries.dataset_id.in_(dataset_ids)).order_by(MetricSeries.id, *order)
+
+
+def _load_history(db: Session, dataset_ids: List[int]) -> Tuple[Dict[int, Tuple[int, DimensionEnum, str]], List[Any]]:
+    catalogue = {
+        series_id: (ds_id, dimension, name)
+        for series_id, ds_id, dimension, name in db.execute(
+            select(MetricSeries.id, MetricSeries.dataset_id, MetricSeries.dimension, MetricSeries.metric_name)
+            .where(MetricSeries.dataset_id.in_(dataset_ids))
+        )
+    }
+    dialect = db.get_bind().dialect.name
+    rows = db.execute(_history_statement(dialect, dataset_ids, get_settings().ANOMALY_LOOKBACK_POINTS)).all()
+    return catalogue, rows
+
+
+def _compute(
+    dataset_ids: List[int],
+    thresholds: Dict[int, Thresholds],
+    catalogue: Dict[int, Tuple[int, DimensionEnum, str]],
+    rows: List[Any],
+) -> Dict[int, List[SeriesStats]]:
+    settings = get_settings()
+    results: Dict[int, List[SeriesStats]] = {ds_id: [] for ds_id in dataset_ids}
+    if not rows:
+        return results
+
+    series_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+    first = np.flatnonzero(np.r_[True, series_ids[1:] != series_ids[:-1]])
+    bounds = []
+    for series_id in series_ids[first].tolist():
+        ds_id, dimension, name = catalogue[series_id]
+        bounds.append(thresholds.get(ds_id, {}).get((dimension, name), (None, None)))
+    threshold_min = np.array([np.nan if lo is None else lo for lo, _ in bounds], dtype=np.float64)
+    threshold_max = np.array([np.nan if hi is None else hi for _, hi in bounds], dtype=np.float64)
+
+    stats = series_statistics(
+        series_ids,
+        values,
+        window=settings.ANOMALY_ZSCORE_WINDOW,
+        alpha=settings.ANOMALY_EWMA_ALPHA,
+        min_points=settings.ANOMALY_MIN_POINTS,
+        threshold_min=threshold_min,
+        threshold_max=threshold_max,
+    )
+    for i, series_id in enumerate(stats["series_id"].tolist()):
+        ds_id, dimension, name = catalogue[series_id]
+        last = int(stats["last"][i])
+        zscore = float(stats["zscore"][i])
+        drift_score = float(stats["drift_score"][i])
+        results[ds_id].append(SeriesStats(
+            dataset_id=ds_id,
+            series_id=series_id,
+            dimension=dimension,
+            metric_name=name,
+            points=int(stats["points"][i]),
+            last_value=float(values[last]),
+            last_recorded_at=rows[last][1],
+            threshold_min=bounds[i][0],
+            threshold_max=bounds[i][1],
+            breach_points=int(stats["breach_points"][i]),
+            zscore=None if math.isnan(zscore) else zscore,
+            drift_score=None if math.isnan(drift_score) else drift_score,
+        ))
+    return results
+
+
+def _cache_key(ds_id: int, version: int, thresholds: Thresholds) -> Tuple[Any, ...]:
+    settings = get_settings()
+    return (
+        ds_id,
+        version,
+        tuple(sorted((dimension.value, name, bounds) for (dimension, name), bounds in thresholds.items())),
+        settings.ANOMALY_LOOKBACK_POINTS,
+        settings.ANOMALY_ZSCORE_WINDOW,
+        settings.ANOMALY_EWMA_ALPHA,
+        settings.ANOMALY_MIN_POINTS,
+    )
+
+
+def _cached(db: Session, dataset_ids: Collection[int]):
+    # Versions are read before the history, so a cached entry can only be newer than its key.
+    ids = sorted(set(dataset_ids))
+    versions = get_versions(db, ids)
+    thresholds = load_thresholds(db, ids)
+    keys = {ds_id: _cache_key(ds_id, versions[ds_id], thresholds.get(ds_id, {})) for ds_id in ids}
+    found: Dict[int, List[SeriesStats]] = {}
+    for ds_id in ids:
+        cached = stats_cache.get(keys[ds_id])
+        if cached is not None:
+            found[ds_id] = cached
+    return ids, thresholds, keys, found
+
+
+def _store(keys: Dict[int, Tuple[Any, ...]], found: Dict[int, List[SeriesStats]], computed: Dict[int, List[SeriesStats]]) -> None:
+    for ds_id, stats in computed.items():
+        stats_cache.set(keys[ds_id], stats)
+    found.update(computed)
+
+
+def series_anomalies(db: Session, dataset_ids: Collection[int]) -> List[SeriesStats]:
+    ids, thresholds, keys, found = _cached(db, dataset_ids)
+    missing = [ds_id for ds_id in ids if ds_id not in found]
+    if missing:
+        _store(keys, found, _compute(missing, thresholds, *_load_history(db, missing)))
+    return [stats for ds_id in ids for stats in found[ds_id]]
+
+
+async def series_anomalies_async(db: AsyncSession, dataset_ids: Collection[int]) -> List[SeriesStats]:
+    # The queries are awaited; the NumPy statistics run in the threadpool.
+    ids, thresholds, keys, found = await db.run_sync(_cached, dataset_ids)
+    missing = [ds_id for ds_id in ids if ds_id not in found]
+    if missing:
+        catalogue, rows = await db.run_sync(_load_history, missing)
+        _store(keys, found, await run_in_threadpool(_compute, missing, thresholds, catalogue, rows))
+    return [stats for ds_id in ids for stats in found[ds_id]]
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import List, Sequence, Tuple
+
+
+Point = Tuple[datetime, float]
+
+
+def epoch_ms(ts: datetime) -> int:
+    # Naive timestamps are stored as UTC.
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+
+def lttb(points: Sequence[Point], threshold: int) -> List[Point]:
+    # Largest-Triangle-Three-Buckets: keep the first and last points and, for every
+    # bucket in between, the point forming the largest triangle with its neighbours.
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    xs = [epoch_ms(p[0]) for p in points]
+    ys = [p[1] for p in points]
+    every = (n - 2) / (threshold - 2)
+
+    sampled: List[Point] = [points[0]]
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        span = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / span
+        avg_y = sum(ys[avg_start:avg_end]) / span
+
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        max_area = -1.0
+        chosen = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                chosen = j
+        sampled.append(points[chosen])
+        a = chosen
+    sampled.append(points[-1])
+    return sampled
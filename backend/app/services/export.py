@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy import and_, or_, select, true, tuple_
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.visitors import iterate
+
+from ..models import MetricRecord, MetricSeries
+from .timeseries import RECORDS
+
+
+EXPORT_COLUMNS = (
+    MetricRecord.id,
+    MetricSeries.dataset_id,
+    MetricSeries.dimension,
+    MetricSeries.metric_name,
+    MetricRecord.metric_value,
+    MetricRecord.recorded_at,
+)
+
+Cursor = Tuple[datetime, int]
+
+
+def encode_cursor(recorded_at: datetime, record_id: int) -> str:
+    raw = f"{recorded_at.isoformat()}|{record_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    ts, record_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rsplit("|", 1)
+    return datetime.fromisoformat(ts), int(record_id)
+
+
+def _keyset(after: Cursor):
+    # The row-value comparison is spelled out so it works on every backend.
+    ts, record_id = after
+    return or_(MetricRecord.recorded_at > ts, and_(MetricRecord.recorded_at == ts, MetricRecord.id > record_id))
+
+
+def export_statement(dialect: str, clauses: list, after: Optional[Cursor] = None, limit: Optional[int] = None):
+    # Keyset order on (recorded_at, id), read through ix_metrics_series_time_id so a
+    # page never walks other datasets' rows.
+    if dialect != "postgresql":
+        # SQLite already plans this as per-series index searches plus a bounded sort.
+        stmt = select(*EXPORT_COLUMNS).select_from(RECORDS).where(*clauses)
+        if after is not None:
+            stmt = stmt.where(_keyset(after))
+        stmt = stmt.order_by(MetricRecord.recorded_at, MetricRecord.id)
+        return stmt.limit(limit) if limit is not None else stmt
+
+    # On PostgreSQL an ORDER BY ... LIMIT lets the planner pick the table-wide
+    # ix_metrics_time_id instead. Spell the dataset-scoped plan out: every series of
+    # the dataset contributes its first `limit` rows after the cursor (LATERAL), and
+    # those are merged. Time-range filters go into the per-series scans, series
+    # filters (dataset, dimension, name) outside them.
+    on_records = [
+        any(getattr(element, "table", None) is MetricRecord.__table__ for element in iterate(clause)) for clause in clauses
+    ]
+    series_clauses = [clause for clause, on_record in zip(clauses, on_records) if not on_record]
+    record_clauses = [clause for clause, on_record in zip(clauses, on_records) if on_record]
+    if after is not None:
+        # A row-value comparison, which PostgreSQL turns into an index range.
+        record_clauses.append(tuple_(MetricRecord.recorded_at, MetricRecord.id) > tuple_(*after))
+    page = (
+        select(MetricRecord.id, MetricRecord.metric_value, MetricRecord.recorded_at)
+        .where(MetricRecord.series_id == MetricSeries.id, *record_clauses)
+        .order_by(MetricRecord.recorded_at, MetricRecord.id)
+        .limit(limit)
+        .correlate(MetricSeries)
+        .lateral("page")
+    )
+    stmt = (
+        select(
+            page.c.id, MetricSeries.dataset_id, MetricSeries.dimension, MetricSeries.metric_name,
+            page.c.metric_value, page.c.recorded_at,
+        )
+        .select_from(MetricSeries)
+        .join(page, true())
+        .where(*series_clauses)
+        .order_by(page.c.recorded_at, page.c.id)
+    )
+    return stmt.limit(limit) if limit is not None else stmt
+
+
+def row_to_dict(row: Any) -> Dict[str, Any]:
+    return dict(row._mapping)
+
+
+def row_to_ndjson(row: Any) -> bytes:
+    item = row_to_dict(row)
+    item["dimension"] = item["dimension"].value
+    item["recorded_at"] = item["recorded_at"].isoformat()
+    return (json.dumps(item) + "\n").encode("utf-8")
+
+
+def iter_ndjson(db: Session, clauses: list, after: Optional[Cursor], batch_size: int) -> Iterator[bytes]:
+    # Server-side cursor: rows are fetched batch_size at a time and never held all at once.
+    stmt = export_statement(db.get_bind().dialect.name, clauses, after).execution_options(stream_results=True, yield_per=batch_size)
+    for row in db.execute(stmt):
+        yield row_to_ndjson(row)
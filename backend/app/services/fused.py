@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.engine import Dialect
+
+
+@dataclass(frozen=True)
+class CheckTemplate:
+    # Row-level predicates of an OHDSI field check (inst/sql/sql_server/*.sql):
+    # `violated` marks a violating row, `eligible` a denominator row (None = every row).
+    violated: str
+    eligible: Optional[str] = None
+    needs_value: bool = False
+
+
+CHECK_TEMPLATES: Dict[str, CheckTemplate] = {
+    "isRequired": CheckTemplate(violated="{field} IS NULL"),
+    "measureValueCompleteness": CheckTemplate(violated="{field} IS NULL"),
+    "plausibleValueLow": CheckTemplate(violated="{field} < {value}", eligible="{field} IS NOT NULL", needs_value=True),
+    "plausibleValueHigh": CheckTemplate(violated="{field} > {value}", eligible="{field} IS NOT NULL", needs_value=True),
+}
+
+
+@dataclass(frozen=True)
+class FieldCheck:
+    check_name: str
+    table: str
+    field: str
+    value: Optional[float] = None
+
+
+@dataclass
+class CheckCounts:
+    num_violated_rows: int
+    num_denominator_rows: int
+
+    @property
+    def pct_violated_rows(self) -> float:
+        if self.num_denominator_rows == 0:
+            return 0.0
+        return self.num_violated_rows / self.num_denominator_rows
+
+    def __add__(self, other: "CheckCounts") -> "CheckCounts":
+        # Counts over disjoint row sets merge by addition.
+        return CheckCounts(
+            self.num_violated_rows + other.num_violated_rows,
+            self.num_denominator_rows + other.num_denominator_rows,
+        )
+
+
+def validate_check(
+    check_name: Optional[str],
+    table: Optional[str],
+    field: Optional[str],
+    value: Optional[float],
+    incremental_column: Optional[str] = None,
+) -> None:
+    if check_name is None:
+        if incremental_column:
+            raise ValueError("incremental_column is only supported for structured checks")
+        return
+    template = CHECK_TEMPLATES.get(check_name)
+    if template is None:
+        raise ValueError(f"Unsupported check_name {check_name!r}; expected one of {', '.join(CHECK_TEMPLATES)}")
+    if not table or not field:
+        raise ValueError("cdm_table_name and cdm_field_name are required for structured checks")
+    if template.needs_value and (value is None or not math.isfinite(value)):
+        raise ValueError(f"A finite check_value is required for {check_name}")
+
+
+def quote_table(dialect: Dialect, table: str) -> str:
+    return ".".join(dialect.identifier_preparer.quote(part) for part in table.split("."))
+
+
+def _predicates(dialect: Dialect, check: FieldCheck) -> Tuple[str, Optional[str]]:
+    # Identifiers are quoted by the dialect; the only value is a validated float literal.
+    template = CHECK_TEMPLATES[check.check_name]
+    field = dialect.identifier_preparer.quote(check.field)
+    value = repr(float(check.value)) if check.value is not None else None
+    violated = template.violated.format(field=field, value=value)
+    eligible = template.eligible.format(field=field) if template.eligible else None
+    return violated, eligible
+
+
+def render_check_sql(dialect: Dialect, check: FieldCheck) -> str:
+    # Standalone form with the same shape as the OHDSI templates: one scan for the
+    # violating rows and one for the denominator.
+    violated, eligible = _predicates(dialect, check)
+    table = quote_table(dialect, check.table)
+    return (
+        "SELECT num_violated_rows, "
+        "CASE WHEN denominator.num_rows = 0 THEN 0 ELSE 1.0*num_violated_rows/denominator.num_rows END AS pct_violated_rows, "
+        "denominator.num_rows AS num_denominator_rows "
+        f"FROM (SELECT COUNT(*) AS num_violated_rows FROM {table} WHERE {violated}) violated_row_count, "
+        f"(SELECT COUNT(*) AS num_rows FROM {table}{f' WHERE {eligible}' if eligible else ''}) denominator"
+    )
+
+
+def render_fused_sql(
+    dialect: Dialect,
+    table: str,
+    checks: Sequence[FieldCheck],
+    incremental_column: Optional[str] = None,
+    since_watermark: bool = False,
+) -> str:
+    # One pass over the table: a conditional SUM per check for the numerator, and a
+    # shared COUNT(*) or COUNT(field) for the denominators. With an incremental column
+    # the new high-water mark comes back as `hwm`, and since_watermark restricts the
+    # scan to rows past the :watermark parameter.
+    columns: List[str] = ["COUNT(*) AS n_all"]
+    denominators: Dict[str, str] = {}
+    for i, check in enumerate(checks):
+        violated, eligible = _predicates(dialect, check)
+        columns.append(f"SUM(CASE WHEN {violated} THEN 1 ELSE 0 END) AS c{i}")
+        if eligible is not None and check.field not in denominators:
+            denominators[check.field] = f"n{len(denominators)}"
+            columns.append(f"COUNT({dialect.identifier_preparer.quote(check.field)}) AS {denominators[check.field]}")
+    where = ""
+    if incremental_column:
+        column = dialect.identifier_preparer.quote(incremental_column)
+        columns.append(f"MAX({column}) AS hwm")
+        if since_watermark:
+            where = f" WHERE {column} > :watermark"
+    return f"SELECT {', '.join(columns)} FROM {quote_table(dialect, table)}{where}"
+
+
+def read_fused_counts(row: Dict[str, Any], checks: Sequence[FieldCheck]) -> List[CheckCounts]:
+    row = {str(k).lower(): v for k, v in row.items()}
+    denominators: Dict[str, str] = {}
+    counts: List[CheckCounts] = []
+    for i, check in enumerate(checks):
+        if CHECK_TEMPLATES[check.check_name].eligible is None:
+            denominator = row["n_all"]
+        else:
+            denominators.setdefault(check.field, f"n{len(denominators)}")
+            denominator = row[denominators[check.field]]
+        counts.append(CheckCounts(num_violated_rows=int(row[f"c{i}"] or 0), num_denominator_rows=int(denominator or 0)))
+    return counts
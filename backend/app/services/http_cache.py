@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Collection, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..core.cache import TTLCache, register_cache
+from ..core.config import get_settings
+from .versions import get_versions
+
+
+# Rendered body and media type, keyed by ETag.
+CachedBody = Tuple[bytes, str]
+
+_settings = get_settings()
+response_cache: TTLCache[CachedBody] = register_cache(
+    "http_responses",
+    TTLCache(
+        maxsize=_settings.RESPONSE_CACHE_MAX_ENTRIES,
+        ttl=_settings.RESPONSE_CACHE_TTL_SECONDS,
+        max_weight=_settings.RESPONSE_CACHE_MAX_BYTES,
+        weigh=lambda entry: len(entry[0]),
+    ),
+)
+
+
+def make_etag(scope: str, params: Dict[str, Any], versions: Dict[int, int]) -> str:
+    raw = json.dumps([scope, sorted(params.items()), sorted(versions.items())], default=str, separators=(",", ":"))
+    return '"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison, so a W/ prefix added by a proxy still matches.
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+
+
+def _render(result: Any) -> CachedBody:
+    if isinstance(result, Response):
+        return bytes(result.body), result.media_type
+    return bytes(JSONResponse(jsonable_encoder(result)).body), "application/json"
+
+
+def conditional_get(
+    request: Request,
+    db: Session,
+    scope: str,
+    params: Dict[str, Any],
+    dataset_ids: Collection[int],
+    render: Callable[[], Any],
+) -> Response:
+    # The ETag covers the scope, every parameter that shapes the body (including the
+    # caller's visible datasets where the body depends on them) and the data versions
+    # of the datasets involved. Versions are read before rendering, so a body can only
+    # be newer than its tag - worst case a client refetches once, it never keeps stale data.
+    etag = make_etag(scope, params, get_versions(db, dataset_ids))
+    headers = _headers(etag)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    cached = response_cache.get(etag)
+    if cached is None:
+        cached = _render(render())
+        response_cache.set(etag, cached)
+    body, media_type = cached
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+async def conditional_get_async(
+    request: Request,
+    db: AsyncSession,
+    scope: str,
+    params: Dict[str, Any],
+    dataset_ids: Collection[int],
+    render: Callable[[], Awaitable[Any]],
+) -> Response:
+    # conditional_get for the async routers; the body is encoded in the threadpool.
+    etag = make_etag(scope, params, await db.run_sync(get_versions, dataset_ids))
+    headers = _headers(etag)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    cached = response_cache.get(etag)
+    if cached is None:
+        cached = await run_in_threadpool(_render, await render())
+        response_cache.set(etag, cached)
+    body, media_type = cached
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import codecs
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from ..core.config import get_settings
+from ..models import LatestMetric, MetricRecord
+from .live import stage_metrics_update
+from .rollups import mark_dirty
+from .series import series_catalog, series_key
+from .versions import bump_versions
+
+
+METRIC_COLUMNS = ("dataset_id", "dimension", "metric_name", "metric_value", "recorded_at")
+SERIES_KEY = ("dataset_id", "dimension", "metric_name")
+RECORD_COLUMNS = ("series_id", "metric_value", "recorded_at")
+
+
+@dataclass
+class IngestResult:
+    inserted: int = 0
+    rows: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _chunks(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk: List[Dict[str, Any]] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _utc_naive(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _normalize(row: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    recorded_at = row.get("recorded_at")
+    return {
+        "dataset_id": row["dataset_id"],
+        "dimension": row["dimension"],
+        "metric_name": row["metric_name"],
+        "metric_value": row["metric_value"],
+        "recorded_at": _utc_naive(recorded_at) if recorded_at else now,
+    }
+
+
+def normalize_metrics(rows: Iterable[Dict[str, Any]], now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    # Points without recorded_at are stamped `now`; aware timestamps become naive UTC.
+    now = now or datetime.utcnow()
+    return [_normalize(r, now) for r in rows]
+
+
+def _supports_copy(db: Session) -> bool:
+    return db.get_bind().dialect.driver == "psycopg2"
+
+
+def _copy_chunk(db: Session, chunk: List[Dict[str, Any]]) -> None:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in chunk:
+        writer.writerow([
+            row["series_id"],
+            repr(float(row["metric_value"])),
+            row["recorded_at"].isoformat(),
+        ])
+    buf.seek(0)
+    dbapi_conn = db.connection().connection
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {MetricRecord.__tablename__} ({', '.join(RECORD_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buf,
+        )
+    finally:
+        cursor.close()
+
+
+def _upsert_latest(db: Session, chunk: List[Dict[str, Any]]) -> None:
+    # Points at a series' newest timestamp accumulate, so the summaries can average all
+    # of them; a newer timestamp starts over and an older one is ignored.
+    newest: Dict[tuple, Dict[str, Any]] = {}
+    for row in chunk:
+        key = tuple(row[k] for k in SERIES_KEY)
+        current = newest.get(key)
+        if current is None or row["recorded_at"] > current["recorded_at"]:
+            newest[key] = dict(zip(SERIES_KEY, key), recorded_at=row["recorded_at"], value_sum=row["metric_value"], value_count=1)
+        elif row["recorded_at"] == current["recorded_at"]:
+            current["value_sum"] += row["metric_value"]
+            current["value_count"] += 1
+    values = list(newest.values())
+
+    table = LatestMetric.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(table)
+        same = stmt.excluded.recorded_at == table.c.recorded_at
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(SERIES_KEY),
+            set_={
+                "value_sum": case((same, table.c.value_sum + stmt.excluded.value_sum), else_=stmt.excluded.value_sum),
+                "value_count": case((same, table.c.value_count + stmt.excluded.value_count), else_=stmt.excluded.value_count),
+                "recorded_at": stmt.excluded.recorded_at,
+            },
+            where=stmt.excluded.recorded_at >= table.c.recorded_at,
+        )
+        db.execute(stmt, values)
+        return
+
+    for value in values:
+        key_filter = [table.c[k] == value[k] for k in SERIES_KEY]
+        existing = db.execute(select(table.c.recorded_at, table.c.value_sum, table.c.value_count).where(*key_filter)).first()
+        if existing is None:
+            db.execute(insert(table), value)
+        elif value["recorded_at"] == existing.recorded_at:
+            db.execute(update(table).where(*key_filter).values(
+                value_sum=existing.value_sum + value["value_sum"], value_count=existing.value_count + value["value_count"]
+            ))
+        elif value["recorded_at"] > existing.recorded_at:
+            db.execute(update(table).where(*key_filter).values(
+                value_sum=value["value_sum"], value_count=value["value_count"], recorded_at=value["recorded_at"]
+            ))
+
+
+def insert_metrics(
+    db: Session,
+    rows: Iterable[Dict[str, Any]],
+    *,
+    echo: bool = True,
+    chunk_size: Optional[int] = None,
+    normalized: bool = False,
+) -> IngestResult:
+    # Caller commits; latest_metrics is upserted in the same transaction.
+    # echo returns rows via INSERT ... RETURNING; otherwise COPY on PostgreSQL, executemany elsewhere.
+    # `normalized` rows already went through normalize_metrics.
+    settings = get_settings()
+    chunk_size = chunk_size or settings.INGEST_CHUNK_SIZE
+    now = datetime.utcnow()
+    table = MetricRecord.__table__
+    use_copy = not echo and _supports_copy(db)
+
+    result = IngestResult()
+    oldest: Optional[datetime] = None
+    counts: Dict[int, int] = {}
+    live_points: Dict[int, List[Dict[str, Any]]] = {}
+    if not normalized:
+        rows = (_normalize(r, now) for r in rows)
+    for chunk in _chunks(rows, chunk_size):
+        ids = series_catalog.resolve(db, (series_key(*(row[k] for k in SERIES_KEY)) for row in chunk))
+        for row in chunk:
+            row["series_id"] = ids[series_key(*(row[k] for k in SERIES_KEY))]
+            counts[row["dataset_id"]] = counts.get(row["dataset_id"], 0) + 1
+            points = live_points.setdefault(row["dataset_id"], [])
+            if len(points) < settings.LIVE_MAX_POINTS:
+                points.append(row)
+        records = [{c: row[c] for c in RECORD_COLUMNS} for row in chunk]
+        if echo:
+            stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+            for row, (record_id,) in zip(chunk, db.execute(stmt, records)):
+                result.rows.append({"id": record_id, **{c: row[c] for c in METRIC_COLUMNS}})
+        elif use_copy:
+            _copy_chunk(db, records)
+        else:
+            db.execute(insert(table), records)
+        _upsert_latest(db, chunk)
+        result.inserted += len(chunk)
+        chunk_oldest = min(row["recorded_at"] for row in chunk)
+        oldest = chunk_oldest if oldest is None else min(oldest, chunk_oldest)
+    if oldest is not None:
+        # Backfilled points invalidate rollups already computed for their range.
+        mark_dirty(db, oldest)
+    bump_versions(db, counts)
+    stage_metrics_update(db, live_points, counts)
+    return result
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Split a chunked request body into lines without buffering more than one partial line.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in chunks:
+        try:
+            pending += decoder.decode(chunk)
+        except UnicodeDecodeError as exc:
+            # Hand out the complete lines before the undecodable byte, then fail.
+            *lines, _ = (pending + exc.object[:exc.start].decode("utf-8")).split("\n")
+            for line in lines:
+                yield line.rstrip("\r")
+            raise
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def parse_ndjson_line(line: str) -> Dict[str, Any]:
+    value = json.loads(line)
+    if not isinstance(value, dict):
+        raise ValueError("Expected a JSON object")
+    return value
+
+
+class CsvLineParser:
+    # The first line is the header; empty cells are treated as missing.
+    def __init__(self) -> None:
+        self.header: Optional[List[str]] = None
+
+    def __call__(self, line: str) -> Optional[Dict[str, Any]]:
+        cells = next(csv.reader([line]))
+        if self.header is None:
+            header = [c.strip() for c in cells]
+            missing = set(METRIC_COLUMNS) - {"recorded_at"} - set(header)
+            if missing:
+                raise ValueError(f"CSV header is missing columns: {', '.join(sorted(missing))}")
+            self.header = header
+            return None
+        if len(cells) != len(self.header):
+            raise ValueError(f"Expected {len(self.header)} columns, got {len(cells)}")
+        return {k: v for k, v in zip(self.header, cells) if v != ""}
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from ..core.config import get_settings
+from ..models import IngestBatch
+from ..schemas import MetricRecordCreate
+from .ingest import insert_metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+@dataclass
+class BatchStatus:
+    batch_id: str
+    status: str
+    rows: int
+    user_id: int
+    inserted: Optional[int]
+    error: Optional[str]
+    created_at: float
+    finished_at: Optional[float]
+
+
+class IngestSpool:
+    # Durable FIFO of accepted ingest batches in a local SQLite file (WAL, fsync on
+    # every commit). Several processes on one host may share the file: writers claim
+    # batches under a lease, and a claim older than lease_seconds is assumed to belong
+    # to a dead writer and handed out again - but only within retention_seconds of the
+    # claim, since the writer's record of committed batches (ingested_batches) is only
+    # kept that long; an older claim is failed instead of risking a double insert.
+    # Batches move queued -> writing -> done or failed; finished ones are kept
+    # retention_seconds for the status endpoint.
+
+    def __init__(self, path: str, max_rows: int, lease_seconds: float = 300, retention_seconds: float = 3600) -> None:
+        self.path = path
+        self.max_rows = max_rows
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS ingest_batches ("
+            "batch_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, status TEXT NOT NULL, rows INTEGER NOT NULL, "
+            "payload TEXT, inserted INTEGER, error TEXT, claimed_by TEXT, claimed_at REAL, "
+            "created_at REAL NOT NULL, finished_at REAL);"
+            "CREATE INDEX IF NOT EXISTS ix_spool_status_created ON ingest_batches (status, created_at);"
+        )
+
+    def _transaction(self, sql_and_params: List[Tuple[str, tuple]]) -> List[sqlite3.Cursor]:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                results = [self._db.execute(sql, params) for sql, params in sql_and_params]
+                self._db.execute("COMMIT")
+                return results
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def pending_rows(self) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT COALESCE(SUM(rows), 0) FROM ingest_batches WHERE status IN ('queued', 'writing')").fetchone()
+        return int(row[0])
+
+    def enqueue(self, rows: List[Dict[str, Any]], user_id: int) -> str:
+        batch_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                (pending,) = self._db.execute(
+                    "SELECT COALESCE(SUM(rows), 0) FROM ingest_batches WHERE status IN ('queued', 'writing')"
+                ).fetchone()
+                if pending and pending + len(rows) > self.max_rows:
+                    raise IngestQueueFull(f"{pending} rows already queued")
+                self._db.execute(
+                    "INSERT INTO ingest_batches (batch_id, user_id, status, rows, payload, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                    (batch_id, user_id, len(rows), json.dumps(rows), time.time()),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return batch_id
+
+    def claim(self, writer_id: str, max_rows: int) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        # Oldest batches first, up to max_rows in total (always at least one batch).
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "UPDATE ingest_batches SET status = 'failed', error = ?, payload = NULL, finished_at = ? "
+                    "WHERE status = 'writing' AND claimed_at < ?",
+                    ("Writer lost past the retention window; the batch may or may not have been written", now, now - self.retention_seconds),
+                )
+                candidates = self._db.execute(
+                    "SELECT batch_id, rows FROM ingest_batches "
+                    "WHERE status = 'queued' OR (status = 'writing' AND claimed_at < ?) ORDER BY created_at",
+                    (now - self.lease_seconds,),
+                ).fetchall()
+                chosen: List[str] = []
+                total = 0
+                for batch_id, rows in candidates:
+                    if chosen and total + rows > max_rows:
+                        break
+                    chosen.append(batch_id)
+                    total += rows
+                claimed = []
+                for batch_id in chosen:
+                    self._db.execute(
+                        "UPDATE ingest_batches SET status = 'writing', claimed_by = ?, claimed_at = ? WHERE batch_id = ?",
+                        (writer_id, now, batch_id),
+                    )
+                    (payload,) = self._db.execute("SELECT payload FROM ingest_batches WHERE batch_id = ?", (batch_id,)).fetchone()
+                    claimed.append((batch_id, json.loads(payload)))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def complete(self, results: Dict[str, int]) -> None:
+        now = time.time()
+        self._transaction([
+            ("UPDATE ingest_batches SET status = 'done', inserted = ?, payload = NULL, finished_at = ? WHERE batch_id = ?", (inserted, now, batch_id))
+            for batch_id, inserted in results.items()
+        ])
+
+    def fail(self, batch_id: str, error: str) -> None:
+        self._transaction([
+            ("UPDATE ingest_batches SET status = 'failed', error = ?, payload = NULL, finished_at = ? WHERE batch_id = ?", (error, time.time(), batch_id))
+        ])
+
+    def release(self, batch_ids: List[str]) -> None:
+        self._transaction([
+            ("UPDATE ingest_batches SET status = 'queued', claimed_by = NULL, claimed_at = NULL WHERE batch_id = ?", (batch_id,))
+            for batch_id in batch_ids
+        ])
+
+    def prune(self) -> int:
+        (cursor,) = self._transaction([
+            ("DELETE FROM ingest_batches WHERE status IN ('done', 'failed') AND finished_at < ?", (time.time() - self.retention_seconds,))
+        ])
+        return cursor.rowcount
+
+    def status(self, batch_id: str) -> Optional[BatchStatus]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT batch_id, status, rows, user_id, inserted, error, created_at, finished_at FROM ingest_batches WHERE batch_id = ?",
+                (batch_id,),
+            ).fetchone()
+        return BatchStatus(*row) if row else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM ingest_batches GROUP BY status").fetchall())
+        return {"path": self.path, "pending_rows": self.pending_rows(), "max_rows": self.max_rows, "batches": counts}
+
+
+class IngestWriter:
+    # Drains the spool into the database, coalescing many small batches into one
+    # insert_metrics call and one commit. Each committed batch id is recorded in the
+    # ingested_batches table in the same transaction, so a batch re-claimed after a
+    # crash between the database commit and the spool update is not inserted twice.
+    # Those records are pruned with the spool: the spool replays no claim older than
+    # its retention, and records outlive that by one lease so the re-claiming writer
+    # still finds them. Every host's writer prunes the shared table by the same rule.
+
+    def __init__(self, spool: IngestSpool, session_factory, flush_rows: int, flush_interval: float) -> None:
+        self.spool = spool
+        self.session_factory = session_factory
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.writer_id = uuid.uuid4().hex
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def _run(self) -> None:
+        last_prune = 0.0
+        while not self._stopping.is_set():
+            try:
+                written = self.flush()
+                if time.time() - last_prune > 60:
+                    self.prune()
+                    last_prune = time.time()
+            except Exception:
+                logger.exception("Ingest writer failed")
+                written = 0
+            if not written:
+                # Small batches accumulate for up to flush_interval before the next write.
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+
+    def prune(self) -> int:
+        self.spool.prune()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.spool.retention_seconds + self.spool.lease_seconds)
+        db: Session = self.session_factory()
+        try:
+            deleted = db.execute(delete(IngestBatch).where(IngestBatch.committed_at < cutoff)).rowcount
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def _write(self, batches: List[Tuple[str, List[Dict[str, Any]]]]) -> Dict[str, int]:
+        db: Session = self.session_factory()
+        try:
+            ids = [batch_id for batch_id, _ in batches]
+            committed = set(db.execute(select(IngestBatch.id).where(IngestBatch.id.in_(ids))).scalars())
+            todo = [(batch_id, rows) for batch_id, rows in batches if batch_id not in committed]
+            rows = [MetricRecordCreate.model_validate(row).model_dump() for _, batch in todo for row in batch]
+            if rows:
+                insert_metrics(db, rows, echo=False)
+            db.add_all(IngestBatch(id=batch_id, rows=len(batch_rows)) for batch_id, batch_rows in todo)
+            db.commit()
+            return {batch_id: len(batch_rows) for batch_id, batch_rows in batches}
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def flush(self) -> int:
+        # Write one coalesced group; returns the number of batches finished.
+        batches = self.spool.claim(self.writer_id, self.flush_rows)
+        if not batches:
+            return 0
+        try:
+            self.spool.complete(self._write(batches))
+            return len(batches)
+        except OperationalError:
+            # Database unavailable: leave everything queued and back off.
+            self.spool.release([batch_id for batch_id, _ in batches])
+            logger.exception("Ingest writer could not reach the database")
+            self._stopping.wait(self.flush_interval * 10)
+            return 0
+        except Exception:
+            if len(batches) == 1:
+                batch_id = batches[0][0]
+                logger.exception("Ingest batch %s failed", batch_id)
+                self.spool.fail(batch_id, "Batch could not be written")
+                return 1
+        # One bad batch must not sink the rest of the group: write them one by one.
+        finished = 0
+        for batch in batches:
+            try:
+                self.spool.complete(self._write([batch]))
+            except OperationalError:
+                self.spool.release([batch[0]])
+                continue
+            except Exception:
+                logger.exception("Ingest batch %s failed", batch[0])
+                self.spool.fail(batch[0], "Batch could not be written")
+            finished += 1
+        return finished
+
+
+@lru_cache(maxsize=1)
+def get_ingest_spool() -> Optional[IngestSpool]:
+    settings = get_settings()
+    if not settings.INGEST_QUEUE_PATH:
+        return None
+    return IngestSpool(
+        settings.INGEST_QUEUE_PATH,
+        max_rows=settings.INGEST_QUEUE_MAX_ROWS,
+        lease_seconds=settings.INGEST_QUEUE_LEASE_SECONDS,
+        retention_seconds=settings.INGEST_QUEUE_RETENTION_SECONDS,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_ingest_writer() -> Optional[IngestWriter]:
+    spool = get_ingest_spool()
+    if spool is None:
+        return None
+    from ..db import SessionLocal
+
+    settings = get_settings()
+    return IngestWriter(spool, SessionLocal, settings.INGEST_QUEUE_FLUSH_ROWS, settings.INGEST_QUEUE_FLUSH_SECONDS)
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .pubsub import get_broker
+from .summary import dimension_summaries, latest_by_dimension
+
+
+def dataset_channel(dataset_id: int) -> str:
+    return f"dataset:{dataset_id}"
+
+
+def stage_metrics_update(db: Session, points: Dict[int, List[Dict[str, Any]]], counts: Dict[int, int]) -> None:
+    # Called by ingest inside its transaction: builds one message per dataset that has
+    # listeners, carrying the new points (at most LIVE_MAX_POINTS, flagged truncated
+    # beyond that) and the dataset's latest summary as of this transaction. A broker
+    # that cannot tell whether anyone listens gets a "changed" notice per dataset
+    # instead. Messages go out once the session commits and are dropped if it rolls back.
+    broker = get_broker()
+    pending = db.info.setdefault("pending_live", [])
+    if broker.notify_only:
+        for ds_id, inserted in counts.items():
+            notice = {"type": "changed", "dataset_id": ds_id, "inserted": inserted}
+            pending.append((dataset_channel(ds_id), json.dumps(notice)))
+        return
+    dataset_ids = [ds_id for ds_id in counts if broker.has_subscribers(dataset_channel(ds_id))]
+    if not dataset_ids:
+        return
+    latest = latest_by_dimension(db, dataset_ids)
+    for ds_id in dataset_ids:
+        message = {
+            "type": "metrics",
+            "dataset_id": ds_id,
+            "inserted": counts[ds_id],
+            "truncated": counts[ds_id] > len(points.get(ds_id, ())),
+            "points": [
+                {
+                    "dimension": getattr(p["dimension"], "value", p["dimension"]),
+                    "metric_name": p["metric_name"],
+                    "metric_value": p["metric_value"],
+                    "recorded_at": p["recorded_at"].isoformat(),
+                }
+                for p in points.get(ds_id, ())
+            ],
+            "latest": [s.model_dump(mode="json") for s in dimension_summaries(latest.get(ds_id, {}))],
+        }
+        pending.append((dataset_channel(ds_id), json.dumps(message)))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_live(session: Session) -> None:
+    pending = session.info.pop("pending_live", None)
+    if pending:
+        broker = get_broker()
+        for channel, message in pending:
+            broker.publish(channel, message)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_live(session: Session, previous_transaction) -> None:
+    session.info.pop("pending_live", None)
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from ..models import MetricRecord
+
+# PostgreSQL range partitioning of metric_records by recorded_at. Partitions are named
+# metric_records_pYYYYMM (interval "month") or metric_records_pYYYYMMDD ("day"); rows
+# outside every partition land in metric_records_default.
+
+TABLE = MetricRecord.__tablename__
+DEFAULT_PARTITION = f"{TABLE}_default"
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+@dataclass(frozen=True)
+class Partition:
+    name: str
+    lower: datetime
+    upper: datetime
+
+
+def _aware(ts: datetime) -> datetime:
+    # Naive timestamps are UTC throughout the app.
+    return ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _period_start(ts: datetime, interval: str) -> datetime:
+    ts = _aware(ts)
+    if interval == "day":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_period(start: datetime, interval: str) -> datetime:
+    if interval == "day":
+        return datetime.fromtimestamp(start.timestamp() + 86400, timezone.utc)
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+
+def partition_for(ts: datetime, interval: str) -> Partition:
+    lower = _period_start(ts, interval)
+    suffix = lower.strftime("%Y%m%d" if interval == "day" else "%Y%m")
+    return Partition(f"{TABLE}_p{suffix}", lower, _next_period(lower, interval))
+
+
+def partitions_between(start: datetime, end: datetime, interval: str) -> List[Partition]:
+    # Every partition overlapping [start, end].
+    end = _aware(end)
+    partitions = [partition_for(start, interval)]
+    while partitions[-1].upper <= end:
+        partitions.append(partition_for(partitions[-1].upper, interval))
+    return partitions
+
+
+def is_partitioned(conn: Connection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": TABLE}).scalar()
+    return kind == "p"
+
+
+def list_partitions(conn: Connection) -> List[Partition]:
+    rows = conn.execute(
+        text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:t)"
+        ),
+        {"t": TABLE},
+    )
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound or "")
+        if match:
+            lower, upper = (datetime.fromisoformat(v).astimezone(timezone.utc) for v in match.groups())
+            partitions.append(Partition(name, lower, upper))
+    return sorted(partitions, key=lambda p: p.lower)
+
+
+def create_partition(conn: Connection, partition: Partition) -> None:
+    # Rows already sitting in the default partition for this range are moved first,
+    # otherwise ATTACH would fail.
+    lower, upper = partition.lower.isoformat(), partition.upper.isoformat()
+    conn.execute(text(f'CREATE TABLE "{partition.name}" (LIKE {TABLE} INCLUDING DEFAULTS)'))
+    conn.execute(text(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE recorded_at >= :lower AND recorded_at < :upper RETURNING *) '
+        f'INSERT INTO "{partition.name}" SELECT * FROM moved'
+    ), {"lower": lower, "upper": upper})
+    conn.execute(text(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION \"{partition.name}\" FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    ))
+
+
+def ensure_partitions(conn: Connection, interval: str, premake: int, now: Optional[datetime] = None) -> List[str]:
+    # Create the current partition and `premake` ahead of it.
+    now = now or datetime.now(timezone.utc)
+    existing = {p.name for p in list_partitions(conn)}
+    created = []
+    partition = partition_for(now, interval)
+    for _ in range(premake + 1):
+        if partition.name not in existing:
+            create_partition(conn, partition)
+            created.append(partition.name)
+        partition = partition_for(partition.upper, interval)
+    return created
+
+
+def drop_partitions_before(conn: Connection, cutoff: datetime) -> List[Partition]:
+    dropped = [p for p in list_partitions(conn) if p.upper <= _aware(cutoff)]
+    for partition in dropped:
+        conn.execute(text(f'DROP TABLE "{partition.name}"'))
+    return dropped
+
+
+def convert_to_partitioned(conn: Connection, interval: str, premake: int) -> List[str]:
+    # Swap the plain metric_records table for a partitioned one holding the same rows.
+    # The primary key becomes (id, recorded_at), as PostgreSQL requires the partition
+    # key in it; ids keep coming from the existing sequence. Only the two composite
+    # indexes the read paths use are recreated.
+    if is_partitioned(conn):
+        return []
+    old = f"{TABLE}_unpartitioned"
+    conn.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+    bounds = conn.execute(text(f"SELECT MIN(recorded_at), MAX(recorded_at) FROM {TABLE}")).first()
+    conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {old}"))
+    conn.execute(text(f"CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (recorded_at)"))
+    conn.execute(text(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_part_pkey PRIMARY KEY (id, recorded_at)"))
+    conn.execute(text(
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_part_series_fkey "
+        "FOREIGN KEY (series_id) REFERENCES metric_series (id) ON DELETE CASCADE"
+    ))
+    conn.execute(text(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF {TABLE} DEFAULT'))
+
+    now = datetime.now(timezone.utc)
+    start = bounds[0] if bounds[0] is not None else now
+    created = []
+    for partition in partitions_between(start, max(bounds[1] or now, now), interval):
+        create_partition(conn, partition)
+        created.append(partition.name)
+    created.extend(ensure_partitions(conn, interval, premake, now))
+
+    conn.execute(text(
+        f"INSERT INTO {TABLE} (id, series_id, metric_value, recorded_at) "
+        f"SELECT id, series_id, metric_value, recorded_at FROM {old}"
+    ))
+    conn.execute(text(f"ALTER SEQUENCE IF EXISTS {TABLE}_id_seq OWNED BY {TABLE}.id"))
+    conn.execute(text(f"DROP TABLE {old}"))
+    conn.execute(text(f"CREATE INDEX ix_metrics_series_time_id ON {TABLE} (series_id, recorded_at, id)"))
+    conn.execute(text(f"CREATE INDEX ix_metrics_time_id ON {TABLE} (recorded_at, id)"))
+    return created
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import select
+import threading
+import uuid
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..core.config import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+# Delivered in place of whatever a slow subscriber missed; clients refetch on it.
+RESYNC = json.dumps({"type": "resync"})
+
+
+class Subscription:
+    # One subscriber's bounded queue, owned by the event loop it was created on.
+
+    def __init__(self, channels: Iterable[str], queue_size: int) -> None:
+        self.channels = frozenset(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def _offer(self, message: str) -> None:
+        # Runs on self.loop. On overflow the backlog is replaced by a single resync.
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    # Fan-out to subscribers in this process. publish() is thread-safe, so it can be
+    # called from the threadpool that runs sync request handlers.
+
+    # Brokers that cannot see every subscriber publish small "changed" notices
+    # instead of full messages; see services/live.py.
+    notify_only = False
+
+    def __init__(self, queue_size: int = 256) -> None:
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def subscribe(self, channels: Iterable[str]) -> Subscription:
+        subscription = Subscription(channels, self.queue_size)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def has_subscribers(self, channel: str) -> bool:
+        return bool(self._subscribers.get(channel))
+
+    def _deliver(self, channel: str, message: str) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._offer, message)
+            except RuntimeError:
+                # The subscriber's loop is closed; it will unsubscribe on its way out.
+                pass
+
+    def publish(self, channel: str, message: str) -> None:
+        self.published += 1
+        self._deliver(channel, message)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "broker": type(self).__name__,
+                "channels": len(self._subscribers),
+                "subscriptions": len({s for subs in self._subscribers.values() for s in subs}),
+                "published": self.published,
+            }
+
+
+class PostgresBroker(InProcessBroker):
+    # Cross-worker fan-out over LISTEN/NOTIFY. Every worker LISTENs on one PostgreSQL
+    # channel and delivers what it hears to its own subscribers; publish() only
+    # NOTIFYs, so local subscribers get messages the same way as remote ones.
+    # Other workers' subscribers are invisible from here, so ingest never builds full
+    # messages for it: it NOTIFYs a small "dataset changed" notice per commit, which
+    # workers without a local subscriber drop, and clients refetch on it.
+    # NOTIFY payloads are capped at 8000 bytes, so longer messages are sent as
+    # fragments within one transaction and reassembled by the listener.
+
+    FRAGMENT_CHARS = 1900
+    notify_only = True
+
+    def __init__(self, engine, pg_channel: str, queue_size: int = 256) -> None:
+        super().__init__(queue_size)
+        self.engine = engine
+        self.pg_channel = pg_channel
+        self._notify_conn = None
+        self._notify_lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def _raw_connection(self):
+        # A dedicated autocommit DBAPI connection, taken out of the pool for good.
+        conn = self.engine.raw_connection()
+        conn.detach()
+        conn.driver_connection.autocommit = True
+        return conn
+
+    def start(self) -> None:
+        if self._listener is None:
+            self._stopping.clear()
+            self._listener = threading.Thread(target=self._listen, name="live-listener", daemon=True)
+            self._listener.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+        with self._notify_lock:
+            if self._notify_conn is not None:
+                self._notify_conn.invalidate()
+                self._notify_conn = None
+
+    def publish(self, channel: str, message: str) -> None:
+        self.published += 1
+        message_id = uuid.uuid4().hex
+        chunks = [message[i:i + self.FRAGMENT_CHARS] for i in range(0, len(message), self.FRAGMENT_CHARS)] or [""]
+        with self._notify_lock:
+            try:
+                if self._notify_conn is None:
+                    self._notify_conn = self._raw_connection()
+                cursor = self._notify_conn.cursor()
+                try:
+                    cursor.execute("BEGIN")
+                    for index, chunk in enumerate(chunks):
+                        header = f"{message_id} {index} {len(chunks)} {channel}\n"
+                        cursor.execute("SELECT pg_notify(%s, %s)", (self.pg_channel, header + chunk))
+                    cursor.execute("COMMIT")
+                finally:
+                    cursor.close()
+            except Exception:
+                logger.exception("Live NOTIFY failed")
+                if self._notify_conn is not None:
+                    self._notify_conn.invalidate()
+                self._notify_conn = None
+
+    def _listen(self) -> None:
+        partial: Dict[str, Tuple[str, List[Optional[str]]]] = {}
+        while not self._stopping.is_set():
+            try:
+                conn = self._raw_connection()
+            except Exception:
+                logger.exception("Live listener could not connect")
+                self._stopping.wait(5)
+                continue
+            dbapi = conn.driver_connection
+            try:
+                cursor = dbapi.cursor()
+                cursor.execute(f'LISTEN "{self.pg_channel}"')
+                cursor.close()
+                while not self._stopping.is_set():
+                    if select.select([dbapi], [], [], 1.0) == ([], [], []):
+                        continue
+                    dbapi.poll()
+                    while dbapi.notifies:
+                        self._receive(dbapi.notifies.pop(0).payload, partial)
+            except Exception:
+                logger.exception("Live listener lost its connection")
+                partial.clear()
+                self._stopping.wait(1)
+            finally:
+                conn.invalidate()
+
+    def _receive(self, payload: str, partial: Dict[str, Tuple[str, List[Optional[str]]]]) -> None:
+        header, _, chunk = payload.partition("\n")
+        message_id, index, count, channel = header.split(" ", 3)
+        if count == "1":
+            self._deliver(channel, chunk)
+            return
+        _, chunks = partial.setdefault(message_id, (channel, [None] * int(count)))
+        chunks[int(index)] = chunk
+        if all(c is not None for c in chunks):
+            del partial[message_id]
+            self._deliver(channel, "".join(chunks))
+
+
+@lru_cache(maxsize=1)
+def get_broker() -> InProcessBroker:
+    settings = get_settings()
+    if settings.LIVE_BROKER == "postgres":
+        from ..db import engine
+
+        if settings.DB_PGBOUNCER:
+            # LISTEN registrations are lost when PgBouncer reassigns the server connection.
+            logger.warning("LIVE_BROKER=postgres needs session pooling; DATABASE_URL should bypass PgBouncer's transaction mode")
+
+        return PostgresBroker(engine, settings.LIVE_PG_CHANNEL, settings.LIVE_QUEUE_SIZE)
+    return InProcessBroker(settings.LIVE_QUEUE_SIZE)
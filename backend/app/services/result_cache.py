@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..core.cache import register_cache
+from ..core.config import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_IDENT = r'(?:"(?:[^"]|"")+"|[A-Za-z_][\w$]*)'
+_QUALIFIED = rf"{_IDENT}(?:\s*\.\s*{_IDENT})*"
+_ALIAS = (
+    r"(?:\s+(?:as\s+)?(?!(?:where|join|inner|left|right|full|cross|natural|outer|on|using|group|order|limit|offset"
+    rf"|union|intersect|except|having|window|lateral|fetch|for)\b){_IDENT})?"
+)
+_FROM_LIST = re.compile(rf"\b(?:from|join)\s+({_QUALIFIED}{_ALIAS}(?:\s*,\s*{_QUALIFIED}{_ALIAS})*)", re.I)
+_TABLE = re.compile(_QUALIFIED)
+# Results that depend on the clock or randomness are never cached.
+_VOLATILE = re.compile(
+    r"\b(?:now|random|current_date|current_time|current_timestamp|localtime|localtimestamp|clock_timestamp"
+    r"|statement_timestamp|transaction_timestamp|timeofday|gen_random_uuid|uuid_generate_v4)\b"
+    r"|'now'",
+    re.I,
+)
+
+
+def normalize_sql(sql: str) -> str:
+    # Strip comments, collapse whitespace and drop a trailing semicolon, leaving
+    # string literals and quoted identifiers untouched.
+    parts = _LITERALS.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = " ".join(_COMMENTS.sub(" ", parts[i]).split())
+    return " ".join(part for part in parts if part).rstrip("; ")
+
+
+def referenced_tables(sql: str) -> List[str]:
+    # Names after FROM/JOIN, including comma-separated FROM lists. CTE names and
+    # table functions are returned too; they fail to fingerprint, so the rule
+    # simply isn't cached.
+    code = " ".join(_LITERALS.sub("''", normalize_sql(sql)).split())
+    tables: List[str] = []
+    for match in _FROM_LIST.finditer(code):
+        for item in match.group(1).split(","):
+            name = _TABLE.match(item.strip())
+            table = re.sub(r"\s*\.\s*", ".", name.group(0)) if name else None
+            if table and table not in tables:
+                tables.append(table)
+    return tables
+
+
+def is_volatile(sql: str) -> bool:
+    return bool(_VOLATILE.search(sql))
+
+
+def sql_hash(target: Engine, sql: str) -> str:
+    identity = target.url.render_as_string(hide_password=True)
+    return hashlib.sha256(f"{identity}\0{normalize_sql(sql)}".encode()).hexdigest()
+
+
+# Opt-in (RULES_TRACK_TABLE_CHANGES) per-table change counters on the target
+# database, bumped by triggers that table_fingerprint installs on the tables rules read.
+CHANGES_TABLE = "rule_table_changes"
+_CHANGES_DDL = {
+    "postgresql": [
+        f"CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (table_oid oid PRIMARY KEY, changes bigint NOT NULL)",
+        "CREATE OR REPLACE FUNCTION rule_table_changed() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+        f"UPDATE {CHANGES_TABLE} SET changes = changes + 1 WHERE table_oid = TG_RELID; RETURN NULL; END $$",
+    ],
+    "sqlite": [f"CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (table_name TEXT PRIMARY KEY, changes INTEGER NOT NULL)"],
+}
+# The app's own metric tables change only together with a dataset version bump.
+VERSIONED_TABLES = {"metric_records", "metric_series"}
+
+
+def _unquote(name: str) -> str:
+    return name[1:-1].replace('""', '"') if name.startswith('"') else name
+
+
+def _versions_fingerprint(conn: Connection) -> str:
+    count, total, latest = conn.execute(
+        text("SELECT COUNT(*), COALESCE(SUM(version), 0), MAX(updated_at) FROM dataset_versions")
+    ).first()
+    return f"v{count}:{total}:{latest}"
+
+
+def _stats_fingerprint(conn: Connection, table: str, name: str) -> Optional[str]:
+    # Read-only. PostgreSQL: the table's modification counters plus its relfilenode
+    # (which changes on TRUNCATE/VACUUM FULL). SQLite: row count and max rowid, which
+    # does not see in-place UPDATEs; RULES_RESULT_CACHE_TTL_SECONDS bounds how long
+    # that, or the statistics lag on PostgreSQL, can go unnoticed.
+    if conn.dialect.name == "postgresql":
+        row = conn.execute(
+            text(
+                "SELECT c.relkind, c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del "
+                "FROM pg_class c LEFT JOIN pg_stat_all_tables s ON s.relid = c.oid "
+                "WHERE c.oid = to_regclass(:name)"
+            ),
+            {"name": table},
+        ).first()
+        if row is None or row[0] != "r":
+            return None
+        return ":".join(str(v) for v in row[1:])
+    kind = conn.execute(text("SELECT type FROM sqlite_master WHERE name = :name"), {"name": name}).scalar()
+    if kind != "table":
+        return None
+    quoted = conn.dialect.identifier_preparer.quote(name)
+    count, max_rowid = conn.execute(text(f"SELECT COUNT(*), MAX(rowid) FROM {quoted}")).first()
+    return f"{count}:{max_rowid}"
+
+
+def _track_changes(conn: Connection, key: Any, quoted: str) -> None:
+    # Starts (or restarts, after the table was recreated without its triggers) the
+    # table's counter; the bump also invalidates results computed before tracking.
+    for ddl in _CHANGES_DDL[conn.dialect.name]:
+        conn.exec_driver_sql(ddl)
+    if conn.dialect.name == "postgresql":
+        conn.execute(
+            text(
+                f"INSERT INTO {CHANGES_TABLE} VALUES (:key, 1) "
+                f"ON CONFLICT (table_oid) DO UPDATE SET changes = {CHANGES_TABLE}.changes + 1"
+            ),
+            {"key": key},
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER {CHANGES_TABLE} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {quoted} "
+            "FOR EACH STATEMENT EXECUTE FUNCTION rule_table_changed()"
+        )
+    else:
+        conn.execute(
+            text(
+                f"INSERT INTO {CHANGES_TABLE} VALUES (:key, 1) "
+                "ON CONFLICT (table_name) DO UPDATE SET changes = changes + 1"
+            ),
+            {"key": key},
+        )
+        literal = key.replace("'", "''")
+        preparer = conn.dialect.identifier_preparer
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            trigger = preparer.quote(f"{CHANGES_TABLE}_{op.lower()}_{key}")
+            conn.exec_driver_sql(
+                f"CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {op} ON {quoted} BEGIN "
+                f"UPDATE {CHANGES_TABLE} SET changes = changes + 1 WHERE table_name = '{literal}'; END"
+            )
+    conn.commit()
+
+
+def _tracked_fingerprint(conn: Connection, table: str, name: str) -> Optional[str]:
+    # Change counter bumped by statement (PostgreSQL) or row (SQLite) triggers, so even
+    # in-place UPDATEs are seen at once; the triggers are installed on first use.
+    if conn.dialect.name == "postgresql":
+        row = conn.execute(
+            text(
+                "SELECT c.oid, c.oid::regclass::text, c.relkind, "
+                "EXISTS (SELECT 1 FROM pg_trigger t WHERE t.tgrelid = c.oid AND t.tgname = :trigger) "
+                "FROM pg_class c WHERE c.oid = to_regclass(:name)"
+            ),
+            {"name": table, "trigger": CHANGES_TABLE},
+        ).first()
+        if row is None or row[2] not in ("r", "p"):
+            return None
+        key, quoted, tracked = row[0], row[1], row[3]
+        lookup = f"SELECT changes FROM {CHANGES_TABLE} WHERE table_oid = :key"
+    else:
+        kind = conn.execute(text("SELECT type FROM sqlite_master WHERE name = :name"), {"name": name}).scalar()
+        if kind != "table":
+            return None
+        key, quoted = name, conn.dialect.identifier_preparer.quote(name)
+        tracked = conn.execute(
+            text("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = :name AND name LIKE :prefix"),
+            {"name": name, "prefix": f"{CHANGES_TABLE}_%"},
+        ).scalar() == 3
+        lookup = f"SELECT changes FROM {CHANGES_TABLE} WHERE table_name = :key"
+    if not tracked:
+        _track_changes(conn, key, quoted)
+    changes = conn.execute(text(lookup), {"key": key}).scalar()
+    return None if changes is None else f"{key}:{changes}"
+
+
+def table_fingerprint(conn: Connection, table: str) -> Optional[str]:
+    # The app's metric tables are fingerprinted by the dataset versions every write
+    # bumps, other tables by their statistics unless RULES_TRACK_TABLE_CHANGES opts in
+    # to trigger counters. Views and missing relations have no fingerprint.
+    if conn.dialect.name not in _CHANGES_DDL:
+        return None
+    name = _unquote(table.split(".")[-1])
+    if name in VERSIONED_TABLES:
+        from ..db import engine
+
+        if conn.engine is engine:
+            return _versions_fingerprint(conn)
+    if get_settings().RULES_TRACK_TABLE_CHANGES:
+        return _tracked_fingerprint(conn, table, name)
+    return _stats_fingerprint(conn, table, name)
+
+
+def fingerprint_tables(conn: Connection, tables: Iterable[str], memo: Dict[str, Optional[str]]) -> Optional[str]:
+    parts = []
+    for table in sorted(set(tables)):
+        if table not in memo:
+            try:
+                memo[table] = table_fingerprint(conn, table)
+            except SQLAlchemyError as exc:
+                logger.warning("Could not fingerprint %s; its rules run uncached: %s", table, exc)
+                conn.rollback()
+                memo[table] = None
+        if memo[table] is None:
+            return None
+        parts.append(f"{table}={memo[table]}")
+    return "|".join(parts) if parts else None
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    fingerprint: str
+    value: Optional[float]
+    num_violated_rows: Optional[int]
+    num_denominator_rows: Optional[int]
+    computed_at: float
+
+
+class RuleResultCache:
+    # LRU of the latest result per SQL hash, written through to a SQLite file when
+    # `path` is set so results survive restarts. An entry only answers a lookup
+    # whose table fingerprint matches and which is younger than ttl seconds.
+
+    def __init__(self, maxsize: int, ttl: float, path: Optional[str] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._data: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS rule_result_cache ("
+                "sql_hash TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, value REAL, "
+                "num_violated_rows INTEGER, num_denominator_rows INTEGER, computed_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _load(self, key: str) -> Optional[CachedResult]:
+        entry = self._data.get(key)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT fingerprint, value, num_violated_rows, num_denominator_rows, computed_at "
+                "FROM rule_result_cache WHERE sql_hash = ?",
+                (key,),
+            ).fetchone()
+            if row is not None:
+                entry = CachedResult(*row)
+                self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: str, entry: CachedResult) -> None:
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str, fingerprint: str) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._load(key)
+            if entry is None or entry.fingerprint != fingerprint or time.time() - entry.computed_at > self.ttl:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def latest(self, key: str) -> Optional[CachedResult]:
+        # Last stored result regardless of fingerprint, e.g. to re-check new thresholds.
+        with self._lock:
+            return self._load(key)
+
+    def put(self, key: str, entry: CachedResult) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO rule_result_cache VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, entry.fingerprint, entry.value, entry.num_violated_rows, entry.num_denominator_rows, entry.computed_at),
+                )
+                # The file keeps the maxsize most recently computed results.
+                self._db.execute(
+                    "DELETE FROM rule_result_cache WHERE sql_hash NOT IN "
+                    "(SELECT sql_hash FROM rule_result_cache ORDER BY computed_at DESC LIMIT ?)",
+                    (self.maxsize,),
+                )
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM rule_result_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "path": self.path,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_result_cache() -> Optional[RuleResultCache]:
+    settings = get_settings()
+    if settings.RULES_RESULT_CACHE_SIZE <= 0:
+        return None
+    cache = RuleResultCache(
+        settings.RULES_RESULT_CACHE_SIZE,
+        settings.RULES_RESULT_CACHE_TTL_SECONDS,
+        settings.RULES_RESULT_CACHE_PATH,
+    )
+    register_cache("rule_results", cache)
+    return cache
+
+
+def cache_key(target: Engine, sql: str, tables: Optional[List[str]] = None) -> Optional[Tuple[str, List[str]]]:
+    # (hash, tables to fingerprint), or None when the SQL must not be cached.
+    if is_volatile(sql):
+        return None
+    tables = tables if tables is not None else referenced_tables(sql)
+    if not tables:
+        return None
+    return sql_hash(target, sql), tables
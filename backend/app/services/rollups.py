@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import calendar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, delete, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session
+
+from ..core.config import get_settings
+from ..models import DimensionEnum, MetricRecord, MetricRollup, MetricRollupState, MetricSeries
+from . import partitions
+from .timeseries import BUCKET_SECONDS, RECORDS, Series, _bucket_start, metric_filters
+from .versions import bump_versions
+
+
+GRANULARITIES: Dict[str, int] = {"1h": 3600, "1d": 86400}
+STATE_ID = 1
+
+# count, sum, min, max, last value, epoch of the last value
+Partial = List[Any]
+
+
+def to_epoch(ts: datetime) -> int:
+    # Naive timestamps are UTC.
+    return calendar.timegm(ts.utctimetuple())
+
+
+def from_epoch(seconds: int) -> datetime:
+    return datetime.fromtimestamp(seconds, timezone.utc)
+
+
+def floor_epoch(seconds: int, width: int) -> int:
+    return seconds // width * width
+
+
+def _state(db: Session, lock: bool = False) -> Optional[MetricRollupState]:
+    stmt = select(MetricRollupState).where(MetricRollupState.id == STATE_ID)
+    if lock:
+        stmt = stmt.with_for_update()
+    return db.execute(stmt).scalar_one_or_none()
+
+
+def rollup_boundary(db: Session) -> Optional[int]:
+    # Epoch below which metric_rollups are exact, or None before the first maintenance run.
+    state = _state(db)
+    if state is None or state.rolled_until is None:
+        return None
+    if state.dirty_from is not None:
+        return max(min(state.rolled_until, state.dirty_from), state.raw_floor or 0)
+    return state.rolled_until
+
+
+def mark_dirty(db: Session, oldest: datetime) -> None:
+    # Called by ingest. Rollups are at most as fresh as the current hour, so writes
+    # within it never touch the state row.
+    seconds = to_epoch(oldest)
+    if seconds >= floor_epoch(to_epoch(datetime.utcnow()), GRANULARITIES["1h"]):
+        return
+    db.execute(
+        update(MetricRollupState)
+        .where(
+            MetricRollupState.id == STATE_ID,
+            MetricRollupState.rolled_until > seconds,
+            or_(MetricRollupState.dirty_from.is_(None), MetricRollupState.dirty_from > seconds),
+        )
+        .values(dirty_from=seconds)
+    )
+
+
+def _raw_partials(dialect: str, seconds: int, clauses: list, keys: Tuple[str, ...]):
+    # One row per (keys, bucket) with count/sum/min/max, the newest value and its time.
+    bucket = _bucket_start(dialect, seconds).label("bucket")
+    key_columns = [getattr(MetricSeries, k) for k in keys]
+    ranked = (
+        select(
+            *key_columns,
+            bucket,
+            MetricRecord.metric_value,
+            MetricRecord.recorded_at,
+            func.row_number()
+            .over(partition_by=(*key_columns, bucket), order_by=(MetricRecord.recorded_at.desc(), MetricRecord.id.desc()))
+            .label("rn"),
+        )
+        .select_from(RECORDS)
+        .where(*clauses)
+        .subquery()
+    )
+    r = ranked.c
+    group = [r[k] for k in keys] + [r.bucket]
+    return select(
+        *group,
+        func.count(),
+        func.sum(r.metric_value),
+        func.min(r.metric_value),
+        func.max(r.metric_value),
+        func.max(case((r.rn == 1, r.metric_value))),
+        func.max(r.recorded_at),
+    ).group_by(*group)
+
+
+def rollup_range(db: Session, granularity: str, start: int, end: int) -> None:
+    # Recompute whole buckets in [start, end) from raw points; idempotent.
+    if end <= start:
+        return
+    seconds = GRANULARITIES[granularity]
+    db.execute(
+        delete(MetricRollup).where(
+            MetricRollup.granularity == granularity,
+            MetricRollup.bucket_epoch >= start,
+            MetricRollup.bucket_epoch < end,
+        )
+    )
+    clauses = [MetricRecord.recorded_at >= from_epoch(start), MetricRecord.recorded_at < from_epoch(end)]
+    partials = _raw_partials(db.get_bind().dialect.name, seconds, clauses, ("dataset_id", "dimension", "metric_name")).subquery()
+    db.execute(
+        insert(MetricRollup).from_select(
+            ["granularity", "dataset_id", "dimension", "metric_name", "bucket_epoch",
+             "count", "sum_value", "min_value", "max_value", "last_value", "last_at"],
+            select(literal(granularity), *partials.c),
+        )
+    )
+
+
+def _merge(into: Optional[Partial], other: Partial) -> Partial:
+    if into is None:
+        return list(other)
+    into[0] += other[0]
+    into[1] += other[1]
+    into[2] = min(into[2], other[2])
+    into[3] = max(into[3], other[3])
+    if other[5] >= into[5]:
+        into[4], into[5] = other[4], other[5]
+    return into
+
+
+def _merge_late_rows(db: Session, raw_floor: int) -> int:
+    # Points ingested behind raw_floor (their raw neighbours are already gone) are
+    # added into the existing rollups and then dropped like the rest.
+    clauses = [MetricRecord.recorded_at < from_epoch(raw_floor)]
+    late = db.execute(select(func.count()).select_from(MetricRecord).where(*clauses)).scalar()
+    if not late:
+        return 0
+    dialect = db.get_bind().dialect.name
+    for granularity, seconds in GRANULARITIES.items():
+        stmt = _raw_partials(dialect, seconds, clauses, ("dataset_id", "dimension", "metric_name"))
+        for dataset_id, dimension, name, bucket, count, total, lo, hi, last, last_at in db.execute(stmt).all():
+            key = (granularity, dataset_id, dimension, name, int(bucket))
+            partial = [count, total, lo, hi, last, to_epoch(last_at)]
+            rollup = db.get(MetricRollup, key)
+            if rollup is not None:
+                current = [rollup.count, rollup.sum_value, rollup.min_value, rollup.max_value, rollup.last_value, to_epoch(rollup.last_at)]
+                partial = _merge(current, partial)
+            else:
+                rollup = MetricRollup(granularity=granularity, dataset_id=dataset_id, dimension=dimension, metric_name=name, bucket_epoch=int(bucket))
+                db.add(rollup)
+            rollup.count, rollup.sum_value, rollup.min_value, rollup.max_value, rollup.last_value = partial[:5]
+            rollup.last_at = from_epoch(partial[5])
+    db.flush()
+    db.execute(delete(MetricRecord).where(*clauses))
+    return late
+
+
+def maintain_metrics(db: Session, now: Optional[datetime] = None) -> Dict[str, Any]:
+    # Bring rollups up to the current hour, then apply retention: raw points older than
+    # METRICS_RAW_RETENTION_DAYS go (whole partitions on partitioned PostgreSQL), then
+    # hourly rollups older than METRICS_HOURLY_RETENTION_DAYS. Commits.
+    settings = get_settings()
+    now_epoch = to_epoch(now or datetime.utcnow())
+    day = GRANULARITIES["1d"]
+    report: Dict[str, Any] = {"partitions_created": [], "partitions_dropped": [], "late_rows_merged": 0, "raw_deleted": 0}
+
+    state = _state(db, lock=True)
+    if state is None:
+        state = MetricRollupState(id=STATE_ID)
+        db.add(state)
+        db.flush()
+        state = _state(db, lock=True)
+
+    conn = db.connection()
+    partitioned = partitions.is_partitioned(conn)
+    if partitioned:
+        report["partitions_created"] = partitions.ensure_partitions(
+            conn, settings.METRICS_PARTITION_INTERVAL, settings.METRICS_PARTITION_PREMAKE, from_epoch(now_epoch)
+        )
+
+    if state.raw_floor is not None:
+        report["late_rows_merged"] = _merge_late_rows(db, state.raw_floor)
+
+    if state.rolled_until is None:
+        oldest = db.execute(select(func.min(MetricRecord.recorded_at))).scalar()
+        start = to_epoch(oldest) if oldest is not None else now_epoch
+    else:
+        start = min(state.rolled_until, state.dirty_from if state.dirty_from is not None else state.rolled_until)
+    start = floor_epoch(max(start, state.raw_floor or 0), day)
+    rolled_until = floor_epoch(now_epoch, GRANULARITIES["1h"])
+    rollup_range(db, "1h", start, rolled_until)
+    rollup_range(db, "1d", start, floor_epoch(now_epoch, day))
+    report["rolled_from"], report["rolled_until"] = start, rolled_until
+
+    if settings.METRICS_RAW_RETENTION_DAYS > 0:
+        cutoff = floor_epoch(now_epoch - settings.METRICS_RAW_RETENTION_DAYS * day, day)
+        raw_floor = state.raw_floor or 0
+        if partitioned:
+            dropped = partitions.drop_partitions_before(conn, from_epoch(cutoff))
+            report["partitions_dropped"] = [p.name for p in dropped]
+            raw_floor = max([raw_floor] + [to_epoch(p.upper) for p in dropped])
+        else:
+            raw_floor = max(raw_floor, cutoff)
+        if raw_floor:
+            # On partitioned tables this only reaches the default partition.
+            report["raw_deleted"] = db.execute(delete(MetricRecord).where(MetricRecord.recorded_at < from_epoch(raw_floor))).rowcount
+            state.raw_floor = raw_floor
+
+    if settings.METRICS_HOURLY_RETENTION_DAYS > 0:
+        hourly_cutoff = floor_epoch(now_epoch - settings.METRICS_HOURLY_RETENTION_DAYS * day, day)
+        report["hourly_deleted"] = db.execute(
+            delete(MetricRollup).where(MetricRollup.granularity == "1h", MetricRollup.bucket_epoch < hourly_cutoff)
+        ).rowcount
+
+    if report["late_rows_merged"] or report["raw_deleted"] or report["partitions_dropped"]:
+        # Raw reads over the removed range now answer differently.
+        bump_versions(db)
+
+    state.rolled_until = rolled_until
+    state.dirty_from = None
+    state.updated_at = datetime.utcnow()
+    db.commit()
+    return report
+
+
+def rollup_granularity(bucket: Optional[str]) -> Optional[str]:
+    # Coarsest rollup a bucket width can be built from.
+    if bucket is None:
+        return None
+    width = BUCKET_SECONDS[bucket]
+    for granularity in ("1d", "1h"):
+        if width % GRANULARITIES[granularity] == 0:
+            return granularity
+    return None
+
+
+def _finalize(partial: Partial, agg: str) -> float:
+    count, total, lo, hi, last, _ = partial
+    return {"avg": total / count if count else 0.0, "min": lo, "max": hi, "last": last}[agg]
+
+
+def rollup_window(
+    granularity: str, start: Optional[datetime], end: Optional[datetime], boundary: int
+) -> Tuple[Optional[int], int]:
+    # [lo, hi) of whole rollup buckets inside [start, end] and below the boundary;
+    # lo is None when the range is open at the start.
+    seconds = GRANULARITIES[granularity]
+    lo = -(-to_epoch(start) // seconds) * seconds if start is not None else None
+    hi = floor_epoch(boundary, seconds)
+    if end is not None:
+        hi = min(hi, floor_epoch(to_epoch(end), seconds))
+    return lo, hi
+
+
+def rollup_statements(
+    dialect: str,
+    dataset_id: int,
+    dimension: Optional[DimensionEnum],
+    metric_name: Optional[str],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    bucket: str,
+    window: Tuple[Optional[int], int],
+):
+    # Whole rollup buckets inside `window` come from metric_rollups, the rest of
+    # [start, end] from raw points; merge_rollup_rows combines the two results.
+    lo, hi = window
+    q = select(
+        MetricRollup.metric_name,
+        MetricRollup.bucket_epoch,
+        MetricRollup.count,
+        MetricRollup.sum_value,
+        MetricRollup.min_value,
+        MetricRollup.max_value,
+        MetricRollup.last_value,
+        MetricRollup.last_at,
+    ).where(
+        MetricRollup.granularity == rollup_granularity(bucket),
+        MetricRollup.dataset_id == dataset_id,
+        MetricRollup.bucket_epoch < hi,
+    )
+    if lo is not None:
+        q = q.where(MetricRollup.bucket_epoch >= lo)
+    if dimension is not None:
+        q = q.where(MetricRollup.dimension == dimension)
+    if metric_name is not None:
+        q = q.where(MetricRollup.metric_name == metric_name)
+
+    outside = MetricRecord.recorded_at >= from_epoch(hi)
+    if lo is not None:
+        outside = or_(MetricRecord.recorded_at < from_epoch(lo), outside)
+    clauses = metric_filters(dataset_id, dimension, metric_name, start, end) + [outside]
+    return q, _raw_partials(dialect, BUCKET_SECONDS[bucket], clauses, ("metric_name",))
+
+
+def merge_rollup_rows(rollup_rows, raw_rows, bucket: str, agg: str) -> Series:
+    # Output buckets spanning rollups and raw points merge the two partials.
+    width = BUCKET_SECONDS[bucket]
+    merged: Dict[Tuple[str, int], Partial] = {}
+    for name, bucket_epoch, count, total, lo_value, hi_value, last, last_at in rollup_rows:
+        key = (name, floor_epoch(bucket_epoch, width))
+        merged[key] = _merge(merged.get(key), [count, total, lo_value, hi_value, last, to_epoch(last_at)])
+    for name, bucket_start, count, total, lo_value, hi_value, last, last_at in raw_rows:
+        key = (name, int(bucket_start))
+        merged[key] = _merge(merged.get(key), [count, total, lo_value, hi_value, last, to_epoch(last_at)])
+
+    series: Series = {}
+    for (name, bucket_start), partial in sorted(merged.items()):
+        series.setdefault(name, []).append((datetime.utcfromtimestamp(bucket_start), float(_finalize(partial, agg))))
+    return series
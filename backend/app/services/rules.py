@@ -0,0 +1,519 @@
+from __future__ import annotations
+
+import logging
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Deque, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from ..core.config import get_settings
+from ..core.pooling import statement_deadline_handler
+from ..models import DimensionEnum, QualityRule, RuleExecution, RuleRun, RuleWatermark
+from .fused import CheckCounts, FieldCheck, read_fused_counts, render_check_sql, render_fused_sql
+from .ingest import insert_metrics
+from .result_cache import CachedResult, RuleResultCache, cache_key, fingerprint_tables, get_result_cache
+
+
+logger = logging.getLogger(__name__)
+
+VALUE_COLUMNS = ("pct_violated_rows", "metric_value", "value")
+
+
+@dataclass(frozen=True)
+class RuleState:
+    # Stored counts of an incremental rule over every row up to `watermark`.
+    watermark: Optional[str]
+    counts: CheckCounts
+
+
+@dataclass(frozen=True)
+class RuleSpec:
+    # Detached copy of a QualityRule so worker threads never touch ORM state.
+    id: int
+    dataset_id: int
+    name: str
+    sql_query: str
+    dimension: Optional[DimensionEnum] = None
+    threshold_min: Optional[float] = None
+    threshold_max: Optional[float] = None
+    check: Optional[FieldCheck] = None
+    incremental_column: Optional[str] = None
+    state: Optional[RuleState] = None
+
+    @property
+    def signature(self) -> str:
+        check = self.check
+        return "|".join(str(part) for part in (check.check_name, check.table, check.field, check.value, self.incremental_column))
+
+    @property
+    def since(self) -> Optional[str]:
+        # Watermark to scan from; None means a full scan.
+        return self.state.watermark if self.state else None
+
+    @classmethod
+    def from_rule(cls, rule: QualityRule) -> "RuleSpec":
+        return cls(
+            id=rule.id,
+            dataset_id=rule.dataset_id,
+            name=rule.name,
+            sql_query=rule.sql_query,
+            dimension=rule.dimension,
+            threshold_min=rule.threshold_min,
+            threshold_max=rule.threshold_max,
+            check=(
+                FieldCheck(rule.check_name, rule.cdm_table_name, rule.cdm_field_name, rule.check_value)
+                if rule.check_name
+                else None
+            ),
+            incremental_column=rule.incremental_column if rule.check_name else None,
+        )
+
+
+@dataclass
+class RuleOutcome:
+    rule: RuleSpec
+    status: str
+    started_at: datetime
+    duration_ms: float
+    value: Optional[float] = None
+    error: Optional[str] = None
+    num_violated_rows: Optional[int] = None
+    num_denominator_rows: Optional[int] = None
+    incremental: bool = False
+    watermark: Optional[str] = None
+    cached: bool = False
+
+    @property
+    def passed(self) -> Optional[bool]:
+        return evaluate_thresholds(self.value, self.rule.threshold_min, self.rule.threshold_max)
+
+
+def evaluate_thresholds(value: Optional[float], threshold_min: Optional[float], threshold_max: Optional[float]) -> Optional[bool]:
+    if value is None:
+        return None
+    if threshold_min is not None and value < threshold_min:
+        return False
+    if threshold_max is not None and value > threshold_max:
+        return False
+    return True
+
+
+def extract_value(row: Optional[Mapping[str, Any]]) -> Optional[float]:
+    # A rule returns one row: PCT_VIOLATED_ROWS (the OHDSI check shape), a
+    # metric_value/value column, or otherwise its first column.
+    if row is None:
+        return None
+    lowered = {str(k).lower(): v for k, v in row.items()}
+    for column in VALUE_COLUMNS:
+        if column in lowered:
+            value = lowered[column]
+            break
+    else:
+        value = next(iter(lowered.values()), None)
+    return float(value) if value is not None else None
+
+
+def extract_count(row: Optional[Mapping[str, Any]], column: str) -> Optional[int]:
+    if row is None:
+        return None
+    value = {str(k).lower(): v for k, v in row.items()}.get(column)
+    return int(value) if value is not None else None
+
+
+def apply_statement_timeout(conn: Connection, seconds: float) -> None:
+    if seconds <= 0:
+        return
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        conn.execute(text(f"SET LOCAL statement_timeout = {int(seconds * 1000)}"))
+    elif dialect == "sqlite":
+        deadline = time.monotonic() + seconds
+        conn.connection.driver_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10_000)
+
+
+def clear_statement_timeout(conn: Connection) -> None:
+    if conn.dialect.name == "sqlite":
+        # Hand the connection back the pool's own DB_STATEMENT_TIMEOUT_MS handler.
+        handler = statement_deadline_handler(conn.connection.info) if get_settings().DB_STATEMENT_TIMEOUT_MS > 0 else None
+        conn.connection.driver_connection.set_progress_handler(handler, 10_000 if handler else 0)
+
+
+def set_read_only(conn: Connection) -> None:
+    # Must run first in the transaction on PostgreSQL; SQLite's pragma is per
+    # connection and has to be undone before the connection goes back to the pool.
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+    elif dialect == "sqlite":
+        conn.exec_driver_sql("PRAGMA query_only = ON")
+
+
+def clear_read_only(conn: Connection) -> None:
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("PRAGMA query_only = OFF")
+
+
+@lru_cache(maxsize=1)
+def get_target_engine() -> Engine:
+    settings = get_settings()
+    url = settings.RULES_TARGET_DATABASE_URL
+    if not url or url == settings.DATABASE_URL:
+        from ..db import engine
+
+        return engine
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    return create_engine(url, pool_pre_ping=True, pool_size=settings.RULES_MAX_WORKERS, connect_args=connect_args)
+
+
+def _failure(exc: Exception) -> Tuple[str, str]:
+    if isinstance(exc, OperationalError):
+        timed_out = "timeout" in str(exc).lower() or "interrupted" in str(exc).lower()
+        return ("timeout" if timed_out else "error"), str(exc.orig)
+    return "error", str(exc)
+
+
+class RuleEngine:
+    # Runs rules on a thread pool of max_workers, never more than
+    # per_dataset_concurrency at once against the same dataset. With fuse=True,
+    # structured checks on the same (dataset, table) share one scan.
+
+    def __init__(
+        self,
+        target: Engine,
+        max_workers: int,
+        per_dataset_concurrency: int,
+        statement_timeout: float,
+        fuse: bool = True,
+        cache: Optional[RuleResultCache] = None,
+    ) -> None:
+        self.target = target
+        self.max_workers = max(1, max_workers)
+        self.per_dataset_concurrency = max(1, per_dataset_concurrency)
+        self.statement_timeout = statement_timeout
+        self.fuse = fuse
+        self.cache = cache
+
+    @classmethod
+    def from_settings(cls, target: Optional[Engine] = None) -> "RuleEngine":
+        settings = get_settings()
+        return cls(
+            target or get_target_engine(),
+            max_workers=settings.RULES_MAX_WORKERS,
+            per_dataset_concurrency=settings.RULES_PER_DATASET_CONCURRENCY,
+            statement_timeout=settings.RULES_STATEMENT_TIMEOUT_SECONDS,
+            fuse=settings.RULES_FUSE_CHECKS,
+            cache=get_result_cache(),
+        )
+
+    def _fetch_one(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Optional[Mapping[str, Any]]:
+        # Rule SQL is user-written: run it read-only and never commit what it did.
+        with self.target.connect() as conn:
+            transaction = conn.begin()
+            try:
+                set_read_only(conn)
+                apply_statement_timeout(conn, self.statement_timeout)
+                return conn.execute(text(sql), params or {}).mappings().first()
+            finally:
+                clear_statement_timeout(conn)
+                transaction.rollback()
+                clear_read_only(conn)
+
+    def execute(self, rule: RuleSpec) -> RuleOutcome:
+        started_at = datetime.utcnow()
+        t0 = time.perf_counter()
+        outcome = RuleOutcome(rule=rule, status="ok", started_at=started_at, duration_ms=0.0)
+        try:
+            # Structured checks are rendered for the target dialect at run time.
+            row = self._fetch_one(self.rule_sql(rule))
+            outcome.value = extract_value(row)
+            outcome.num_violated_rows = extract_count(row, "num_violated_rows")
+            outcome.num_denominator_rows = extract_count(row, "num_denominator_rows")
+        except Exception as exc:
+            outcome.status, outcome.error = _failure(exc)
+        outcome.duration_ms = (time.perf_counter() - t0) * 1000
+        return outcome
+
+    def execute_fused(self, rules: Sequence[RuleSpec]) -> List[RuleOutcome]:
+        # All rules share the dataset, table, incremental column and watermark (see
+        # plan()); the scan's duration is reported for each. Incremental rules with a
+        # watermark only scan newer rows and add them to their stored counts.
+        started_at = datetime.utcnow()
+        t0 = time.perf_counter()
+        checks = [rule.check for rule in rules]
+        column, since = rules[0].incremental_column, rules[0].since
+        try:
+            sql = render_fused_sql(self.target.dialect, checks[0].table, checks, column, since_watermark=since is not None)
+            row = dict(self._fetch_one(sql, {"watermark": since} if since is not None else None))
+            counts = read_fused_counts(row, checks)
+        except Exception as exc:
+            status, error = _failure(exc)
+            duration_ms = (time.perf_counter() - t0) * 1000
+            return [
+                RuleOutcome(rule=rule, status=status, started_at=started_at, duration_ms=duration_ms, error=error)
+                for rule in rules
+            ]
+        duration_ms = (time.perf_counter() - t0) * 1000
+        hwm = row.get("hwm")
+        outcomes = []
+        for rule, c in zip(rules, counts):
+            if since is not None:
+                c = rule.state.counts + c
+            outcomes.append(RuleOutcome(
+                rule=rule,
+                status="ok",
+                started_at=started_at,
+                duration_ms=duration_ms,
+                value=c.pct_violated_rows,
+                num_violated_rows=c.num_violated_rows,
+                num_denominator_rows=c.num_denominator_rows,
+                incremental=since is not None,
+                watermark=str(hwm) if hwm is not None else since,
+            ))
+        return outcomes
+
+    def plan(self, rules: Iterable[RuleSpec]) -> Dict[int, Deque[List[RuleSpec]]]:
+        # Per dataset, a queue of tasks: a group of fusable checks or a single rule.
+        queues: Dict[int, Deque[List[RuleSpec]]] = {}
+        groups: Dict[Tuple[int, str, Optional[str], Optional[str]], List[RuleSpec]] = {}
+        for rule in rules:
+            queue = queues.setdefault(rule.dataset_id, deque())
+            if rule.check is not None and (self.fuse or rule.incremental_column):
+                key = (rule.dataset_id, rule.check.table, rule.incremental_column, rule.since)
+                if key not in groups or not self.fuse:
+                    groups[key] = []
+                    queue.append(groups[key])
+                groups[key].append(rule)
+            else:
+                queue.append([rule])
+        return queues
+
+    def rule_sql(self, rule: RuleSpec) -> str:
+        return render_check_sql(self.target.dialect, rule.check) if rule.check else rule.sql_query
+
+    def _lookup_cached(self, task: List[RuleSpec]) -> Tuple[List[RuleOutcome], List[RuleSpec], Dict[int, Tuple[str, str]]]:
+        # Split a task into cache hits and rules that still need to run; the keys of
+        # the latter are returned so their results can be stored afterwards.
+        # Incremental rules are cheap already and keep their own state, so they bypass it.
+        hits: List[RuleOutcome] = []
+        pending: List[RuleSpec] = []
+        keys: Dict[int, Tuple[str, str]] = {}
+        memo: Dict[str, Optional[str]] = {}
+        t0 = time.perf_counter()
+        try:
+            with self.target.connect() as conn:
+                for rule in task:
+                    key = None if rule.incremental_column else cache_key(
+                        self.target, self.rule_sql(rule), [rule.check.table] if rule.check else None
+                    )
+                    fingerprint = fingerprint_tables(conn, key[1], memo) if key else None
+                    entry = self.cache.get(key[0], fingerprint) if fingerprint else None
+                    if entry is None:
+                        pending.append(rule)
+                        if fingerprint:
+                            keys[rule.id] = (key[0], fingerprint)
+                        continue
+                    hits.append(RuleOutcome(
+                        rule=rule,
+                        status="ok",
+                        started_at=datetime.utcnow(),
+                        duration_ms=(time.perf_counter() - t0) * 1000,
+                        value=entry.value,
+                        num_violated_rows=entry.num_violated_rows,
+                        num_denominator_rows=entry.num_denominator_rows,
+                        cached=True,
+                    ))
+        except SQLAlchemyError as exc:
+            logger.warning("Rule result cache lookup failed; running uncached: %s", exc)
+            return [], task, {}
+        return hits, pending, keys
+
+    def _run_task(self, task: List[RuleSpec]) -> List[RuleOutcome]:
+        hits, pending, keys = self._lookup_cached(task) if self.cache is not None else ([], task, {})
+        if not pending:
+            return hits
+        # Incremental checks always take the fused path, which tracks the watermark.
+        if len(pending) == 1 and not pending[0].incremental_column:
+            outcomes = [self.execute(pending[0])]
+        else:
+            outcomes = self.execute_fused(pending)
+        for outcome in outcomes:
+            key = keys.get(outcome.rule.id)
+            if key is not None and outcome.status == "ok":
+                self.cache.put(key[0], CachedResult(
+                    fingerprint=key[1],
+                    value=outcome.value,
+                    num_violated_rows=outcome.num_violated_rows,
+                    num_denominator_rows=outcome.num_denominator_rows,
+                    computed_at=time.time(),
+                ))
+        return hits + outcomes
+
+    def run(self, rules: Iterable[RuleSpec]) -> List[RuleOutcome]:
+        queues = self.plan(rules)
+        active: Counter = Counter()
+        running: Dict[Future, int] = {}
+        outcomes: List[RuleOutcome] = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rule-engine") as pool:
+            def fill() -> None:
+                # Round-robin across datasets so one large dataset cannot monopolise the pool.
+                progressed = True
+                while progressed and len(running) < self.max_workers:
+                    progressed = False
+                    for dataset_id, queue in queues.items():
+                        if queue and active[dataset_id] < self.per_dataset_concurrency and len(running) < self.max_workers:
+                            task = queue.popleft()
+                            running[pool.submit(self._run_task, task)] = dataset_id
+                            active[dataset_id] += 1
+                            progressed = True
+
+            fill()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    active[running.pop(future)] -= 1
+                    outcomes.extend(future.result())
+                fill()
+        return outcomes
+
+
+def record_outcomes(db: Session, outcomes: Sequence[RuleOutcome], run_id: Optional[str] = None) -> List[RuleExecution]:
+    # Successful values go through the regular ingest path (metric_records and
+    # latest_metrics); every run, successful or not, is logged in rule_executions.
+    insert_metrics(
+        db,
+        (
+            {
+                "dataset_id": o.rule.dataset_id,
+                "dimension": o.rule.dimension or DimensionEnum.validity,
+                "metric_name": o.rule.name,
+                "metric_value": o.value,
+                "recorded_at": o.started_at,
+            }
+            for o in outcomes
+            if o.value is not None
+        ),
+        echo=False,
+    )
+    executions = [
+        RuleExecution(
+            run_id=run_id,
+            rule_id=o.rule.id,
+            dataset_id=o.rule.dataset_id,
+            status=o.status,
+            metric_value=o.value,
+            passed=o.passed,
+            duration_ms=o.duration_ms,
+            error=o.error,
+            num_violated_rows=o.num_violated_rows,
+            num_denominator_rows=o.num_denominator_rows,
+            incremental=o.incremental,
+            cached=o.cached,
+            started_at=o.started_at,
+        )
+        for o in outcomes
+    ]
+    db.add_all(executions)
+    for o in outcomes:
+        if o.rule.incremental_column and o.status == "ok":
+            db.merge(RuleWatermark(
+                rule_id=o.rule.id,
+                signature=o.rule.signature,
+                watermark=o.watermark,
+                num_violated_rows=o.num_violated_rows,
+                num_denominator_rows=o.num_denominator_rows,
+                updated_at=o.started_at,
+            ))
+    db.commit()
+    return executions
+
+
+def load_rules(
+    db: Session,
+    dataset_ids: Optional[Iterable[int]] = None,
+    rule_ids: Optional[Iterable[int]] = None,
+    full: bool = False,
+) -> List[RuleSpec]:
+    # Incremental rules resume from their watermark unless `full` is set or the check
+    # definition changed since the counts were stored.
+    q = db.query(QualityRule).filter(QualityRule.is_active == True)
+    if dataset_ids is not None:
+        q = q.filter(QualityRule.dataset_id.in_(list(dataset_ids)))
+    if rule_ids is not None:
+        q = q.filter(QualityRule.id.in_(list(rule_ids)))
+    specs = [RuleSpec.from_rule(rule) for rule in q.order_by(QualityRule.dataset_id, QualityRule.id)]
+    incremental = [spec.id for spec in specs if spec.incremental_column]
+    if full or not incremental:
+        return specs
+    states = {w.rule_id: w for w in db.query(RuleWatermark).filter(RuleWatermark.rule_id.in_(incremental))}
+    for i, spec in enumerate(specs):
+        state = states.get(spec.id)
+        if state is not None and state.signature == spec.signature:
+            counts = CheckCounts(state.num_violated_rows, state.num_denominator_rows)
+            specs[i] = replace(spec, state=RuleState(watermark=state.watermark, counts=counts))
+    return specs
+
+
+def run_rules(
+    db: Session,
+    rules: Sequence[RuleSpec],
+    engine: Optional[RuleEngine] = None,
+    run_id: Optional[str] = None,
+) -> List[RuleExecution]:
+    engine = engine or RuleEngine.from_settings()
+    return record_outcomes(db, engine.run(rules), run_id=run_id)
+
+
+class RuleRunner:
+    # Executes submitted rule sets in the background, at most max_runs at a time, so a
+    # long scan never holds an HTTP request open. Progress lives in rule_runs; a run
+    # cut short by a restart stays unfinished and is simply submitted again (watermarks
+    # and the result cache make the repeat cheap).
+
+    def __init__(self, session_factory, max_runs: int) -> None:
+        self.session_factory = session_factory
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_runs), thread_name_prefix="rule-runs")
+
+    def submit(self, db: Session, rules: Sequence[RuleSpec]) -> RuleRun:
+        run = RuleRun(id=uuid.uuid4().hex, status="queued", rules=len(rules))
+        db.add(run)
+        db.commit()
+        self._pool.submit(self._execute, run.id, list(rules))
+        return run
+
+    def _execute(self, run_id: str, rules: List[RuleSpec]) -> None:
+        db: Session = self.session_factory()
+        try:
+            db.get(RuleRun, run_id).status = "running"
+            db.commit()
+            try:
+                run_rules(db, rules, run_id=run_id)
+                status, error = "done", None
+            except Exception as exc:
+                logger.exception("Rule run %s failed", run_id)
+                db.rollback()
+                status, error = "failed", str(exc)
+            run = db.get(RuleRun, run_id)
+            run.status, run.error, run.finished_at = status, error, datetime.utcnow()
+            db.commit()
+        finally:
+            db.close()
+
+    def stop(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+@lru_cache(maxsize=1)
+def get_rule_runner() -> RuleRunner:
+    from ..db import SessionLocal
+
+    return RuleRunner(SessionLocal, get_settings().RULES_CONCURRENT_RUNS)
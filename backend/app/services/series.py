@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import and_, event, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from ..models import DimensionEnum, MetricSeries
+
+
+SeriesKey = Tuple[int, DimensionEnum, str]
+
+
+def series_key(dataset_id: int, dimension, metric_name: str) -> SeriesKey:
+    return int(dataset_id), DimensionEnum(dimension), metric_name
+
+
+class SeriesCatalog:
+    # Process-wide (dataset, dimension, name) -> series id map. Ids created inside a
+    # session's transaction are only published once that transaction commits, so a
+    # rolled-back ingest never leaves an id behind that the database doesn't have.
+
+    def __init__(self) -> None:
+        self._ids: Dict[SeriesKey, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: SeriesKey) -> Optional[int]:
+        return self._ids.get(key)
+
+    def publish(self, ids: Dict[SeriesKey, int]) -> None:
+        with self._lock:
+            self._ids.update(ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def resolve(self, db: Session, keys: Iterable[SeriesKey]) -> Dict[SeriesKey, int]:
+        pending: Dict[SeriesKey, int] = db.info.setdefault("pending_series", {})
+        found: Dict[SeriesKey, int] = {}
+        missing = []
+        for key in set(keys):
+            series_id = self._ids.get(key) or pending.get(key)
+            if series_id is None:
+                missing.append(key)
+            else:
+                found[key] = series_id
+        if missing:
+            loaded = _load_or_create(db, missing)
+            pending.update(loaded)
+            found.update(loaded)
+        return found
+
+
+def _select_ids(db: Session, keys) -> Dict[SeriesKey, int]:
+    ids: Dict[SeriesKey, int] = {}
+    for start in range(0, len(keys), 500):
+        batch = keys[start:start + 500]
+        stmt = select(MetricSeries.id, MetricSeries.dataset_id, MetricSeries.dimension, MetricSeries.metric_name).where(
+            or_(*(
+                and_(MetricSeries.dataset_id == d, MetricSeries.dimension == dim, MetricSeries.metric_name == name)
+                for d, dim, name in batch
+            ))
+        )
+        for series_id, dataset_id, dimension, name in db.execute(stmt):
+            ids[(dataset_id, dimension, name)] = series_id
+    return ids
+
+
+def _load_or_create(db: Session, keys) -> Dict[SeriesKey, int]:
+    ids = _select_ids(db, keys)
+    new = [k for k in keys if k not in ids]
+    if new:
+        values = [{"dataset_id": d, "dimension": dim, "metric_name": name} for d, dim, name in new]
+        dialect = db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            # Concurrent ingests may create the same series; the loser just reads it back.
+            dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            db.execute(dialect_insert(MetricSeries).on_conflict_do_nothing(index_elements=["dataset_id", "dimension", "metric_name"]), values)
+        else:
+            db.execute(insert(MetricSeries), values)
+        ids.update(_select_ids(db, new))
+    return ids
+
+
+series_catalog = SeriesCatalog()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_series(session: Session) -> None:
+    pending = session.info.pop("pending_series", None)
+    if pending:
+        series_catalog.publish(pending)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_series(session: Session, previous_transaction) -> None:
+    session.info.pop("pending_series", None)
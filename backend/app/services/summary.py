@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Collection, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from ..models import DimensionEnum, LatestMetric
+from ..schemas import DimensionSummary
+
+
+def latest_by_dimension(
+    db: Session, dataset_ids: Optional[Collection[int]] = None
+) -> Dict[int, Dict[DimensionEnum, Tuple[float, datetime]]]:
+    # One grouped join over latest_metrics (one row per series, keyed by dataset first):
+    # MAX(recorded_at) per (dataset, dimension), then the average of every point at that
+    # timestamp, from the per-series sums and counts.
+    latest = select(
+        LatestMetric.dataset_id,
+        LatestMetric.dimension,
+        func.max(LatestMetric.recorded_at).label("latest_at"),
+    ).group_by(LatestMetric.dataset_id, LatestMetric.dimension)
+    if dataset_ids is not None:
+        latest = latest.where(LatestMetric.dataset_id.in_(list(dataset_ids)))
+    latest = latest.subquery()
+
+    stmt = (
+        select(
+            latest.c.dataset_id,
+            latest.c.dimension,
+            latest.c.latest_at,
+            func.sum(LatestMetric.value_sum) / func.sum(LatestMetric.value_count),
+        )
+        .join(
+            LatestMetric,
+            and_(
+                LatestMetric.dataset_id == latest.c.dataset_id,
+                LatestMetric.dimension == latest.c.dimension,
+                LatestMetric.recorded_at == latest.c.latest_at,
+            ),
+        )
+        .group_by(latest.c.dataset_id, latest.c.dimension, latest.c.latest_at)
+    )
+
+    out: Dict[int, Dict[DimensionEnum, Tuple[float, datetime]]] = {}
+    for ds_id, dim, latest_at, avg_value in db.execute(stmt):
+        out.setdefault(ds_id, {})[DimensionEnum(dim)] = (float(avg_value), latest_at)
+    return out
+
+
+def dimension_summaries(latest: Dict[DimensionEnum, Tuple[float, datetime]]) -> List[DimensionSummary]:
+    results: List[DimensionSummary] = []
+    for dim in DimensionEnum:
+        if dim in latest:
+            value, latest_at = latest[dim]
+            results.append(DimensionSummary(dimension=dim, latest_value=value, latest_at=latest_at))
+        else:
+            results.append(DimensionSummary(dimension=dim, latest_value=None, latest_at=None))
+    return results
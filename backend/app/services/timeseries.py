@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import io
+import math
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Integer, cast, func, join, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..core.config import get_settings
+from ..models import DimensionEnum, MetricRecord, MetricSeries
+from .downsample import epoch_ms, lttb
+
+
+BUCKET_SECONDS: Dict[str, int] = {
+    "1m": 60,
+    "5m": 300,
+    "15m": 900,
+    "1h": 3600,
+    "6h": 6 * 3600,
+    "1d": 86400,
+    "1w": 7 * 86400,
+}
+AGGREGATES = ("avg", "min", "max", "last")
+# Unbucketed reads with max_points are pre-aggregated in SQL to about this many buckets
+# per output point once there are more raw points than that, so LTTB's input (and the
+# rows fetched) scale with the chart width rather than the history length.
+LTTB_OVERSAMPLE = 4
+
+Series = Dict[str, List[Tuple[datetime, float]]]
+
+# Points carry only a series id; dataset, dimension and name live on metric_series.
+RECORDS = join(MetricRecord, MetricSeries, MetricRecord.series_id == MetricSeries.id)
+
+
+def _bucket_start(dialect: str, seconds: int):
+    # Inline the width so the expression is textually identical in SELECT and GROUP BY
+    # even on drivers that bind parameters server-side.
+    seconds = literal_column(str(int(seconds)))
+    if dialect == "sqlite":
+        epoch = cast(func.strftime("%s", MetricRecord.recorded_at), Integer)
+        return epoch // seconds * seconds
+    return func.floor(func.extract("epoch", MetricRecord.recorded_at) / seconds) * seconds
+
+
+def metric_filters(
+    dataset_id: int,
+    dimension: Optional[DimensionEnum],
+    metric_name: Optional[str],
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> list:
+    # Filters over RECORDS.
+    clauses = [MetricSeries.dataset_id == dataset_id]
+    if dimension is not None:
+        clauses.append(MetricSeries.dimension == dimension)
+    if metric_name is not None:
+        clauses.append(MetricSeries.metric_name == metric_name)
+    if start is not None:
+        clauses.append(MetricRecord.recorded_at >= start)
+    if end is not None:
+        clauses.append(MetricRecord.recorded_at <= end)
+    return clauses
+
+
+def _bucketed_statement(dialect: str, clauses: list, seconds: int, agg: str):
+    bucket = _bucket_start(dialect, seconds).label("bucket")
+    if agg == "last":
+        ranked = (
+            select(
+                MetricSeries.metric_name,
+                bucket,
+                MetricRecord.metric_value,
+                func.row_number()
+                .over(
+                    partition_by=(MetricSeries.metric_name, bucket),
+                    order_by=(MetricRecord.recorded_at.desc(), MetricRecord.id.desc()),
+                )
+                .label("rn"),
+            )
+            .select_from(RECORDS)
+            .where(*clauses)
+            .subquery()
+        )
+        return (
+            select(ranked.c.metric_name, ranked.c.bucket, ranked.c.metric_value)
+            .where(ranked.c.rn == 1)
+            .order_by(ranked.c.metric_name, ranked.c.bucket)
+        )
+    agg_fn = {"avg": func.avg, "min": func.min, "max": func.max}[agg]
+    return (
+        select(MetricSeries.metric_name, bucket, agg_fn(MetricRecord.metric_value))
+        .select_from(RECORDS)
+        .where(*clauses)
+        .group_by(MetricSeries.metric_name, bucket)
+        .order_by(MetricSeries.metric_name, bucket)
+    )
+
+
+def _rollup_window(db: Session, bucket: str, start: Optional[datetime], end: Optional[datetime]):
+    # Bucketed reads use metric_rollups for whole rollup buckets they cover; None
+    # keeps the query on raw points only.
+    if not get_settings().METRICS_ROLLUP_READS:
+        return None
+    from .rollups import rollup_boundary, rollup_granularity, rollup_window
+
+    granularity = rollup_granularity(bucket)
+    if granularity is None:
+        return None
+    boundary = rollup_boundary(db)
+    if boundary is None:
+        return None
+    lo, hi = rollup_window(granularity, start, end, boundary)
+    return (lo, hi) if lo is None or lo < hi else None
+
+
+def _bucket_series(rows) -> Series:
+    series: Series = {}
+    for name, bucket_start, value in rows:
+        series.setdefault(name, []).append((datetime.utcfromtimestamp(int(bucket_start)), float(value)))
+    return series
+
+
+def _raw_series(rows) -> Series:
+    series: Series = {}
+    for name, recorded_at, value in rows:
+        series.setdefault(name, []).append((recorded_at, value))
+    return series
+
+
+def _downsample(series: Series, max_points: Optional[int]) -> Series:
+    if max_points is None:
+        return series
+    return {name: lttb(points, max_points) for name, points in series.items()}
+
+
+def _span_statement(clauses: list):
+    return (
+        select(func.count(), func.min(MetricRecord.recorded_at), func.max(MetricRecord.recorded_at))
+        .select_from(RECORDS)
+        .where(*clauses)
+    )
+
+
+def downsample_seconds(span, max_points: Optional[int]) -> Optional[int]:
+    # Bucket width for pre-aggregating an unbucketed read, from its (count, first, last)
+    # row; None when the raw points are few enough to hand to LTTB as they are.
+    count, first, last = span
+    if max_points is None or not count or count <= max_points * LTTB_OVERSAMPLE:
+        return None
+    return max(1, math.ceil((last - first).total_seconds() / (max_points * LTTB_OVERSAMPLE)))
+
+
+def _raw_statement(clauses: list):
+    return (
+        select(MetricSeries.metric_name, MetricRecord.recorded_at, MetricRecord.metric_value)
+        .select_from(RECORDS)
+        .where(*clauses)
+        .order_by(MetricSeries.metric_name, MetricRecord.recorded_at)
+    )
+
+
+def load_series(
+    db: Session,
+    dataset_id: int,
+    dimension: Optional[DimensionEnum] = None,
+    metric_name: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Optional[str] = None,
+    agg: str = "avg",
+    max_points: Optional[int] = None,
+) -> Series:
+    # Rows come back as plain tuples; with a bucket (or a width derived from max_points)
+    # the aggregation happens in SQL and max_points applies LTTB to whatever is left.
+    clauses = metric_filters(dataset_id, dimension, metric_name, start, end)
+    dialect = db.get_bind().dialect.name
+    window = _rollup_window(db, bucket, start, end) if bucket is not None else None
+    seconds = BUCKET_SECONDS[bucket] if bucket is not None else None
+    if seconds is None and max_points is not None:
+        seconds = downsample_seconds(db.execute(_span_statement(clauses)).one(), max_points)
+    if window is not None:
+        from .rollups import merge_rollup_rows, rollup_statements
+
+        rollup_q, raw_q = rollup_statements(dialect, dataset_id, dimension, metric_name, start, end, bucket, window)
+        series = merge_rollup_rows(db.execute(rollup_q), db.execute(raw_q), bucket, agg)
+    elif seconds is not None:
+        series = _bucket_series(db.execute(_bucketed_statement(dialect, clauses, seconds, agg)))
+    else:
+        series = _raw_series(db.execute(_raw_statement(clauses).execution_options(yield_per=10_000)))
+    return _downsample(series, max_points)
+
+
+async def load_series_async(
+    db: AsyncSession,
+    dataset_id: int,
+    dimension: Optional[DimensionEnum] = None,
+    metric_name: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Optional[str] = None,
+    agg: str = "avg",
+    max_points: Optional[int] = None,
+) -> Series:
+    # load_series over an AsyncSession: the queries are awaited, and grouping rows,
+    # merging rollups and LTTB run in the threadpool instead of on the event loop.
+    clauses = metric_filters(dataset_id, dimension, metric_name, start, end)
+    dialect = db.get_bind().dialect.name
+    window = await db.run_sync(_rollup_window, bucket, start, end) if bucket is not None else None
+    if window is not None:
+        from .rollups import merge_rollup_rows, rollup_statements
+
+        rollup_q, raw_q = rollup_statements(dialect, dataset_id, dimension, metric_name, start, end, bucket, window)
+        rollup_rows = (await db.execute(rollup_q)).all()
+        raw_rows = (await db.execute(raw_q)).all()
+        return await run_in_threadpool(lambda: _downsample(merge_rollup_rows(rollup_rows, raw_rows, bucket, agg), max_points))
+    seconds = BUCKET_SECONDS[bucket] if bucket is not None else None
+    if seconds is None and max_points is not None:
+        seconds = downsample_seconds((await db.execute(_span_statement(clauses))).one(), max_points)
+    if seconds is not None:
+        rows = (await db.execute(_bucketed_statement(dialect, clauses, seconds, agg))).all()
+        return await run_in_threadpool(lambda: _downsample(_bucket_series(rows), max_points))
+    rows = (await db.execute(_raw_statement(clauses))).all()
+    return await run_in_threadpool(lambda: _downsample(_raw_series(rows), max_points))
+
+
+def to_columnar(series: Series) -> List[Dict[str, Any]]:
+    return [
+        {"metric_name": name, "timestamps": [epoch_ms(ts) for ts, _ in points], "values": [value for _, value in points]}
+        for name, points in series.items()
+    ]
+
+
+ARROW_MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def to_arrow_bytes(series: Series, fmt: str) -> bytes:
+    # pyarrow is optional; ImportError propagates to the caller.
+    import pyarrow as pa
+
+    names: List[str] = []
+    timestamps: List[int] = []
+    values: List[float] = []
+    for name, points in series.items():
+        names.extend([name] * len(points))
+        timestamps.extend(epoch_ms(ts) for ts, _ in points)
+        values.extend(value for _, value in points)
+    table = pa.table({
+        "metric_name": pa.array(names, type=pa.string()).dictionary_encode(),
+        "recorded_at": pa.array(timestamps, type=pa.timestamp("ms", tz="UTC")),
+        "value": pa.array(values, type=pa.float64()),
+    })
+
+    sink = io.BytesIO()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue()
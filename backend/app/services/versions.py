@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Collection, Dict, Optional
+
+from sqlalchemy import DateTime, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from ..models import Dataset, DatasetVersion
+
+
+def bump_versions(db: Session, dataset_ids: Optional[Collection[int]] = None) -> None:
+    # Caller commits, so the new version becomes visible together with the data.
+    # None bumps every dataset (e.g. after retention removed raw points).
+    table = DatasetVersion.__table__
+    now = datetime.utcnow()
+    if dataset_ids is None:
+        db.execute(update(table).values(version=table.c.version + 1, updated_at=now))
+        known = select(table.c.dataset_id)
+        db.execute(insert(table).from_select(
+            ["dataset_id", "version", "updated_at"],
+            select(Dataset.id, literal(1), literal(now, DateTime(timezone=True))).where(Dataset.id.not_in(known)),
+        ))
+        return
+    values = [{"dataset_id": ds_id, "version": 1, "updated_at": now} for ds_id in sorted(set(dataset_ids))]
+    if not values:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["dataset_id"],
+            set_={"version": table.c.version + 1, "updated_at": stmt.excluded.updated_at},
+        )
+        db.execute(stmt, values)
+        return
+    for value in values:
+        bumped = db.execute(
+            update(table).where(table.c.dataset_id == value["dataset_id"]).values(version=table.c.version + 1, updated_at=now)
+        ).rowcount
+        if not bumped:
+            db.execute(insert(table), value)
+
+
+def get_versions(db: Session, dataset_ids: Collection[int]) -> Dict[int, int]:
+    # Datasets never written to are at version 0.
+    ids = sorted(set(dataset_ids))
+    versions = dict.fromkeys(ids, 0)
+    if ids:
+        rows = db.execute(select(DatasetVersion.dataset_id, DatasetVersion.version).where(DatasetVersion.dataset_id.in_(ids)))
+        versions.update({ds_id: version for ds_id, version in rows})
+    return versions
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+# Login throughput under concurrency, and how much a login burst slows other requests.
+#
+# One uvicorn process is started per PASSWORD_HASH_WORKERS value (0 = hash on the
+# request threadpool, as before the process pool existed).
+#
+#   python -m benchmarks.login --workers-list 0,4 --logins 200 --concurrency 32
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from .load import percentile, wait_until_ready
+
+
+async def burst(base_url: str, email: str, password: str, logins: int, reads: int, concurrency: int) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0) as client:
+        token = (await client.post("/auth/login", json={"email": email, "password": password})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        semaphore = asyncio.Semaphore(concurrency)
+        login_latencies: List[float] = []
+        read_latencies: List[float] = []
+        statuses: Dict[int, int] = {}
+
+        async def login() -> None:
+            async with semaphore:
+                t0 = time.perf_counter()
+                r = await client.post("/auth/login", json={"email": email, "password": password})
+                login_latencies.append(time.perf_counter() - t0)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        async def read() -> None:
+            t0 = time.perf_counter()
+            await client.get("/datasets/", headers=headers)
+            read_latencies.append(time.perf_counter() - t0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)), *(read() for _ in range(reads)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "logins": logins,
+        "login_statuses": statuses,
+        "logins_per_second": round(logins / elapsed, 2),
+        "login_p95_ms": round(percentile(login_latencies, 95) * 1000, 1),
+        "read_p50_ms_during_burst": round(percentile(read_latencies, 50) * 1000, 1),
+        "read_p95_ms_during_burst": round(percentile(read_latencies, 95) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Login throughput with and without the hashing process pool")
+    parser.add_argument("--database-url", default=None, help="defaults to a temporary SQLite file")
+    parser.add_argument("--workers-list", default="0,4")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--reads", type=int, default=200, help="dataset reads issued alongside the logins")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite+pysqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_login.db')}"
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "benchmark-secret-key-with-enough-bytes"),
+    }
+    subprocess.run([sys.executable, "-m", "app.seed_db"], env=env, check=True)
+    email = env.get("INITIAL_ADMIN_EMAIL", "admin@example.com")
+    password = env.get("INITIAL_ADMIN_PASSWORD", "admin123")
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    results: Dict[str, Any] = {}
+    for workers in args.workers_list.split(","):
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+            env={**env, "PASSWORD_HASH_WORKERS": workers},
+        )
+        try:
+            wait_until_ready(base_url)
+            results[f"workers={workers}"] = asyncio.run(
+                burst(base_url, email, password, args.logins, args.reads, args.concurrency)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps({"cpu_count": os.cpu_count(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
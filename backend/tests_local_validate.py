@@ -73,6 +73,1209 @@ def test_flow():
     assert r.status_code == 200, r.text
 
 
+def admin_token() -> str:
+    r = client.post("/auth/login", json={"email": "admin@example.com", "password": "admin123"})
+    assert r.status_code == 200, r.text
+    return r.json()["access_token"]
+
+
+def run_rule_set(token: str, payload: dict) -> List[dict]:
+    # POST /rules/run answers 202 at once; poll the run until the background work is done.
+    import time
+
+    r = client.post("/rules/run", headers=auth_headers(token), json=payload)
+    assert r.status_code == 202, r.text
+    run = r.json()
+    deadline = time.monotonic() + 30
+    while run["status"] in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(0.02)
+        run = client.get(f"/rules/runs/{run['run_id']}", headers=auth_headers(token)).json()
+    assert run["status"] == "done", run
+    assert len(run["executions"]) == run["rules"]
+    return run["executions"]
+
+
+def test_bulk_ingest_without_echo():
+    token = admin_token()
+    dataset_id = client.get("/datasets", headers=auth_headers(token)).json()[0]["id"]
+    payload = [
+        {"dataset_id": dataset_id, "dimension": "validity", "metric_name": f"bulk_{i % 3}", "metric_value": i / 100}
+        for i in range(25)
+    ]
+    r = client.post("/metrics/ingest", headers=auth_headers(token), params={"echo": False, "chunk_size": 10}, json=payload)
+    assert r.status_code == 200, r.text
+    assert r.json() == {"inserted": 25}
+
+    r = client.post("/metrics/ingest", headers=auth_headers(token), params={"chunk_size": 2}, json=payload[:5])
+    assert r.status_code == 200, r.text
+    rows = r.json()
+    assert [row["metric_name"] for row in rows] == [p["metric_name"] for p in payload[:5]]
+    assert all(row["id"] for row in rows)
+
+    from app.core.config import get_settings
+
+    too_big = get_settings().INGEST_MAX_CHUNK_SIZE + 1
+    r = client.post("/metrics/ingest", headers=auth_headers(token), params={"chunk_size": too_big}, json=payload[:1])
+    assert r.status_code == 422
+
+
+def test_stream_ingest_ndjson_and_csv():
+    token = admin_token()
+    dataset_id = client.get("/datasets", headers=auth_headers(token)).json()[0]["id"]
+    ndjson = "\n".join([
+        f'{{"dataset_id": {dataset_id}, "dimension": "accuracy", "metric_name": "stream_a", "metric_value": 0.5}}',
+        "not json",
+        f'{{"dataset_id": {dataset_id}, "dimension": "bogus", "metric_name": "stream_a", "metric_value": 0.5}}',
+        "",
+        f'{{"dataset_id": {dataset_id}, "dimension": "accuracy", "metric_name": "stream_a", "metric_value": 0.7}}',
+    ])
+    r = client.post(
+        "/metrics/ingest/stream",
+        headers={**auth_headers(token), "Content-Type": "application/x-ndjson"},
+        content=iter([ndjson[:50].encode(), ndjson[50:].encode()]),
+    )
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["inserted"] == 2
+    assert [e["line"] for e in body["errors"]] == [2, 3]
+
+    csv_body = (
+        "dataset_id,dimension,metric_name,metric_value,recorded_at\n"
+        f"{dataset_id},timeliness,stream_csv,1.5,2024-01-01T00:00:00\n"
+        f"{dataset_id},timeliness,stream_csv,oops,\n"
+        f"{dataset_id},timeliness,stream_csv,2.5,\n"
+    )
+    r = client.post("/metrics/ingest/stream", headers={**auth_headers(token), "Content-Type": "text/csv"}, content=csv_body)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["inserted"] == 2 and body["failed"] == 1
+    assert body["errors"][0]["line"] == 3
+    r = client.post(
+        "/metrics/ingest/stream",
+        headers={**auth_headers(token), "Content-Type": "text/csv"},
+        content=f"\n\ndataset_id,metric_name\n{dataset_id},stream_csv\n",
+    )
+    assert r.status_code == 400 and "missing columns" in r.json()["detail"]
+
+    # A body that is not UTF-8 is a 400 that still reports what was committed before it.
+    def chunks():
+        yield f'{{"dataset_id": {dataset_id}, "dimension": "validity", "metric_name": "stream_utf8", "metric_value": 1}}\n'.encode()
+        yield b'{"metric_name": "\xff\xfe"}\n'
+
+    r = client.post("/metrics/ingest/stream", headers=auth_headers(token), content=chunks())
+    assert r.status_code == 400, r.text
+    detail = r.json()["detail"]
+    assert detail["inserted"] == 1 and detail["failed"] == 1
+    assert detail["errors"][0]["line"] == 2 and "UTF-8" in detail["errors"][0]["error"]
+
+
+def test_latest_overview():
+    token = admin_token()
+    dataset_id = client.get("/datasets", headers=auth_headers(token)).json()[0]["id"]
+    single = client.get("/metrics/latest", headers=auth_headers(token), params={"dataset_id": dataset_id}).json()
+
+    r = client.get("/metrics/latest/overview", headers=auth_headers(token))
+    assert r.status_code == 200, r.text
+    overview = {o["dataset_id"]: o["dimensions"] for o in r.json()}
+    assert overview[dataset_id] == single
+
+    r = client.get("/metrics/latest/overview", headers=auth_headers(token), params={"dataset_ids": f"{dataset_id},{dataset_id}"})
+    assert r.status_code == 200, r.text
+    assert [o["dataset_id"] for o in r.json()] == [dataset_id]
+
+
+def test_latest_table_ignores_backfilled_points():
+    token = admin_token()
+    r = client.post("/datasets", headers=auth_headers(token), json={"key": "latest_table", "name": "Latest table"})
+    assert r.status_code == 200, r.text
+    dataset_id = r.json()["id"]
+    payload = [
+        {"dataset_id": dataset_id, "dimension": "accuracy", "metric_name": "m", "metric_value": 0.9, "recorded_at": "2024-02-01T00:00:00"},
+        {"dataset_id": dataset_id, "dimension": "accuracy", "metric_name": "m", "metric_value": 0.1, "recorded_at": "2024-01-01T00:00:00"},
+    ]
+    for item in payload:
+        r = client.post("/metrics/ingest", headers=auth_headers(token), params={"echo": False}, json=[item])
+        assert r.status_code == 200, r.text
+    latest = client.get("/metrics/latest", headers=auth_headers(token), params={"dataset_id": dataset_id}).json()
+    accuracy = next(x for x in latest if x["dimension"] == "accuracy")
+    assert accuracy["latest_value"] == 0.9
+
+    # Like an AVG over metric_records, every point at the latest timestamp counts: repeats
+    # within a series (in one request or across requests) and other series alike.
+    at = "2024-03-01T00:00:00"
+    point = {"dataset_id": dataset_id, "dimension": "validity", "recorded_at": at}
+    for batch in (
+        [dict(point, metric_name="a", metric_value=0.2), dict(point, metric_name="a", metric_value=0.4)],
+        [dict(point, metric_name="a", metric_value=0.6), dict(point, metric_name="b", metric_value=1.0)],
+        [dict(point, metric_name="b", metric_value=0.0, recorded_at="2024-02-01T00:00:00")],
+    ):
+        assert client.post("/metrics/ingest", headers=auth_headers(token), params={"echo": False}, json=batch).status_code == 200
+    latest = client.get("/metrics/latest", headers=auth_headers(token), params={"dataset_id": dataset_id}).json()
+    validity = next(x for x in latest if x["dimension"] == "validity")
+    assert abs(validity["latest_value"] - 0.55) < 1e-9
+
+    from app.rebuild_latest import main as rebuild_latest
+
+    rebuild_latest()
+    assert client.get("/metrics/latest", headers=auth_headers(token), params={"dataset_id": dataset_id}).json() == latest
+
+
+def test_timeseries_bucketing_and_downsampling():
+    token = admin_token()
+    r = client.post("/datasets", headers=auth_headers(token), json={"key": "timeseries_buckets", "name": "Timeseries buckets"})
+    assert r.status_code == 200, r.text
+    dataset_id = r.json()["id"]
+    payload = [
+        {
+            "dataset_id": dataset_id,
+            "dimension": "completeness",
+            "metric_name": "hourly",
+            "metric_value": float(i),
+            "recorded_at": f"2024-03-01T{i // 6:02d}:{(i % 6) * 10:02d}:00",
+        }
+        for i in range(24)
+    ]
+    r = client.post("/metrics/ingest", headers=auth_headers(token), params={"echo": False}, json=payload)
+    assert r.status_code == 200, r.text
+
+    params = {"dataset_id": dataset_id, "bucket": "1h"}
+    series = client.get("/metrics/timeseries", headers=auth_headers(token), params={**params, "agg": "avg"}).json()
+    assert [p["value"] for p in series[0]["points"]] == [2.5, 8.5, 14.5, 20.5]
+    assert series[0]["points"][1]["recorded_at"].startswith("2024-03-01T01:00:00")
+    series = client.get("/metrics/timeseries", headers=auth_headers(token), params={**params, "agg": "last"}).json()
+    assert [p["value"] for p in series[0]["points"]] == [5.0, 11.0, 17.0, 23.0]
+
+    series = client.get("/metrics/timeseries", headers=auth_headers(token), params={"dataset_id": dataset_id, "max_points": 5}).json()
+    points = series[0]["points"]
+    assert len(points) == 5
+    assert points[0]["value"] == 0.0 and points[-1]["value"] == 23.0
+
+    # Long unbucketed histories are pre-aggregated in SQL to a width derived from
+    # max_points, so LTTB only sees about LTTB_OVERSAMPLE points per output point.
+    from datetime import datetime, timedelta, timezone
+    from app.services.timeseries import downsample_seconds
+
+    t0 = datetime(2024, 4, 1)
+    assert downsample_seconds((24, t0, t0 + timedelta(hours=4)), 6) is None
+    assert downsample_seconds((400, t0, t0 + timedelta(minutes=399)), 10) == 599
+    spiky = [
+        {"dataset_id": dataset_id, "dimension": "completeness", "metric_name": "minutely",
+         "metric_value": 100.0 if i == 123 else float(i % 7), "recorded_at": (t0 + timedelta(minutes=i)).isoformat()}
+        for i in range(400)
+    ]
+    assert client.post("/metrics/ingest", headers=auth_headers(token), params={"echo": False}, json=spiky).status_code == 200
+    r = client.get("/metrics/timeseries", headers=auth_headers(token), params={
+        "dataset_id": dataset_id, "metric_name": "minutely", "max_points": 10, "agg": "max",
+    })
+    points = r.json()[0]["points"]
+    assert len(points) == 10 and max(p["value"] for p in points) == 100.0
+    assert all(int(datetime.fromisoformat(p["recorded_at"]).replace(tzinfo=timezone.utc).timestamp()) % 599 == 0 for p in points)
+
+    # Naive timestamps are UTC: the server's zone and its DST changes must not matter.
+    import time
+    from app.services.downsample import lttb
+
+    across_dst = [(datetime(2024, 3, 10) + timedelta(minutes=10 * i), float((i * 7) % 5)) for i in range(25)]
+    old_tz = os.environ.get("TZ")
+    try:
+        os.environ["TZ"] = "UTC"
+        time.tzset()
+        in_utc = lttb(across_dst, 8)
+        os.environ["TZ"] = "America/New_York"
+        time.tzset()
+        assert lttb(across_dst, 8) == in_utc
+    finally:
+        if old_tz is None:
+            os.environ.pop("TZ", None)
+        else:
+            os.environ["TZ"] = old_tz
+        time.tzset()
+
+    r = client.get("/metrics/timeseries", headers=auth_headers(token), params={**params, "agg": "max", "format": "columnar"})
+    assert r.status_code == 200, r.text
+    columnar = r.json()[0]
+    assert columnar["values"] == [5.0, 11.0, 17.0, 23.0]
+    assert columnar["timestamps"][0] == 1709251200000
+
+
+def test_export_pagination_and_stream():
+    token = admin_token()
+    dataset_id = client.get("/datasets", headers=auth_headers(token)).json()[0]["id"]
+    seen: List[int] = []
+    cursor = None
+    while True:
+        params = {"dataset_id": dataset_id, "limit": 4}
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get("/metrics/export", headers=auth_headers(token), params=params)
+        assert r.status_code == 200, r.text
+        page = r.json()
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) > 4
+
+    r = client.get("/metrics/export", headers=auth_headers(token), params={"dataset_id": dataset_id, "stream": True})
+    assert r.status_code == 200, r.text
+    lines = [line for line in r.text.splitlines() if line]
+    assert len(lines) == len(seen)
+
+    # Pages are read per series of the dataset, never through the table-wide time index.
+    from datetime import datetime
+    from sqlalchemy.dialects import postgresql
+    from app.services.export import export_statement
+    from app.services.timeseries import metric_filters
+
+    clauses = metric_filters(dataset_id, None, None, None, None)
+    sql = str(export_statement("postgresql", clauses, (datetime.utcnow(), 1), 5).compile(dialect=postgresql.dialect()))
+    assert "JOIN LATERAL" in sql and "(metric_records.recorded_at, metric_records.id) >" in sql
+    with engine.connect() as conn:
+        stmt = export_statement(conn.dialect.name, clauses, None, 5)
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(stmt.compile(conn, compile_kwargs={"literal_binds": True}))).all()
+    assert not any("ix_metrics_time_id" in row[-1] for row in plan)
+
+
+def test_principal_cache_invalidated_on_update():
+    token = admin_token()
+    r = client.post(
+        "/users",
+        headers=auth_headers(token),
+        json={"email": "cached@example.com", "password": "password123", "dataset_ids": []},
+    )
+    assert r.status_code == 200, r.text
+    user_id = r.json()["id"]
+    r = client.post("/auth/login", json={"email": "cached@example.com", "password": "password123"})
+    user_token = r.json()["access_token"]
+
+    for _ in range(2):
+        assert client.get("/datasets", headers=auth_headers(user_token)).status_code == 200
+    stats = client.get("/system/caches", headers=auth_headers(token)).json()["auth_principals"]
+    assert stats["hits"] >= 1
+
+    r = client.patch(f"/users/{user_id}", headers=auth_headers(token), json={"is_active": False})
+    assert r.status_code == 200, r.text
+    assert client.get("/datasets", headers=auth_headers(user_token)).status_code == 401
+
+
+def test_dataset_acl_cache_follows_access_updates():
+    token = admin_token()
+    datasets = client.get("/datasets", headers=auth_headers(token)).json()
+    first, second = datasets[0]["id"], datasets[1]["id"]
+    r = client.post(
+        "/users",
+        headers=auth_headers(token),
+        json={"email": "acl@example.com", "password": "password123", "dataset_ids": [first]},
+    )
+    assert r.status_code == 200, r.text
+    user_id = r.json()["id"]
+    user_token = client.post("/auth/login", json={"email": "acl@example.com", "password": "password123"}).json()["access_token"]
+    item = {"dimension": "validity", "metric_name": "acl", "metric_value": 1.0}
+
+    assert [d["id"] for d in client.get("/datasets", headers=auth_headers(user_token)).json()] == [first]
+    r = client.post("/metrics/ingest", headers=auth_headers(user_token), json=[{**item, "dataset_id": second}])
+    assert r.status_code == 403
+
+    r = client.patch(f"/users/{user_id}", headers=auth_headers(token), json={"dataset_ids": [first, second]})
+    assert r.status_code == 200, r.text
+    r = client.post(
+        "/metrics/ingest",
+        headers=auth_headers(user_token),
+        params={"echo": False},
+        json=[{**item, "dataset_id": first}, {**item, "dataset_id": second}],
+    )
+    assert r.status_code == 200, r.text
+    r = client.get("/metrics/latest/overview", headers=auth_headers(user_token))
+    assert [o["dataset_id"] for o in r.json()] == sorted([first, second])
+
+
+def test_async_routers_match_sync():
+    from fastapi import FastAPI
+
+    from app.routers import auth, datasets_async, metrics_async
+
+    async_app = FastAPI()
+    for module in (auth, datasets_async, metrics_async):
+        async_app.include_router(module.router)
+    token = admin_token()
+    dataset_id = client.get("/datasets", headers=auth_headers(token)).json()[0]["id"]
+
+    with TestClient(async_app) as async_client:
+        r = async_client.post(
+            "/metrics/ingest",
+            headers=auth_headers(token),
+            json=[{"dataset_id": dataset_id, "dimension": "consistency", "metric_name": "async", "metric_value": 0.25}],
+        )
+        assert r.status_code == 200, r.text
+        assert r.json()[0]["metric_name"] == "async"
+        for path, params in [
+            ("/datasets/", {}),
+            ("/metrics/latest", {"dataset_id": dataset_id}),
+            ("/metrics/timeseries", {"dataset_id": dataset_id, "bucket": "1d"}),
+            ("/metrics/export", {"dataset_id": dataset_id, "limit": 3}),
+        ]:
+            r = async_client.get(path, headers=auth_headers(token), params=params)
+            assert r.status_code == 200, r.text
+            assert r.json() == client.get(path, headers=auth_headers(token), params=params).json()
+        r = async_client.get("/metrics/export", headers=auth_headers(token), params={"dataset_id": dataset_id, "stream": True})
+        sync_stream = client.get("/metrics/export", headers=auth_headers(token), params={"dataset_id": dataset_id, "stream": True})
+        assert r.text == sync_stream.text
+
+
+def test_login_rehashes_outdated_password_hash():
+    from app.core.security import PBKDF2_ITERATIONS, hash_password
+    from app.db import SessionLocal
+    from app.models import User
+
+    token = admin_token()
+    r = client.post("/users", headers=auth_headers(token), json={"email": "rehash@example.com", "password": "password123"})
+    assert r.status_code == 200, r.text
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.email == "rehash@example.com").one()
+        user.hashed_password = hash_password("password123", iterations=1000)
+        db.commit()
+
+    r = client.post("/auth/login", json={"email": "rehash@example.com", "password": "password123"})
+    assert r.status_code == 200, r.text
+    with SessionLocal() as db:
+        hashed = db.query(User).filter(User.email == "rehash@example.com").one().hashed_password
+    assert hashed.split("$")[1] == str(PBKDF2_ITERATIONS)
+
+    stats = client.get("/system/password-hasher", headers=auth_headers(token)).json()
+    assert stats["completed"] >= 3 and stats["in_flight"] == 0
+
+    # A repeat login against the same stored hash is answered from the verification
+    # cache; a wrong password is not.
+    completed = []
+    for password in ("password123", "password123", "wrong-password"):
+        client.post("/auth/login", json={"email": "rehash@example.com", "password": password})
+        completed.append(client.get("/system/password-hasher", headers=auth_headers(token)).json()["completed"])
+    assert completed[1] == completed[0] and completed[2] == completed[1] + 1
+
+
+def test_rule_engine_records_results():
+    from app.services.rules import RuleEngine, RuleSpec
+
+    token = admin_token()
+    dataset_id = client.get("/datasets", headers=auth_headers(token)).json()[0]["id"]
+    rules = [
+        {"name": "row_count", "sql_query": f"SELECT COUNT(*) AS metric_value FROM metric_records r JOIN metric_series s ON s.id = r.series_id WHERE s.dataset_id = {dataset_id}", "threshold_min": 1},
+        {"name": "pct_check", "sql_query": "SELECT 3 AS num_violated_rows, 0.75 AS pct_violated_rows", "dimension": "validity", "threshold_max": 0.5},
+        {"name": "broken", "sql_query": "SELECT * FROM no_such_table"},
+    ]
+    for rule in rules:
+        r = client.post("/rules", headers=auth_headers(token), json={"dataset_id": dataset_id, "dimension": "completeness", **rule})
+        assert r.status_code == 200, r.text
+
+    results = {e["rule_id"]: e for e in run_rule_set(token, {"dataset_ids": [dataset_id]})}
+    by_name = {rule["name"]: rule["id"] for rule in client.get("/rules", headers=auth_headers(token), params={"dataset_id": dataset_id}).json()}
+    assert results[by_name["row_count"]]["status"] == "ok" and results[by_name["row_count"]]["passed"] is True
+    assert results[by_name["pct_check"]]["metric_value"] == 0.75 and results[by_name["pct_check"]]["passed"] is False
+    assert client.get("/rules/runs/missing", headers=auth_headers(token)).status_code == 404
+    assert results[by_name["broken"]]["status"] == "error"
+
+    series = client.get("/metrics/timeseries", headers=auth_headers(token), params={"dataset_id": dataset_id, "metric_name": "pct_check"}).json()
+    assert series[0]["points"][-1]["value"] == 0.75
+
+    runaway = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT COUNT(*) FROM n"
+    outcome = RuleEngine(engine, max_workers=1, per_dataset_concurrency=1, statement_timeout=0.05).execute(
+        RuleSpec(id=0, dataset_id=dataset_id, name="runaway", sql_query=runaway)
+    )
+    assert outcome.status == "timeout"
+
+    # Rules run read-only, and the connection is writable again afterwards.
+    writer = RuleSpec(id=0, dataset_id=dataset_id, name="writer", sql_query="UPDATE datasets SET name = 'clobbered' RETURNING id")
+    outcome = RuleEngine(engine, max_workers=1, per_dataset_concurrency=1, statement_timeout=0).execute(writer)
+    assert outcome.status == "error"
+    names = [ds["name"] for ds in client.get("/datasets", headers=auth_headers(token)).json()]
+    assert "clobbered" not in names
+    r = client.post("/datasets", headers=auth_headers(token), json={"key": "after_read_only", "name": "Writable"})
+    assert r.status_code == 200, r.text
+
+
+def test_fused_checks_match_individual_runs():
+    from sqlalchemy import text as sql_text
+    from app.db import SessionLocal
+    from app.services.rules import RuleEngine, load_rules
+
+    with engine.begin() as conn:
+        conn.execute(sql_text("DROP TABLE IF EXISTS fused_measurement"))
+        conn.execute(sql_text("CREATE TABLE fused_measurement (id INTEGER PRIMARY KEY, value_as_number REAL, unit_concept_id INTEGER)"))
+        conn.execute(
+            sql_text("INSERT INTO fused_measurement (value_as_number, unit_concept_id) VALUES (:v, :u)"),
+            [{"v": v, "u": u} for v, u in [(1.0, 1), (None, 1), (50.0, None), (-3.0, 2), (120.0, None), (None, None)]],
+        )
+
+    token = admin_token()
+    r = client.post("/datasets", headers=auth_headers(token), json={"key": "fused_ds", "name": "Fused checks"})
+    assert r.status_code == 200, r.text
+    dataset_id = r.json()["id"]
+    checks = [
+        ("req_value", "isRequired", "value_as_number", None),
+        ("req_unit", "isRequired", "unit_concept_id", None),
+        ("low_value", "plausibleValueLow", "value_as_number", 0),
+        ("high_value", "plausibleValueHigh", "value_as_number", 100),
+    ]
+    for name, check_name, field, value in checks:
+        r = client.post("/rules", headers=auth_headers(token), json={
+            "dataset_id": dataset_id, "name": name, "check_name": check_name,
+            "cdm_table_name": "fused_measurement", "cdm_field_name": field, "check_value": value,
+        })
+        assert r.status_code == 200, r.text
+        assert "fused_measurement" in r.json()["sql_query"]
+    r = client.post("/rules", headers=auth_headers(token), json={
+        "dataset_id": dataset_id, "name": "bad_check", "check_name": "plausibleValueLow",
+        "cdm_table_name": "fused_measurement", "cdm_field_name": "value_as_number",
+    })
+    assert r.status_code == 400
+
+    with SessionLocal() as db:
+        rules = load_rules(db, dataset_ids=[dataset_id])
+    fused = {o.rule.name: o for o in RuleEngine(engine, 2, 1, 0, fuse=True).run(rules)}
+    single = {o.rule.name: o for o in RuleEngine(engine, 2, 1, 0, fuse=False).run(rules)}
+    expected = {"req_value": (2, 6), "req_unit": (3, 6), "low_value": (1, 4), "high_value": (1, 4)}
+    for name, (violated, denominator) in expected.items():
+        for outcome in (fused[name], single[name]):
+            assert outcome.status == "ok", outcome.error
+            assert (outcome.num_violated_rows, outcome.num_denominator_rows) == (violated, denominator)
+            assert abs(outcome.value - violated / denominator) < 1e-9
+
+    executions = run_rule_set(token, {"dataset_ids": [dataset_id]})
+    assert sorted((e["num_violated_rows"], e["num_denominator_rows"]) for e in executions) == sorted(expected.values())
+
+
+def test_incremental_rules_match_full_recompute():
+    from sqlalchemy import text as sql_text
+
+    def insert(rows):
+        with engine.begin() as conn:
+            conn.execute(sql_text("INSERT INTO incr_measurement (value_as_number) VALUES (:v)"), [{"v": v} for v in rows])
+
+    with engine.begin() as conn:
+        conn.execute(sql_text("DROP TABLE IF EXISTS incr_measurement"))
+        conn.execute(sql_text("CREATE TABLE incr_measurement (id INTEGER PRIMARY KEY, value_as_number REAL)"))
+    insert([1.0, None, -5.0, 20.0])
+
+    token = admin_token()
+    dataset_id = client.post("/datasets", headers=auth_headers(token), json={"key": "incr_ds", "name": "Incremental"}).json()["id"]
+    for name, check_name, value in [("incr_required", "isRequired", None), ("incr_low", "plausibleValueLow", 0)]:
+        r = client.post("/rules", headers=auth_headers(token), json={
+            "dataset_id": dataset_id, "name": name, "check_name": check_name, "check_value": value,
+            "cdm_table_name": "incr_measurement", "cdm_field_name": "value_as_number", "incremental_column": "id",
+        })
+        assert r.status_code == 200, r.text
+    r = client.post("/rules", headers=auth_headers(token), json={
+        "dataset_id": dataset_id, "name": "incr_raw", "sql_query": "SELECT 1", "incremental_column": "id",
+    })
+    assert r.status_code == 400
+
+    def run(full=False):
+        executions = run_rule_set(token, {"dataset_ids": [dataset_id], "full": full})
+        return {e["rule_id"]: (e["incremental"], e["num_violated_rows"], e["num_denominator_rows"]) for e in executions}
+
+    first = run()
+    assert sorted(first.values()) == [(False, 1, 3), (False, 1, 4)]
+    insert([None, -1.0, 7.0])
+    incremental = run()
+    assert sorted(incremental.values()) == [(True, 2, 5), (True, 2, 7)]
+    assert run() == incremental  # empty delta keeps the counts
+    full = run(full=True)
+    assert {k: v[1:] for k, v in full.items()} == {k: v[1:] for k, v in incremental.items()}
+    assert all(not v[0] for v in full.values())
+
+
+def test_rule_result_cache_reuses_unchanged_results(tmp_path):
+    import time
+    from sqlalchemy import text as sql_text
+    from app.core.config import get_settings
+    from app.services.result_cache import CachedResult, RuleResultCache, is_volatile, normalize_sql, referenced_tables, table_fingerprint
+
+    assert normalize_sql("SELECT  1 -- note\nFROM t ;") == normalize_sql("SELECT 1 FROM t")
+    assert normalize_sql("SELECT 'a  b'") != normalize_sql("SELECT 'a b'")
+    assert referenced_tables("SELECT * FROM a x, b JOIN c ON c.id = x.id WHERE y IN (SELECT z FROM d)") == ["a", "b", "c", "d"]
+    assert is_volatile("SELECT COUNT(*) FROM t WHERE ts > CURRENT_DATE")
+
+    path = str(tmp_path / "results.db")
+    RuleResultCache(10, 60, path).put("k", CachedResult("fp", 0.5, 1, 2, time.time()))
+    reopened = RuleResultCache(10, 60, path)
+    assert reopened.get("k", "fp").value == 0.5 and reopened.get("k", "other") is None
+
+    with engine.begin() as conn:
+        conn.execute(sql_text("DROP TABLE IF EXISTS cached_visits"))
+        conn.execute(sql_text("CREATE TABLE cached_visits (id INTEGER PRIMARY KEY, visit_end DATE)"))
+        conn.execute(sql_text("INSERT INTO cached_visits (visit_end) VALUES ('2024-01-01'), (NULL), (NULL), ('2024-01-03')"))
+
+    token = admin_token()
+    dataset_id = client.post("/datasets", headers=auth_headers(token), json={"key": "cache_ds", "name": "Cached"}).json()["id"]
+    r = client.post("/rules", headers=auth_headers(token), json={
+        "dataset_id": dataset_id, "name": "missing_end", "threshold_max": 0.6,
+        "sql_query": "SELECT 1.0 * SUM(CASE WHEN visit_end IS NULL THEN 1 ELSE 0 END) / COUNT(*) AS pct_violated_rows FROM cached_visits",
+    })
+    assert r.status_code == 200, r.text
+    rule_id = r.json()["id"]
+
+    def run():
+        return run_rule_set(token, {"rule_ids": [rule_id]})[0]
+
+    first, second = run(), run()
+    assert first["cached"] is False and second["cached"] is True
+    assert first["metric_value"] == second["metric_value"] == 0.5 and second["passed"] is True
+
+    client.patch(f"/rules/{rule_id}", headers=auth_headers(token), json={"threshold_max": 0.25})
+    evaluation = client.get(f"/rules/{rule_id}/evaluation", headers=auth_headers(token)).json()
+    assert evaluation["metric_value"] == 0.5 and evaluation["passed"] is False
+    rerun = run()
+    assert rerun["cached"] is True and rerun["passed"] is False
+
+    with engine.begin() as conn:
+        conn.execute(sql_text("INSERT INTO cached_visits (visit_end) VALUES (NULL)"))
+    changed = run()
+    assert changed["cached"] is False and changed["metric_value"] == 0.6
+    # By default looking up the cache leaves the target database untouched.
+    with engine.connect() as conn:
+        assert conn.execute(sql_text("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'rule_table_changes%'")).scalar() == 0
+
+    # Opting in to change triggers also catches in-place updates.
+    settings = get_settings()
+    settings.RULES_TRACK_TABLE_CHANGES = True
+    try:
+        assert run()["cached"] is False and run()["cached"] is True
+        with engine.begin() as conn:
+            conn.execute(sql_text("UPDATE cached_visits SET visit_end = '2024-02-01' WHERE visit_end IS NULL AND id = 2"))
+        updated = run()
+        assert updated["cached"] is False and updated["metric_value"] == 0.4
+    finally:
+        settings.RULES_TRACK_TABLE_CHANGES = False
+
+    # Metric tables follow the dataset versions that ingest bumps.
+    def metric_fingerprint():
+        with engine.connect() as conn:
+            return table_fingerprint(conn, "metric_records")
+
+    before = metric_fingerprint()
+    assert before is not None and metric_fingerprint() == before
+    point = {"dataset_id": dataset_id, "dimension": "validity", "metric_name": "cache_probe", "metric_value": 1}
+    assert client.post("/metrics/ingest", headers=auth_headers(token), json=[point]).status_code == 200
+    assert metric_fingerprint() != before
+
+
+def test_rollups_and_retention_match_raw_series():
+    from datetime import datetime, timedelta
+    from app.core.config import get_settings
+    from app.db import SessionLocal
+    from app.services.rollups import maintain_metrics
+
+    settings = get_settings()
+    token = admin_token()
+    dataset_id = client.post("/datasets", headers=auth_headers(token), json={"key": "rollup_ds", "name": "Rollups"}).json()["id"]
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    points = [
+        {"dataset_id": dataset_id, "dimension": "validity", "metric_name": "roll", "metric_value": (i * 7) % 11,
+         "recorded_at": (now - timedelta(days=8) + timedelta(minutes=37 * i)).isoformat()}
+        for i in range(8 * 24 * 60 // 37)
+    ]
+    assert client.post("/metrics/ingest", headers=auth_headers(token), params={"echo": False}, json=points).status_code == 200
+
+    def series(bucket, agg, start=None):
+        params = {"dataset_id": dataset_id, "metric_name": "roll", "bucket": bucket, "agg": agg}
+        if start:
+            params["start"] = start.isoformat()
+        return [(p["recorded_at"], p["value"]) for p in client.get("/metrics/timeseries", headers=auth_headers(token), params=params).json()[0]["points"]]
+
+    def same(a, b):
+        return len(a) == len(b) and all(ta == tb and abs(va - vb) < 1e-9 for (ta, va), (tb, vb) in zip(a, b))
+
+    cases = [("1d", "avg", None), ("6h", "max", None), ("1h", "last", now - timedelta(days=3, minutes=20)), ("1w", "min", None)]
+    raw = {case: series(*case) for case in cases}
+    try:
+        with SessionLocal() as db:
+            report = maintain_metrics(db)
+        assert report["rolled_until"] <= int((now + timedelta(hours=1) - datetime(1970, 1, 1)).total_seconds())
+        for case in cases:
+            assert same(series(*case), raw[case]), case
+
+        # A backfilled point lowers the rollup boundary until the next run.
+        backfill = {"dataset_id": dataset_id, "dimension": "validity", "metric_name": "roll", "metric_value": 100,
+                    "recorded_at": (now - timedelta(days=5, minutes=5)).isoformat()}
+        client.post("/metrics/ingest", headers=auth_headers(token), json=[backfill])
+        settings.METRICS_ROLLUP_READS = False
+        raw_daily = series("1d", "max")
+        settings.METRICS_ROLLUP_READS = True
+        assert same(series("1d", "max"), raw_daily) and max(v for _, v in raw_daily) == 100
+
+        settings.METRICS_RAW_RETENTION_DAYS = 3
+        with SessionLocal() as db:
+            report = maintain_metrics(db)
+        assert report["raw_deleted"] > 0
+        settings.METRICS_ROLLUP_READS = False
+        assert len(series("1d", "max")) < len(raw_daily)
+        settings.METRICS_ROLLUP_READS = True
+        assert same(series("1d", "max"), raw_daily)
+
+        late = dict(backfill, metric_value=200, recorded_at=(now - timedelta(days=6, minutes=1)).isoformat())
+        client.post("/metrics/ingest", headers=auth_headers(token), json=[late])
+        with SessionLocal() as db:
+            assert maintain_metrics(db)["late_rows_merged"] == 1
+        assert max(v for _, v in series("1d", "max")) == 200
+    finally:
+        settings.METRICS_RAW_RETENTION_DAYS = 0
+        settings.METRICS_ROLLUP_READS = True
+
+
+def test_series_catalog_reuses_ids_and_survives_rollback():
+    from app.db import SessionLocal
+    from app.models import MetricRecord, MetricSeries
+    from app.services.ingest import insert_metrics
+    from app.services.series import series_catalog, series_key
+
+    token = admin_token()
+    dataset_id = client.post("/datasets", headers=auth_headers(token), json={"key": "series_ds", "name": "Series"}).json()["id"]
+    row = {"dataset_id": dataset_id, "dimension": "validity", "metric_name": "catalogued", "metric_value": 1.0}
+    key = series_key(dataset_id, "validity", "catalogued")
+
+    with SessionLocal() as db:
+        insert_metrics(db, [row])
+        db.rollback()
+    assert series_catalog.get(key) is None
+
+    r = client.post("/metrics/ingest", headers=auth_headers(token), json=[row, dict(row, metric_value=2.0)])
+    assert r.status_code == 200, r.text
+    assert [(p["metric_name"], p["dimension"]) for p in r.json()] == [("catalogued", "validity")] * 2
+    series_id = series_catalog.get(key)
+    assert series_id is not None
+
+    client.post("/metrics/ingest", headers=auth_headers(token), params={"echo": False}, json=[dict(row, metric_value=3.0)])
+    with SessionLocal() as db:
+        assert db.query(MetricSeries).filter(MetricSeries.dataset_id == dataset_id).count() == 1
+        values = [v for (v,) in db.query(MetricRecord.metric_value).filter(MetricRecord.series_id == series_id)]
+    assert sorted(values) == [1.0, 2.0, 3.0]
+
+    # A stale process-wide map (e.g. after a restore) is rebuilt from the table.
+    series_catalog.clear()
+    client.post("/metrics/ingest", headers=auth_headers(token), params={"echo": False}, json=[row])
+    assert series_catalog.get(key) == series_id
+
+
+def test_conditional_gets_follow_dataset_versions():
+    from app.services.http_cache import response_cache
+
+    token = admin_token()
+    headers = auth_headers(token)
+    dataset_id = client.post("/datasets", headers=headers, json={"key": "etag_ds", "name": "ETags"}).json()["id"]
+    point = {"dataset_id": dataset_id, "dimension": "accuracy", "metric_name": "etag", "metric_value": 1.0}
+    client.post("/metrics/ingest", headers=headers, params={"echo": False}, json=[point])
+
+    reads = [
+        ("/metrics/latest", {"dataset_id": dataset_id}),
+        ("/metrics/latest/overview", {"dataset_ids": str(dataset_id)}),
+        ("/metrics/timeseries", {"dataset_id": dataset_id}),
+        ("/metrics/timeseries", {"dataset_id": dataset_id, "format": "columnar"}),
+    ]
+    first = {}
+    for path, params in reads:
+        r = client.get(path, headers=headers, params=params)
+        assert r.status_code == 200 and r.headers["etag"], path
+        first[(path, str(params))] = r
+        again = client.get(path, headers={**headers, "If-None-Match": r.headers["etag"]}, params=params)
+        assert again.status_code == 304 and again.headers["etag"] == r.headers["etag"]
+        assert again.content == b""
+
+    hits = response_cache.hits
+    assert client.get("/metrics/timeseries", headers=headers, params={"dataset_id": dataset_id}).status_code == 200
+    assert response_cache.hits == hits + 1
+
+    client.post("/metrics/ingest", headers=headers, params={"echo": False}, json=[dict(point, metric_value=2.0)])
+    for path, params in reads:
+        before = first[(path, str(params))]
+        r = client.get(path, headers={**headers, "If-None-Match": before.headers["etag"]}, params=params)
+        assert r.status_code == 200 and r.headers["etag"] != before.headers["etag"], path
+        assert r.content != before.content
+
+    # The dataset list only changes when the visible set does.
+    listed = client.get("/datasets", headers=headers)
+    assert client.get("/datasets", headers={**headers, "If-None-Match": listed.headers["etag"]}).status_code == 304
+    client.post("/datasets", headers=headers, json={"key": "etag_ds_2", "name": "ETags 2"})
+    relisted = client.get("/datasets", headers={**headers, "If-None-Match": listed.headers["etag"]})
+    assert relisted.status_code == 200 and any(d["key"] == "etag_ds_2" for d in relisted.json())
+
+
+def test_live_push_after_commit_with_acl():
+    import json
+    from starlette.websockets import WebSocketDisconnect
+    from app.db import SessionLocal
+    from app.services.ingest import insert_metrics
+    from app.services.pubsub import get_broker
+
+    token = admin_token()
+    headers = auth_headers(token)
+    dataset_id = client.post("/datasets", headers=headers, json={"key": "live_ds", "name": "Live"}).json()["id"]
+    point = {"dataset_id": dataset_id, "dimension": "timeliness", "metric_name": "live", "metric_value": 0.5}
+
+    with client.websocket_connect(f"/metrics/live?dataset_id={dataset_id}&token={token}") as ws:
+        assert json.loads(ws.receive_text()) == {"type": "subscribed", "dataset_ids": [dataset_id]}
+        with SessionLocal() as db:
+            insert_metrics(db, [dict(point, metric_value=9.0)])
+            db.rollback()
+        client.post("/metrics/ingest", headers=headers, params={"echo": False}, json=[point, dict(point, metric_name="live_2")])
+        message = json.loads(ws.receive_text())
+        assert message["type"] == "metrics" and message["dataset_id"] == dataset_id and message["inserted"] == 2
+        assert sorted(p["metric_name"] for p in message["points"]) == ["live", "live_2"]
+        assert [s["latest_value"] for s in message["latest"] if s["dimension"] == "timeliness"] == [0.5]
+
+        # Brokers that cannot see other workers' subscribers only send a notice.
+        broker = get_broker()
+        broker.notify_only = True
+        try:
+            client.post("/metrics/ingest", headers=headers, params={"echo": False}, json=[point])
+        finally:
+            del broker.notify_only
+        assert json.loads(ws.receive_text()) == {"type": "changed", "dataset_id": dataset_id, "inserted": 1}
+
+    user = {"email": "live_viewer@example.com", "password": "viewerpass1", "dataset_ids": []}
+    client.post("/users", headers=headers, json=user)
+    viewer = client.post("/auth/login", json={"email": user["email"], "password": user["password"]}).json()["access_token"]
+    for query in (f"dataset_id={dataset_id}&token={viewer}", f"dataset_id={dataset_id}"):
+        with client.websocket_connect(f"/metrics/live?{query}") as ws:
+            try:
+                ws.receive_text()
+                raise AssertionError("subscription should have been refused")
+            except WebSocketDisconnect as exc:
+                assert exc.code in (4401, 4403)
+
+
+def test_queued_ingest_coalesces_batches(tmp_path):
+    import time
+    from datetime import datetime, timedelta
+    from app.core.config import get_settings
+    from app.db import SessionLocal
+    from app.models import IngestBatch
+    from app.services import ingest_queue
+
+    settings = get_settings()
+    token = admin_token()
+    headers = auth_headers(token)
+    dataset_id = client.post("/datasets", headers=headers, json={"key": "queue_ds", "name": "Queue"}).json()["id"]
+    assert client.post("/metrics/ingest/batches", headers=headers, json=[]).status_code == 501
+
+    settings.INGEST_QUEUE_PATH = str(tmp_path / "spool.db")
+    ingest_queue.get_ingest_spool.cache_clear()
+    ingest_queue.get_ingest_writer.cache_clear()
+    try:
+        batch_ids = []
+        for i in range(5):
+            points = [{"dataset_id": dataset_id, "dimension": "validity", "metric_name": f"queued_{j}", "metric_value": i + j / 10} for j in range(3)]
+            r = client.post("/metrics/ingest/batches", headers=headers, json=points)
+            assert r.status_code == 202, r.text
+            assert r.json()["status"] == "queued" and r.json()["rows"] == 3
+            batch_ids.append(r.json()["batch_id"])
+        assert client.get("/metrics/timeseries", headers=headers, params={"dataset_id": dataset_id}).json() == []
+
+        # Backpressure once the spool holds more than INGEST_QUEUE_MAX_ROWS.
+        spool = ingest_queue.get_ingest_spool()
+        spool.max_rows = 15
+        point = {"dataset_id": dataset_id, "dimension": "validity", "metric_name": "queued_0", "metric_value": 1}
+        r = client.post("/metrics/ingest/batches", headers=headers, json=[point])
+        assert r.status_code == 503 and r.headers["retry-after"]
+        spool.max_rows = settings.INGEST_QUEUE_MAX_ROWS
+
+        writer = ingest_queue.get_ingest_writer()
+        assert writer.flush() == 5
+        assert writer.flush() == 0
+        for batch_id in batch_ids:
+            status = client.get(f"/metrics/ingest/batches/{batch_id}", headers=headers).json()
+            assert status["status"] == "done" and status["inserted"] == 3 and status["finished_at"]
+        series = client.get("/metrics/timeseries", headers=headers, params={"dataset_id": dataset_id}).json()
+        assert sorted((s["metric_name"], len(s["points"])) for s in series) == [(f"queued_{j}", 5) for j in range(3)]
+
+        # A batch replayed after its commit (writer died before updating the spool) is not applied twice.
+        r = client.post("/metrics/ingest/batches", headers=headers, json=[point])
+        replayed = spool.claim("crashed", 100)
+        writer._write(replayed)
+        spool.release([replayed[0][0]])
+        assert writer.flush() == 1
+        series = client.get("/metrics/timeseries", headers=headers, params={"dataset_id": dataset_id, "metric_name": "queued_0"}).json()
+        assert len(series[0]["points"]) == 6
+        assert client.get("/metrics/ingest/batches/unknown", headers=headers).status_code == 404
+
+        # Commit records are pruned once no claim can be replayed; a claim older than
+        # that is failed rather than replayed.
+        r = client.post("/metrics/ingest/batches", headers=headers, json=[point])
+        stale = spool.claim("lost", 100)[0][0]
+        spool._transaction([("UPDATE ingest_batches SET claimed_at = ? WHERE batch_id = ?", (time.time() - spool.retention_seconds - 1, stale))])
+        assert writer.flush() == 0
+        assert client.get(f"/metrics/ingest/batches/{stale}", headers=headers).json()["status"] == "failed"
+        with SessionLocal() as db:
+            old = datetime.utcnow() - timedelta(seconds=spool.retention_seconds + spool.lease_seconds + 1)
+            db.query(IngestBatch).filter(IngestBatch.id == batch_ids[0]).update({"committed_at": old})
+            db.commit()
+        assert writer.prune() == 1
+        with SessionLocal() as db:
+            kept = {row.id for row in db.query(IngestBatch)}
+        assert batch_ids[0] not in kept and set(batch_ids[1:]) <= kept
+    finally:
+        settings.INGEST_QUEUE_PATH = None
+        ingest_queue.get_ingest_spool.cache_clear()
+        ingest_queue.get_ingest_writer.cache_clear()
+
+
+def test_anomalies_flag_breaches_spikes_and_drift():
+    import random
+    import numpy as np
+    from datetime import datetime, timedelta
+    from app.db import SessionLocal
+    from app.services.anomalies import _history_statement, series_statistics, stats_cache
+
+    # Vectorized statistics against a straightforward per-series computation.
+    rng = random.Random(7)
+    series = {sid: [rng.gauss(10 * sid, 1 + sid) for _ in range(rng.randint(1, 60))] for sid in range(1, 30)}
+    ids = np.array([sid for sid, values in series.items() for _ in values])
+    flat = np.array([v for values in series.values() for v in values])
+    stats = series_statistics(ids, flat, window=10, alpha=0.3, min_points=5)
+    for i, (sid, values) in enumerate(series.items()):
+        assert stats["series_id"][i] == sid and stats["points"][i] == len(values)
+        if len(values) < 5:
+            assert np.isnan(stats["zscore"][i]) and np.isnan(stats["drift_score"][i])
+            continue
+        recent = values[-11:-1]
+        mean = sum(recent) / len(recent)
+        std = (sum((v - mean) ** 2 for v in recent) / (len(recent) - 1)) ** 0.5
+        assert abs(stats["zscore"][i] - (values[-1] - mean) / std) < 1e-6
+        weights = [0.7 ** (len(values) - 1 - k) for k in range(len(values))]
+        ewma = sum(w * v for w, v in zip(weights, values)) / sum(weights)
+        overall = sum(values) / len(values)
+        overall_std = (sum((v - overall) ** 2 for v in values) / (len(values) - 1)) ** 0.5
+        factor = sum(w * w for w in weights) / sum(weights) ** 2
+        assert abs(stats["drift_score"][i] - (ewma - overall) / (overall_std * factor ** 0.5)) < 1e-6
+
+    token = admin_token()
+    headers = auth_headers(token)
+    dataset_id = client.post("/datasets", headers=headers, json={"key": "anomaly_ds", "name": "Anomalies"}).json()["id"]
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=1)
+    steady = [0.95 + 0.01 * ((i * 7) % 5) for i in range(40)]
+    histories = {
+        "steady": steady,
+        "spike": steady[:-1] + [0.2],
+        "drifting": steady[:30] + [0.9 - 0.002 * i for i in range(10)],
+        "ruled": [0.5 + 0.01 * (i % 3) for i in range(40)],
+    }
+    points = [
+        {"dataset_id": dataset_id, "dimension": "accuracy", "metric_name": name, "metric_value": value,
+         "recorded_at": (start + timedelta(minutes=i)).isoformat()}
+        for name, values in histories.items()
+        for i, value in enumerate(values)
+    ]
+    client.post("/metrics/ingest", headers=headers, params={"echo": False}, json=points)
+    r = client.post("/rules", headers=headers, json={
+        "dataset_id": dataset_id, "name": "ruled", "dimension": "accuracy", "sql_query": "SELECT 1", "threshold_min": 0.51,
+    })
+    assert r.status_code in (200, 201), r.text
+
+    r = client.get("/metrics/anomalies", headers=headers, params={"dataset_ids": str(dataset_id)})
+    assert r.status_code == 200, r.text
+    flagged = {row["metric_name"]: row for row in r.json()}
+    assert set(flagged) == {"spike", "drifting", "ruled"}
+    assert "zscore" in flagged["spike"]["anomalies"] and flagged["spike"]["zscore"] < -3
+    assert "drift" in flagged["drifting"]["anomalies"]
+    assert flagged["ruled"]["breach"] == "below_min" and flagged["ruled"]["breach_points"] == 14
+    assert flagged["ruled"]["threshold_min"] == 0.51
+    everything = client.get("/metrics/anomalies", headers=headers, params={"dataset_ids": str(dataset_id), "include_ok": True}).json()
+    assert {row["metric_name"]: row["anomalies"] for row in everything}["steady"] == []
+
+    # History is the latest N points of each series, oldest first.
+    with SessionLocal() as db:
+        dialect = db.get_bind().dialect.name
+        rows = db.execute(_history_statement(dialect, [dataset_id], 5)).all()
+    by_series = {}
+    for series_id, recorded_at, value in rows:
+        by_series.setdefault(series_id, []).append((recorded_at, value))
+    assert sorted([v for _, v in points] for points in by_series.values()) == sorted(values[-5:] for values in histories.values())
+    assert all(points == sorted(points) for points in by_series.values())
+
+    # Unchanged data is answered from the cache; new points are picked up.
+    hits = stats_cache.hits
+    client.get("/metrics/anomalies", headers=headers, params={"dataset_ids": str(dataset_id)})
+    assert stats_cache.hits == hits + 1
+    recovered = {"dataset_id": dataset_id, "dimension": "accuracy", "metric_name": "ruled", "metric_value": 0.52,
+                 "recorded_at": (start + timedelta(minutes=40)).isoformat()}
+    client.post("/metrics/ingest", headers=headers, params={"echo": False}, json=[recovered])
+    flagged = {row["metric_name"]: row for row in client.get("/metrics/anomalies", headers=headers, params={"dataset_ids": str(dataset_id)}).json()}
+    assert "ruled" not in flagged
+
+    # Only datasets the caller can see are scanned.
+    r = client.post("/users", headers=headers, json={"email": "anomaly_viewer@example.com", "password": "viewer123", "dataset_ids": []})
+    assert r.status_code == 200, r.text
+    viewer = client.post("/auth/login", json={"email": "anomaly_viewer@example.com", "password": "viewer123"}).json()["access_token"]
+    assert client.get("/metrics/anomalies", headers=auth_headers(viewer)).json() == []
+    assert client.get("/metrics/anomalies", headers=auth_headers(viewer), params={"dataset_ids": str(dataset_id)}).status_code == 403
+
+
+def test_telemetry_metrics_query_warnings_and_profiles(tmp_path):
+    import logging
+    from app.core.config import get_settings
+
+    token = admin_token()
+    headers = auth_headers(token)
+    dataset_id = client.post("/datasets", headers=headers, json={"key": "telemetry_ds", "name": "Telemetry"}).json()["id"]
+    assert client.get("/metrics/latest", headers=headers, params={"dataset_id": dataset_id}).status_code == 200
+
+    r = client.get("/system/metrics", headers=headers)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    body = r.text
+    assert 'dq_http_request_duration_seconds_count{method="GET",route="/metrics/latest",status="200"}' in body
+    assert 'dq_http_request_duration_seconds_bucket{method="GET",route="/metrics/latest",status="200",le="+Inf"}' in body
+    statements = [line for line in body.splitlines() if line.startswith('dq_http_request_sql_statements_sum{method="GET",route="/metrics/latest"}')]
+    assert statements and float(statements[0].split()[-1]) > 0
+    assert 'dq_sql_statements_total{context="request"}' in body
+    assert 'dq_db_pool_checkout_seconds_count{engine="primary"}' in body or 'dq_db_pool_checkout_seconds_count{engine="async"}' in body
+    assert 'dq_cache_hits_total{cache="http_responses"}' in body
+
+    settings = get_settings()
+    r = client.post("/users", headers=headers, json={"email": "telemetry@example.com", "password": "password123", "dataset_ids": []})
+    assert r.status_code == 200, r.text
+    viewer = client.post("/auth/login", json={"email": "telemetry@example.com", "password": "password123"}).json()["access_token"]
+    assert client.get("/system/metrics", headers=auth_headers(viewer)).status_code == 403
+    settings.TELEMETRY_SCRAPE_TOKEN = "scrape-secret"
+    try:
+        assert client.get("/system/metrics", headers=auth_headers("scrape-secret")).status_code == 200
+        assert client.get("/system/metrics").status_code == 401
+    finally:
+        settings.TELEMETRY_SCRAPE_TOKEN = None
+
+    class Collect(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    collect = Collect()
+    telemetry_logger = logging.getLogger("app.core.telemetry")
+    telemetry_logger.addHandler(collect)
+    settings.TELEMETRY_QUERY_WARN_THRESHOLD = 1
+    settings.PROFILE_SLOW_REQUEST_MS = 0.001
+    settings.PROFILE_INTERVAL_MS = 1
+    settings.PROFILE_DIR = str(tmp_path)
+    try:
+        points = [
+            {"dataset_id": dataset_id, "dimension": "accuracy", "metric_name": f"m{i % 50}", "metric_value": i}
+            for i in range(3000)
+        ]
+        assert client.post("/metrics/ingest", headers=headers, params={"echo": False}, json=points).status_code == 200
+    finally:
+        settings.TELEMETRY_QUERY_WARN_THRESHOLD = 50
+        settings.PROFILE_SLOW_REQUEST_MS = 0
+        settings.PROFILE_INTERVAL_MS = 5
+        settings.PROFILE_DIR = "profiles"
+        telemetry_logger.removeHandler(collect)
+    assert any("POST /metrics/ingest ran" in message and "N+1" in message for message in collect.messages)
+    profiles = list(tmp_path.glob("*-POST-metrics_ingest-*.folded"))
+    assert len(profiles) == 1
+    lines = profiles[0].read_text().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_generate_data_builds_acls_and_history():
+    from datetime import datetime
+    from app.db import SessionLocal, engine as app_engine
+    from app.generate_data import GenerateOptions, generate
+
+    options = GenerateOptions(
+        datasets=3, users=4, datasets_per_user=2, series_per_dataset=6, days=2, cadences=(900, 3600), prefix="gen", chunk_rows=500
+    )
+    with SessionLocal() as db:
+        manifest = generate(app_engine, db, options, now=datetime(2026, 1, 1))
+    assert manifest["datasets"] == 3 and manifest["users"] == 4 and manifest["series"] == 18
+    # 2 days of 15-minute or hourly points per series.
+    assert 18 * 48 <= manifest["rows"] <= 18 * 192
+    assert manifest["latest_series"] >= 18
+
+    token = client.post("/auth/login", json={"email": "gen_user_00000@example.com", "password": "loadtest123"}).json()["access_token"]
+    visible = [ds["id"] for ds in client.get("/datasets", headers=auth_headers(token)).json()]
+    assert len(visible) == 2 and set(visible) <= set(manifest["dataset_ids"])
+    latest = client.get("/metrics/latest", headers=auth_headers(token), params={"dataset_id": visible[0]}).json()
+    assert latest and all(0.0 <= d["latest_value"] <= 1.0 for d in latest if d["latest_value"] is not None)
+    series = client.get("/metrics/timeseries", headers=auth_headers(token), params={"dataset_id": visible[0]}).json()
+    assert len(series) == 6
+    for s in series:
+        stamps = [p["recorded_at"] for p in s["points"]]
+        assert stamps == sorted(stamps) and stamps[-1] < "2026-01-01T00:00"
+    hidden = next(ds_id for ds_id in manifest["dataset_ids"] if ds_id not in visible)
+    assert client.get("/metrics/latest", headers=auth_headers(token), params={"dataset_id": hidden}).status_code == 403
+
+
+def test_pool_settings_pings_and_statement_timeout(tmp_path):
+    import time
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+    from app.core import pooling
+    from app.core.config import get_settings
+
+    headers = auth_headers(admin_token())
+    stats = client.get("/system/db-pool", headers=headers).json()
+    assert "primary" in stats
+    body = client.get("/system/metrics", headers=headers).text
+    assert 'dq_db_pool_pings_total{engine="primary"}' in body
+    if stats["primary"]["pool"] == "QueuePool":
+        assert 'dq_db_pool_size{engine="primary"} 5' in body and 'dq_db_pool_utilization{engine="primary"}' in body
+
+    settings = get_settings()
+    settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW = 2, 1
+    settings.DB_POOL_PING_IDLE_SECONDS = 0
+    settings.DB_STATEMENT_TIMEOUT_MS = 200
+    url = f"sqlite+pysqlite:///{tmp_path / 'pool.db'}"
+    try:
+        options = pooling.engine_options(url)
+        assert options["pool_size"] == 2 and options["max_overflow"] == 1 and not options["pool_pre_ping"]
+        engine = create_engine(url, **options)
+        pooling.install_pool_hooks(engine, "pool_test")
+        for _ in range(3):
+            with engine.connect() as conn:
+                assert conn.execute(text("SELECT 1")).scalar() == 1
+        # The first checkout is a fresh connection; the next two were idle past the limit.
+        assert pooling.pool_stats()["pool_test"]["pings"] == 2
+        with engine.connect() as conn:
+            long_query = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n"
+            started = time.perf_counter()
+            try:
+                conn.execute(text(long_query))
+                raise AssertionError("statement was not interrupted")
+            except OperationalError as exc:
+                assert "interrupted" in str(exc)
+            assert time.perf_counter() - started < 5
+            assert conn.execute(text("SELECT 2")).scalar() == 2
+            # The deadline ends with the statement: raw DBAPI work on the connection later is not cut off.
+            assert "statement_deadline" not in conn.connection.info
+            time.sleep(0.25)
+            cursor = conn.connection.driver_connection.cursor()
+            cursor.execute("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 300000) SELECT count(*) FROM n")
+            assert cursor.fetchone()[0] == 300000
+        stats = pooling.pool_stats()["pool_test"]
+        assert stats["size"] == 2 and stats["checked_out"] == 0 and stats["utilization"] == 0
+
+        settings.DB_PGBOUNCER = True
+        connect_args = pooling.engine_options("postgresql+asyncpg://u:p@h/db", is_async=True)["connect_args"]
+        assert connect_args["statement_cache_size"] == 0 and connect_args["prepared_statement_cache_size"] == 0
+        assert connect_args["prepared_statement_name_func"]() != connect_args["prepared_statement_name_func"]()
+        assert "connect_args" not in pooling.engine_options("postgresql+psycopg2://u:p@h/db")
+        settings.DB_PGBOUNCER = False
+        assert pooling.engine_options("postgresql+psycopg2://u:p@h/db")["connect_args"] == {"options": "-c statement_timeout=200"}
+        settings.DB_POOL_SIZE = 0
+        assert pooling.engine_options(url)["poolclass"].__name__ == "NullPool"
+        engine.dispose()
+    finally:
+        settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW = 5, 10
+        settings.DB_POOL_PING_IDLE_SECONDS = 30
+        settings.DB_STATEMENT_TIMEOUT_MS = 0
+        settings.DB_PGBOUNCER = False
+        pooling._engines.pop("pool_test", None)
+        pooling._counters.pop("pool_test", None)
+
+
+def test_read_replicas_round_robin_health_and_read_your_writes(tmp_path):
+    import sqlite3
+    import time
+    from app import db as app_db
+    from app import deps
+    from app.core import pooling
+    from app.core.config import get_settings
+
+    headers = auth_headers(admin_token())
+    dataset_id = client.post("/datasets", headers=headers, json={"key": "replica_ds", "name": "Replica"}).json()["id"]
+    r = client.post("/users", headers=headers, json={"email": "replica@example.com", "password": "password123", "dataset_ids": [dataset_id]})
+    assert r.status_code == 200, r.text
+    viewer_id = r.json()["id"]
+    viewer = auth_headers(client.post("/auth/login", json={"email": "replica@example.com", "password": "password123"}).json()["access_token"])
+    point = {"dataset_id": dataset_id, "dimension": "accuracy", "metric_name": "match_rate"}
+    assert client.post("/metrics/ingest", headers=headers, json=[dict(point, metric_value=0.1)]).status_code == 200
+
+    # Two replicas frozen at this point, and one that cannot be reached.
+    urls = []
+    source = sqlite3.connect(app_db.engine.url.database)
+    for name in ("replica_a.db", "replica_b.db"):
+        target = sqlite3.connect(tmp_path / name)
+        source.backup(target)
+        target.close()
+        urls.append(f"sqlite+pysqlite:///{tmp_path / name}")
+    source.close()
+    urls.append(f"sqlite+pysqlite:///{tmp_path / 'missing' / 'replica.db'}")
+
+    settings = get_settings()
+    settings.DB_READ_REPLICA_URLS = urls
+    app_db.get_replica_router.cache_clear()
+    router = app_db.get_replica_router()
+    try:
+        # Health checks run on the router's own thread; wait for its first pass.
+        deadline = time.monotonic() + 10
+        while any(replica.checked_at is None for replica in router.replicas) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        r = client.post("/metrics/ingest", headers=headers, json=[dict(point, metric_value=0.9)])
+        assert r.status_code == 200
+        written = dict(headers, **{"X-Read-After": r.headers["X-Read-After"]})
+
+        def latest(hdrs):
+            r = client.get("/metrics/latest", headers=hdrs, params={"dataset_id": dataset_id})
+            assert r.status_code == 200, r.text
+            return next(d["latest_value"] for d in r.json() if d["dimension"] == "accuracy")
+
+        # Reads use the replicas' snapshot unless they carry the write's token (from any
+        # worker) or ask for the primary; an expired token no longer pins.
+        assert latest(viewer) == 0.1 and latest(headers) == 0.1
+        assert latest(written) == 0.9
+        assert latest(dict(viewer, **{"X-Read-Consistency": "primary"})) == 0.9
+        assert latest(dict(headers, **{"X-Read-After": str(time.time() - 60)})) == 0.1
+        # What a replica returned is never cached, so it cannot outlive an invalidation.
+        deps.invalidate_dataset_access()
+        deps.invalidate_active_datasets()
+        assert [d["id"] for d in client.get("/datasets", headers=viewer).json()] == [dataset_id]
+        assert deps.acl_cache.get(viewer_id) is None and deps.active_datasets_cache.get("active") is None
+
+        stats = client.get("/system/replicas", headers=headers).json()
+        assert stats["primary_reads"] == 2
+        by_label = {replica["label"]: replica for replica in stats["replicas"]}
+        assert by_label["replica-0"]["healthy"] and by_label["replica-1"]["healthy"]
+        assert by_label["replica-0"]["reads"] + by_label["replica-1"]["reads"] == 4
+        assert min(by_label["replica-0"]["reads"], by_label["replica-1"]["reads"]) >= 1
+        assert not by_label["replica-2"]["healthy"] and by_label["replica-2"]["failures"] >= 1
+        assert client.get("/system/replicas", headers=viewer).status_code == 403
+    finally:
+        router.stop()
+        for replica in router.replicas:
+            replica.engine.dispose()
+        settings.DB_READ_REPLICA_URLS = []
+        app_db.get_replica_router.cache_clear()
+        app_db._async_replica_engine.cache_clear()
+        for i in range(len(urls)):
+            pooling._engines.pop(f"replica-{i}", None)
+            pooling._engines.pop(f"replica-{i}-async", None)
+    assert client.get("/system/replicas", headers=headers).json() == {"enabled": False}
+
+
 if __name__ == "__main__":
     test_flow()
+    test_bulk_ingest_without_echo()
+    test_stream_ingest_ndjson_and_csv()
+    test_latest_overview()
+    test_latest_table_ignores_backfilled_points()
+    test_timeseries_bucketing_and_downsampling()
+    test_export_pagination_and_stream()
+    test_principal_cache_invalidated_on_update()
+    test_dataset_acl_cache_follows_access_updates()
+    test_async_routers_match_sync()
+    test_login_rehashes_outdated_password_hash()
+    test_rule_engine_records_results()
+    test_fused_checks_match_individual_runs()
+    test_incremental_rules_match_full_recompute()
+    import tempfile, pathlib
+    test_rule_result_cache_reuses_unchanged_results(pathlib.Path(tempfile.mkdtemp()))
+    test_rollups_and_retention_match_raw_series()
+    test_series_catalog_reuses_ids_and_survives_rollback()
+    test_conditional_gets_follow_dataset_versions()
+    test_live_push_after_commit_with_acl()
+    test_queued_ingest_coalesces_batches(pathlib.Path(tempfile.mkdtemp()))
+    test_anomalies_flag_breaches_spikes_and_drift()
+    test_telemetry_metrics_query_warnings_and_profiles(pathlib.Path(tempfile.mkdtemp()))
+    test_generate_data_builds_acls_and_history()
+    test_pool_settings_pings_and_statement_timeout(pathlib.Path(tempfile.mkdtemp()))
+    test_read_replicas_round_robin_health_and_read_your_writes(pathlib.Path(tempfile.mkdtemp()))
     print("Local validation passed.")
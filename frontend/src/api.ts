@@ -6,18 +6,78 @@ export const api = axios.create({
   baseURL: API_BASE,
 })
 
+// Commit time of this tab's last write; sending it back keeps the following reads on
+// the primary database until replicas have caught up (see DB_READ_YOUR_WRITES_SECONDS).
+let readAfter: string | undefined
+
 api.interceptors.request.use((config) => {
   const token = localStorage.getItem('token')
+  config.headers = config.headers ?? {}
   if (token) {
-    config.headers = config.headers ?? {}
     config.headers['Authorization'] = `Bearer ${token}`
   }
+  if (readAfter) {
+    config.headers['X-Read-After'] = readAfter
+  }
   return config
 })
 
+api.interceptors.response.use((response) => {
+  const written = response.headers['x-read-after']
+  if (written) readAfter = written
+  return response
+})
+
 export type Dimension = 'completeness' | 'timeliness' | 'validity' | 'accuracy' | 'consistency'
 
 export interface Dataset { id: number; key: string; name: string; description?: string }
 export interface DimensionSummary { dimension: Dimension; latest_value?: number | null; latest_at?: string | null }
 export interface TimeseriesPoint { recorded_at: string; value: number }
 export interface Timeseries { metric_name: string; points: TimeseriesPoint[] }
+
+export interface LivePoint { dimension: Dimension; metric_name: string; metric_value: number; recorded_at: string }
+export type LiveMessage =
+  | { type: 'subscribed'; dataset_ids: number[] }
+  | { type: 'metrics'; dataset_id: number; inserted: number; truncated: boolean; points: LivePoint[]; latest: DimensionSummary[] }
+  | { type: 'changed'; dataset_id: number; inserted: number }
+  | { type: 'ping' }
+  | { type: 'resync' }
+
+// Pushes committed ingests for the dataset; browsers cannot send headers on a
+// WebSocket, so the token travels as a query parameter. A dropped socket reconnects
+// with backoff, and once resubscribed the caller gets a resync to reload whatever
+// it missed meanwhile. Refused subscriptions (4401/4403) are not retried.
+export function subscribeLive(datasetId: number, onMessage: (message: LiveMessage) => void): () => void {
+  let socket: WebSocket | null = null
+  let retry: ReturnType<typeof setTimeout> | undefined
+  let attempts = 0
+  let stopped = false
+
+  const connect = () => {
+    const url = new URL('/metrics/live', API_BASE.replace(/^http/, 'ws'))
+    url.searchParams.set('dataset_id', String(datasetId))
+    const token = localStorage.getItem('token')
+    if (token) url.searchParams.set('token', token)
+    socket = new WebSocket(url)
+    socket.onmessage = (event) => {
+      const message: LiveMessage = JSON.parse(event.data)
+      onMessage(message)
+      if (message.type === 'subscribed') {
+        if (attempts > 0) onMessage({ type: 'resync' })
+        attempts = 0
+      }
+    }
+    socket.onclose = (event) => {
+      if (stopped || event.code === 4401 || event.code === 4403) return
+      retry = setTimeout(connect, Math.min(30000, 1000 * 2 ** Math.min(attempts, 5)))
+      attempts += 1
+    }
+  }
+
+  connect()
+  return () => {
+    stopped = true
+    clearTimeout(retry)
+    socket?.close()
+  }
+}
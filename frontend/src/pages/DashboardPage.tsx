@@ -1,6 +1,6 @@
 import React from 'react'
 import { Alert, Box, Card, CardContent, FormControl, InputLabel, MenuItem, Select, Stack, Typography } from '@mui/material'
-import { api, Dataset, DimensionSummary, Timeseries } from '../api'
+import { api, Dataset, DimensionSummary, LiveMessage, subscribeLive, Timeseries } from '../api'
 import { LineChart, Line, CartesianGrid, XAxis, YAxis, Tooltip, Legend, ResponsiveContainer } from 'recharts'
 
 const DashboardPage: React.FC = () => {
@@ -14,7 +14,7 @@ const DashboardPage: React.FC = () => {
     api.get('/datasets').then(r => setDatasets(r.data)).catch(e => setError(e?.response?.data?.detail || 'Failed to load datasets'))
   }, [])
 
-  React.useEffect(() => {
+  const load = React.useCallback(() => {
     if (!datasetId) return
     setError(null)
     Promise.all([
@@ -26,6 +26,30 @@ const DashboardPage: React.FC = () => {
     }).catch(e => setError(e?.response?.data?.detail || 'Failed to load metrics'))
   }, [datasetId])
 
+  React.useEffect(load, [load])
+
+  // New points arrive over the live socket instead of re-fetching.
+  React.useEffect(() => {
+    if (!datasetId) return
+    return subscribeLive(datasetId, (message: LiveMessage) => {
+      if (message.type === 'resync' || message.type === 'changed' || (message.type === 'metrics' && message.truncated)) {
+        load()
+      } else if (message.type === 'metrics') {
+        setSummary(message.latest)
+        setSeries(current => {
+          const byName = new Map((current ?? []).map(s => [s.metric_name, [...s.points]]))
+          for (const p of message.points) {
+            byName.set(p.metric_name, [...(byName.get(p.metric_name) ?? []), { recorded_at: p.recorded_at, value: p.metric_value }])
+          }
+          return Array.from(byName, ([metric_name, points]) => ({
+            metric_name,
+            points: points.sort((a, b) => a.recorded_at.localeCompare(b.recorded_at)),
+          }))
+        })
+      }
+    })
+  }, [datasetId, load])
+
   return (
     <Stack spacing={3}>
       <FormControl sx={{ minWidth: 240 }}>